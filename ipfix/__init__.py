@@ -19,7 +19,6 @@
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from __future__ import unicode_literals
 
 """
 IPFIX implementation for Python 3.3.
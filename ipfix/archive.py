@@ -0,0 +1,551 @@
+#
+# python-ipfix (c) 2013-2014 Brian Trammell.
+#
+# Many thanks to the mPlane consortium (http://www.ict-mplane.eu) for
+# its material support of this effort.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Seekable, block-compressed archives of IPFIX messages.
+
+An archive holds a sequence of blocks, each containing whole IPFIX messages
+compressed independently of the other blocks with zlib, bz2 or lzma. Each
+block starts with a checkpoint of the template records valid at its start,
+so every block can be decompressed and decoded on its own; a block index
+at the end of the archive records the position, message count and export
+time range of each block.
+
+Blocks are compressed and decompressed on a pool of threads by default
+(all three codecs release the GIL), or on any given
+:class:`concurrent.futures.Executor`. An :class:`ArchiveWriter` can be used
+as the stream of a :class:`ipfix.writer.MessageStreamWriter`:
+
+>>> import io
+>>> import ipfix.archive
+>>> import ipfix.ie
+>>> import ipfix.testutils
+>>> f = io.BytesIO()
+>>> with ipfix.archive.to_stream(f, codec="zlib", block_size=4096) as w:
+...     ipfix.testutils.mktest_file(w, msg_count=64)
+>>> ielist = ipfix.ie.spec_list(["packetDeltaCount"])
+>>> with ipfix.archive.from_stream(f) as r:
+...     print(len(r.blocks) > 1, len(list(r.tuple_iterator(ielist))))
+True 1024
+
+"""
+
+
+from . import types, template, message
+from .template import IpfixDecodeError
+
+import collections
+import struct
+import zlib
+import bz2
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from concurrent.futures import ThreadPoolExecutor
+
+_archdr_st = struct.Struct("!8sHB")
+_blkhdr_st = struct.Struct("!4sLLLLLL")
+_idxent_st = struct.Struct("!QLLLLLL")
+_idxhdr_st = struct.Struct("!4sL")
+_footer_st = struct.Struct("!Q8s")
+_cprec_st = struct.Struct("!LHH")
+
+_arcmagic = b"IPFIXBLK"
+_arcversion = 1
+_blkmagic = b"IBLK"
+_idxmagic = b"IIDX"
+_endmagic = b"IPFIXEND"
+
+_codec_ids = {"zlib": 1, "bz2": 2, "lzma": 3}
+_codec_names = dict((v, k) for (k, v) in _codec_ids.items())
+
+def _compress(codec, level, data):
+    # module-level, so blocks can be compressed in worker processes
+    if codec == "zlib":
+        return zlib.compress(data, 6 if level is None else level)
+    elif codec == "bz2":
+        return bz2.compress(data, 9 if level is None else level)
+    elif codec == "lzma" and lzma:
+        if level is None:
+            return lzma.compress(data)
+        return lzma.compress(data, preset=level)
+    raise ValueError("unsupported archive codec "+repr(codec))
+
+def _decompress(codec, data):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    elif codec == "bz2":
+        return bz2.decompress(data)
+    elif codec == "lzma" and lzma:
+        return lzma.decompress(data)
+    raise ValueError("unsupported archive codec "+repr(codec))
+
+def _encode_checkpoint(tmplrecs):
+    # serialize a map of (odid, tid) to (setid, template record)
+    return b"".join(_cprec_st.pack(odid, setid, len(rec)) + rec
+                    for ((odid, tid), (setid, rec)) in sorted(tmplrecs.items()))
+
+def _decode_checkpoint(buf, policy):
+    # deserialize a checkpoint into a map of (odid, tid) to Template
+    templates = {}
+    offset = 0
+    while offset < len(buf):
+        (odid, setid, length) = _cprec_st.unpack_from(buf, offset)
+        offset += _cprec_st.size
+        tmpl = template.decode_template_from(buf[offset:offset+length], 0,
+                                             setid, policy)[0]
+        templates[(odid, tmpl.tid)] = tmpl
+        offset += length
+    return templates
+
+class ArchiveBlock(object):
+    """
+    Describes a block in an archive; an entry in the block index.
+
+    """
+    def __init__(self, offset, clen, ulen, msgcount,
+                 first_epoch, last_epoch, cplen):
+        self.offset = offset
+        self.clen = clen
+        self.ulen = ulen
+        self.msgcount = msgcount
+        self.first_epoch = first_epoch
+        self.last_epoch = last_epoch
+        self.cplen = cplen
+
+    def __repr__(self):
+        return "<ArchiveBlock at "+str(self.offset)+" "+ \
+               str(self.msgcount)+" messages>"
+
+class ArchiveWriter(object):
+    """
+    Writes IPFIX messages to a block-compressed archive.
+    Use :func:`to_stream` to get an instance.
+
+    Messages are collected into blocks of about block_size bytes, which are
+    compressed on the executor while further messages are written. The
+    archive is complete once :meth:`close` has written the block index; an
+    archive without an index can still be read, block by block.
+
+    """
+    def __init__(self, stream, codec="zlib", level=None,
+                 block_size=1048576, executor=None):
+        if codec not in _codec_ids or (codec == "lzma" and lzma is None):
+            raise ValueError("unsupported archive codec "+repr(codec))
+
+        self.stream = stream
+        self.codec = codec
+        self.level = level
+        self.block_size = block_size
+
+        if executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=4)
+            self.own_executor = True
+        else:
+            self.executor = executor
+            self.own_executor = False
+
+        self.blocks = []
+        self.pending = collections.deque()
+        self.max_pending = 8
+
+        # template records valid at the current position
+        self.tmplrecs = {}
+        self._start_block()
+
+        self.stream.write(_archdr_st.pack(_arcmagic, _arcversion,
+                                          _codec_ids[codec]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _start_block(self):
+        self.blockbuf = bytearray()
+        self.checkpoint = _encode_checkpoint(self.tmplrecs)
+        self.msgcount = 0
+        self.first_epoch = None
+        self.last_epoch = 0
+
+    def _track_templates(self, buf):
+        # note the template records defined or withdrawn in a message
+        odid = message._msghdr_st.unpack_from(buf, 0)[4]
+        length = message._msghdr_st.unpack_from(buf, 0)[1]
+        offset = message._msghdr_st.size
+        while offset < length:
+            (setid, setlen) = message._sethdr_st.unpack_from(buf, offset)
+            if setlen < message._sethdr_st.size:
+                raise IpfixDecodeError("Illegal set length in message")
+            if setid in (template.TEMPLATE_SET_ID, template.OPTIONS_SET_ID):
+                for (tid, start, end) in template._template_records(buf,
+                        offset + message._sethdr_st.size, offset + setlen,
+                        setid):
+                    if template._tmplhdr_st.unpack_from(buf, start)[1]:
+                        self.tmplrecs[(odid, tid)] = (setid,
+                                                      bytes(buf[start:end]))
+                    else:
+                        # template withdrawal: no fields
+                        self.tmplrecs.pop((odid, tid), None)
+            offset += setlen
+
+    def write_message(self, msgbytes):
+        """
+        Write a complete IPFIX message to the archive.
+
+        :param msgbytes: the message, as bytes or any buffer
+
+        """
+        buf = memoryview(msgbytes)
+        (version, length, epoch) = \
+                message._msghdr_st.unpack_from(buf, 0)[0:3]
+        if version != 10 or length != len(buf):
+            raise IpfixDecodeError("archive messages must be whole "+
+                                   "IPFIX messages")
+
+        self.blockbuf += buf
+        self.msgcount += 1
+        # messages need not arrive in export time order
+        if self.first_epoch is None:
+            self.first_epoch = epoch
+        else:
+            self.first_epoch = min(self.first_epoch, epoch)
+        self.last_epoch = max(self.last_epoch, epoch)
+        self._track_templates(buf)
+
+        if len(self.blockbuf) >= self.block_size:
+            self._flush_block()
+
+    def write(self, msgbytes):
+        """
+        Write a complete IPFIX message to the archive;
+        see :meth:`write_message`. Allows an ArchiveWriter to be used as the
+        stream of a :class:`ipfix.writer.MessageStreamWriter`, or with
+        :meth:`ipfix.message.MessageBuffer.write_message`.
+
+        """
+        self.write_message(msgbytes)
+
+    def _flush_block(self):
+        if not self.msgcount:
+            return
+        future = self.executor.submit(_compress, self.codec, self.level,
+                                      bytes(self.blockbuf))
+        self.pending.append((future, len(self.blockbuf), self.msgcount,
+                             self.first_epoch, self.last_epoch,
+                             self.checkpoint))
+        self._start_block()
+        while len(self.pending) > self.max_pending:
+            self._write_block()
+
+    def _write_block(self):
+        # write the oldest pending block, waiting for its compression
+        (future, ulen, msgcount, first_epoch, last_epoch,
+         checkpoint) = self.pending.popleft()
+        data = future.result()
+        block = ArchiveBlock(self.stream.tell(), len(data), ulen, msgcount,
+                             first_epoch, last_epoch, len(checkpoint))
+        self.stream.write(_blkhdr_st.pack(_blkmagic, block.clen, block.ulen,
+                                          block.msgcount, block.first_epoch,
+                                          block.last_epoch, block.cplen))
+        self.stream.write(checkpoint)
+        self.stream.write(data)
+        self.blocks.append(block)
+
+    def flush(self):
+        """
+        Compress and write the current block, even if it is not full.
+
+        """
+        self._flush_block()
+        while self.pending:
+            self._write_block()
+
+    def close(self):
+        """
+        Write all pending blocks and the block index, completing the
+        archive. Does not close the underlying stream.
+
+        """
+        if self.stream is None:
+            return
+        self.flush()
+
+        idxoff = self.stream.tell()
+        self.stream.write(_idxhdr_st.pack(_idxmagic, len(self.blocks)))
+        for block in self.blocks:
+            self.stream.write(_idxent_st.pack(block.offset, block.clen,
+                                              block.ulen, block.msgcount,
+                                              block.first_epoch,
+                                              block.last_epoch, block.cplen))
+        self.stream.write(_footer_st.pack(idxoff, _endmagic))
+
+        if self.own_executor:
+            self.executor.shutdown()
+        self.stream = None
+
+class ArchiveReader(object):
+    """
+    Reads records from a block-compressed archive, with random access to
+    blocks. Use :func:`from_stream` to get an instance.
+
+    Blocks are decompressed ahead of decoding on the executor. Records are
+    decoded according to the given :class:`ipfix.types.DecodePolicy`, if
+    any. Call :meth:`close`, or use the reader as a context manager, to
+    shut down the reader's own pool of threads.
+
+    """
+    def __init__(self, stream, policy=None, executor=None, readahead=4):
+        self.stream = stream
+        self.policy = policy
+        self.readahead = readahead
+        self.msg = message.MessageBuffer(policy=policy)
+
+        self.own_executor = False
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=readahead)
+            self.own_executor = True
+        self.executor = executor
+
+        stream.seek(0)
+        hdr = stream.read(_archdr_st.size)
+        if len(hdr) < _archdr_st.size:
+            raise IpfixDecodeError("Short read in archive header")
+        (magic, version, codec_id) = _archdr_st.unpack(hdr)
+        if magic != _arcmagic or version != _arcversion:
+            raise IpfixDecodeError("Not an IPFIX archive, or unsupported "+
+                                   "archive version")
+        try:
+            self.codec = _codec_names[codec_id]
+        except KeyError:
+            raise IpfixDecodeError("Unsupported archive codec "+str(codec_id))
+
+        self.blocks = self._read_index()
+        if self.blocks is None:
+            self.blocks = self._scan_blocks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Close the reader, shutting down its executor if it created one.
+        Does not close the underlying stream.
+
+        """
+        if self.own_executor:
+            self.executor.shutdown()
+            self.own_executor = False
+        self.executor = None
+
+    def _read_index(self):
+        # read the block index at the end of the archive, if present
+        self.stream.seek(0, 2)
+        end = self.stream.tell()
+        if end < _archdr_st.size + _footer_st.size:
+            return None
+        self.stream.seek(end - _footer_st.size)
+        (idxoff, magic) = _footer_st.unpack(self.stream.read(_footer_st.size))
+        if magic != _endmagic:
+            return None
+
+        self.stream.seek(idxoff)
+        (magic, count) = _idxhdr_st.unpack(self.stream.read(_idxhdr_st.size))
+        if magic != _idxmagic:
+            return None
+        return [ArchiveBlock(*_idxent_st.unpack(
+                                    self.stream.read(_idxent_st.size)))
+                for i in range(count)]
+
+    def _scan_blocks(self):
+        # rebuild the block index from block headers, e.g. for an archive
+        # whose writer was not closed; a truncated last block is dropped
+        self.stream.seek(0, 2)
+        end = self.stream.tell()
+        blocks = []
+        offset = _archdr_st.size
+        while offset + _blkhdr_st.size <= end:
+            self.stream.seek(offset)
+            (magic, clen, ulen, msgcount, first_epoch, last_epoch, cplen) = \
+                    _blkhdr_st.unpack(self.stream.read(_blkhdr_st.size))
+            if magic != _blkmagic:
+                break
+            block = ArchiveBlock(offset, clen, ulen, msgcount,
+                                 first_epoch, last_epoch, cplen)
+            offset += _blkhdr_st.size + cplen + clen
+            if offset > end:
+                break
+            blocks.append(block)
+        return blocks
+
+    def _read_block(self, block):
+        # read a block's checkpoint and compressed data
+        self.stream.seek(block.offset + _blkhdr_st.size)
+        checkpoint = self.stream.read(block.cplen)
+        data = self.stream.read(block.clen)
+        if len(data) < block.clen:
+            raise IpfixDecodeError("Short read in archive block")
+        return (checkpoint, data)
+
+    def blocks_between(self, start=None, end=None):
+        """
+        Get the numbers of the blocks containing messages exported in a
+        time range.
+
+        :param start: earliest export time, as a datetime, or None
+        :param end: export time after the range, as a datetime, or None
+        :returns: a list of block numbers, in archive order
+
+        """
+        lo = 0 if start is None else types._encode_sec(start)
+        hi = 2**32 if end is None else types._encode_sec(end)
+        return [i for (i, b) in enumerate(self.blocks)
+                if b.first_epoch < hi and b.last_epoch >= lo]
+
+    def block_iterator(self, blocknums=None):
+        """
+        Iterate over decompressed blocks, decompressing up to readahead
+        blocks ahead on the executor.
+
+        :param blocknums: block numbers to read, or None for all blocks
+        :returns: an iterator over (templates, data) for each block, where
+                  templates maps (odid, tid) to the templates valid at the
+                  start of the block, and data contains its messages.
+
+        """
+        if blocknums is None:
+            blocknums = range(len(self.blocks))
+
+        pending = collections.deque()
+        blocknums = iter(blocknums)
+        while True:
+            for blocknum in blocknums:
+                (checkpoint, data) = self._read_block(self.blocks[blocknum])
+                if self.executor is None:
+                    pending.append((checkpoint, None, data))
+                else:
+                    pending.append((checkpoint, self.executor.submit(
+                                        _decompress, self.codec, data), None))
+                if len(pending) >= self.readahead:
+                    break
+            if not pending:
+                return
+
+            (checkpoint, future, data) = pending.popleft()
+            if future is None:
+                data = _decompress(self.codec, data)
+            else:
+                data = future.result()
+            yield (_decode_checkpoint(memoryview(checkpoint), self.policy),
+                   data)
+
+    def message_iterator(self, blocknums=None):
+        """
+        Iterate over the messages in the given blocks.
+
+        :param blocknums: block numbers to read, or None for all blocks
+        :returns: an iterator over the reader's
+                  :class:`ipfix.message.MessageBuffer`, holding each message
+                  in turn
+
+        """
+        msg = self.msg
+        for (templates, data) in self.block_iterator(blocknums):
+            msg.set_templates(templates)
+            buf = memoryview(data)
+            offset = 0
+            while offset < len(buf):
+                msg.from_buffer(buf[offset:])
+                offset += msg.length
+                yield msg
+
+    def namedict_iterator(self, start=None, end=None, recfilter=None):
+        """
+        Iterate over all records in blocks containing messages exported in
+        the given time range, as dicts mapping IE names to values.
+
+        :param start: earliest export time, as a datetime, or None
+        :param end: export time after the range, as a datetime, or None
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
+        :returns: a name dictionary iterator
+
+        """
+        for msg in self.message_iterator(self.blocks_between(start, end)):
+            for rec in msg.namedict_iterator(recfilter):
+                yield rec
+
+    def tuple_iterator(self, ielist, start=None, end=None, recfilter=None):
+        """
+        Iterate over all records in blocks containing messages exported in
+        the given time range, containing all the IEs in the given ielist.
+        Records are returned as tuples in ielist order.
+
+        :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
+                       listing IEs to return as a tuple
+        :param start: earliest export time, as a datetime, or None
+        :param end: export time after the range, as a datetime, or None
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
+        :returns: a tuple iterator for tuples in ielist order
+
+        """
+        for msg in self.message_iterator(self.blocks_between(start, end)):
+            for rec in msg.tuple_iterator(ielist, recfilter):
+                yield rec
+
+def to_stream(stream, codec="zlib", level=None, block_size=1048576,
+              executor=None):
+    """
+    Get an ArchiveWriter for a given stream
+
+    :param stream: seekable binary stream to write the archive to
+    :param codec: "zlib", "bz2" or "lzma"
+    :param level: compression level or preset for the codec, or None for
+                  the codec's default
+    :param block_size: approximate size of uncompressed blocks in bytes
+    :param executor: :class:`concurrent.futures.Executor` to compress
+                     blocks on; by default, a pool of threads
+    :return: an :class:`ArchiveWriter` writing to the stream
+
+    """
+    return ArchiveWriter(stream, codec, level, block_size, executor)
+
+def from_stream(stream, policy=None, executor=None, readahead=4):
+    """
+    Get an ArchiveReader for a given stream
+
+    :param stream: seekable binary stream containing an archive
+    :param policy: :class:`ipfix.types.DecodePolicy` for decoding records,
+                   or None for the default representations
+    :param executor: :class:`concurrent.futures.Executor` to decompress
+                     blocks on; by default, a pool of threads
+    :param readahead: number of blocks to decompress ahead of decoding
+    :return: an :class:`ArchiveReader` for the archive
+
+    """
+    return ArchiveReader(stream, policy, executor, readahead)
@@ -0,0 +1,983 @@
+#
+# python-ipfix (c) 2013-2014 Brian Trammell.
+#
+# Many thanks to the mPlane consortium (http://www.ict-mplane.eu) for
+# its material support of this effort.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Collecting processes for IPFIX over TCP and UDP (see :rfc:`7011`), using
+asyncio.
+
+A :class:`TcpCollector` accepts connections from any number of Exporting
+Processes on a single event loop. Each connection is a transport session
+with its own :class:`CollectorSession`, holding the templates and the
+expected sequence number of each observation domain in the session, so
+templates from one exporter never apply to another.
+
+Records are delivered to a sink, a function (or coroutine function) taking
+the session and a list of records, called once per batch of records read
+from a session::
+
+    import asyncio
+    import ipfix.collector
+    import ipfix.ie
+
+    ipfix.ie.use_iana_default()
+    ielist = ipfix.ie.spec_list(["sourceIPv4Address", "octetDeltaCount"])
+
+    def sink(session, recs):
+        for rec in recs:
+            print(session.peer, rec)
+
+    c = ipfix.collector.for_tcp(sink, port=4739, ielist=ielist)
+    asyncio.run(c.serve_forever())
+
+Each session reads at most read_size bytes at a time, and does not read
+again until the sink has accepted the records decoded from them; a slow
+coroutine sink therefore pushes back on its exporter through TCP flow
+control, without affecting other sessions, and memory use per session is
+bounded.
+
+A :class:`UdpCollector` receives datagrams from any number of exporters on
+one socket, scoping templates to each exporter's address and observation
+domain, expiring templates that are not refreshed, and counting datagrams
+dropped by the kernel and by the collector. A :class:`UdpCollectorPool`
+runs UDP collectors on the same port in several processes, to use more
+than one CPU.
+
+"""
+
+
+from . import ie, types, recfilter, parser
+from .template import IpfixDecodeError
+
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import struct
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# largest possible UDP payload
+_max_datagram = 65535
+
+# SO_RCVBUFFORCE (Linux) can exceed the system limit, given privileges
+_rcvbuf_opts = [opt for opt in (getattr(socket, "SO_RCVBUFFORCE", None),
+                                socket.SO_RCVBUF) if opt is not None]
+
+# socket option to report the kernel's count of dropped datagrams, which
+# the socket module does not define
+if sys.platform.startswith("linux"):
+    _SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+else:
+    _SO_RXQ_OVFL = None
+_ovfl_st = struct.Struct("=L")
+
+# exceptions raised while decoding a malformed message
+_decode_errors = (IpfixDecodeError, struct.error, IndexError, ValueError)
+
+class CollectorSession(object):
+    """
+    The state of a single transport session at a collector: its templates,
+    per observation domain, the next sequence number expected for each
+    observation domain, and counters.
+
+    Sequence numbers are checked against the number of data records
+    received in each domain; :attr:`sequence_errors` counts messages with
+    an unexpected sequence number, and :attr:`lost_records` the records
+    missing before them, as far as they can be determined. A message with
+    a sequence number behind the expected one (by less than half the
+    sequence number space) arrived out of order; it is counted in
+    :attr:`reordered_messages` instead, and leaves the expected sequence
+    number alone.
+
+    """
+    def __init__(self, peer, policy=None, ielist=None, recfilter=None):
+        self.peer = peer
+        self.parser = parser.IpfixParser(policy, ielist, recfilter)
+        self.parser.msg.template_record_hook = self._template_received
+        self.parser.msg.unknown_data_set_hook = self._unknown_set_received
+        self.parser.msg.ignored_data_set_hook = self._ignored_set_received
+        self.next_sequence = {}
+        self.template_times = {}
+        self.last_seen = time.monotonic()
+        self.message_count = 0
+        self.record_count = 0
+        self.byte_count = 0
+        self.sequence_errors = 0
+        self.lost_records = 0
+        self.reordered_messages = 0
+        self.unknown_sets = 0
+
+        # records in the message being decoded, in sets not returned
+        self._skipped_records = 0
+
+    def __repr__(self):
+        return "<CollectorSession from "+str(self.peer)+": "+ \
+               str(self.message_count)+" messages, "+ \
+               str(self.record_count)+" records>"
+
+    @property
+    def templates(self):
+        """Templates in this session, keyed by (odid, tid)."""
+        return self.parser.msg.templates
+
+    def feed(self, data):
+        """
+        Decode data received on this session.
+
+        :param data: bytes following the data previously received
+        :returns: a list of records, as tuples or dicts
+        :raises: IpfixDecodeError
+
+        """
+        self.byte_count += len(data)
+        self.last_seen = time.monotonic()
+        recs = []
+        for msg in self.parser.messages(data):
+            recs.extend(self._decode(msg))
+            self.message_count += 1
+        self.record_count += len(recs)
+        return recs
+
+    def feed_datagram(self, buf):
+        """
+        Decode a datagram received on this session, in place.
+
+        :param buf: a buffer (e.g. a memoryview) containing exactly one
+                    IPFIX message
+        :returns: a list of records, as tuples or dicts
+        :raises: IpfixDecodeError
+
+        """
+        msg = self.parser.msg
+        self.byte_count += len(buf)
+        self.last_seen = time.monotonic()
+        try:
+            msg.from_buffer(buf)
+            recs = self._decode(msg)
+        finally:
+            # drop references to the datagram
+            msg.mbuf = msg.ownbuf
+        self.message_count += 1
+        self.record_count += len(recs)
+        return recs
+
+    def expire_templates(self, before):
+        """
+        Remove templates last received before a given time, as for template
+        lifetimes over UDP (see :rfc:`7011`, section 8.4).
+
+        :param before: time, as returned by :func:`time.monotonic`
+        :returns: the number of templates removed
+
+        """
+        expired = [key for (key, received) in self.template_times.items()
+                   if received < before]
+        msg = self.parser.msg
+        for key in expired:
+            del self.template_times[key]
+            msg.templates.pop(key, None)
+            msg.accepted_tids.discard(key)
+        return len(expired)
+
+    def _decode(self, msg):
+        # Decode the records in a message, counting its data records (all
+        # of them, whether returned or not) in the same pass, and check
+        # its sequence number
+        key = (msg.odid, msg.streamid)
+        start = msg.sequences.get(key, 0)
+        self._skipped_records = 0
+        unknown_sets = self.unknown_sets
+        recs = self.parser.decode(msg)
+        if self.unknown_sets != unknown_sets:
+            # can't count records in sets without templates
+            count = None
+        else:
+            count = msg.sequences.get(key, 0) - start + self._skipped_records
+        self._check_sequence(msg, count)
+        return recs
+
+    def _template_received(self, msg, tmpl):
+        self.template_times[(msg.odid, tmpl.tid)] = self.last_seen
+
+    def _unknown_set_received(self, msg, setbuf):
+        self.unknown_sets += 1
+
+    def _ignored_set_received(self, msg, tmpl, setbuf):
+        # sets not containing the IEs in the ielist are skipped without
+        # decoding, but their records still count toward sequence numbers
+        if tmpl.varlenslice is None:
+            self._skipped_records += (len(setbuf) - 4) // tmpl.minlength
+        else:
+            self._skipped_records += len(tmpl.record_offsets(setbuf, 4,
+                                                             len(setbuf)))
+
+    def _check_sequence(self, msg, count):
+        # Compare the sequence number of a message with the number of
+        # records received so far in its domain, and account for the count
+        # of records in the message, or None if unknown
+        expected = self.next_sequence.get(msg.odid)
+        if expected is not None and expected != msg.sequence:
+            gap = (msg.sequence - expected) % 2**32
+            if gap >= 2**31:
+                # a late message, from before the expected sequence number
+                self.reordered_messages += 1
+                return
+            self.sequence_errors += 1
+            self.lost_records += gap
+
+        if count is None:
+            self.next_sequence.pop(msg.odid, None)
+        else:
+            self.next_sequence[msg.odid] = (msg.sequence + count) % 2**32
+
+class TcpCollector(object):
+    """
+    An IPFIX Collecting Process for TCP, accepting any number of concurrent
+    transport sessions on an asyncio event loop. Use :func:`for_tcp` to get
+    an instance.
+
+    Records are returned to the sink as tuples in ielist order if an ielist
+    is given, and as dicts mapping IE names to values otherwise. If a
+    recfilter is given, only matching records are returned.
+
+    """
+    def __init__(self, sink, host=None, port=4739, policy=None, ielist=None,
+                 recfilter=None, batch_size=4096, read_size=262144,
+                 max_sessions=4096):
+        self.sink = sink
+        self.host = host
+        self.port = port
+        self.policy = policy
+        self.ielist = ielist
+        self.recfilter = recfilter
+        self.batch_size = batch_size
+        self.read_size = read_size
+        self.max_sessions = max_sessions
+
+        self.server = None
+        self.sessions = {}
+        self.closed_stats = {"sessions": 0, "messages": 0, "records": 0,
+                             "bytes": 0, "sequence_errors": 0,
+                             "lost_records": 0, "reordered_messages": 0,
+                             "unknown_sets": 0,
+                             "decode_errors": 0, "rejected": 0}
+
+    def __repr__(self):
+        return "<TcpCollector on "+str(self.host)+":"+str(self.port)+", "+ \
+               str(len(self.sessions))+" sessions>"
+
+    async def start(self):
+        """
+        Start accepting connections on the current event loop.
+
+        """
+        _raise_nofile_limit(self.max_sessions + 64)
+        self.server = await asyncio.start_server(self._handle_session,
+                                                 self.host, self.port,
+                                                 limit=self.read_size,
+                                                 backlog=1024)
+
+    async def serve_forever(self):
+        """
+        Start the collector if necessary, and accept connections until
+        cancelled.
+
+        """
+        if self.server is None:
+            await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            self.close()
+            await self.wait_closed()
+
+    def close(self):
+        """Stop accepting connections."""
+        if self.server is not None:
+            self.server.close()
+
+    async def wait_closed(self):
+        """Wait until the collector is closed."""
+        if self.server is not None:
+            await self.server.wait_closed()
+
+    def addresses(self):
+        """Return the local addresses the collector is listening on."""
+        return [sock.getsockname() for sock in self.server.sockets]
+
+    def stats(self):
+        """
+        Return a dict of counters over all current and closed sessions.
+
+        """
+        stats = dict(self.closed_stats)
+        stats["active"] = len(self.sessions)
+        for session in self.sessions.values():
+            _add_session_stats(stats, session)
+        return stats
+
+    async def _handle_session(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        if len(self.sessions) >= self.max_sessions:
+            logger.warning("rejecting session from %s: too many sessions",
+                           peer)
+            self.closed_stats["rejected"] += 1
+            await _close_writer(writer)
+            return
+
+        session = CollectorSession(peer, self.policy,
+                                   self.ielist, self.recfilter)
+        self.sessions[peer] = session
+        logger.info("session from %s", peer)
+        try:
+            while True:
+                data = await reader.read(self.read_size)
+                if not data:
+                    break
+                try:
+                    recs = session.feed(data)
+                except _decode_errors as e:
+                    # a TCP session can't resynchronize; drop it
+                    logger.warning("closing session from %s: %s", peer, e)
+                    self.closed_stats["decode_errors"] += 1
+                    break
+                if recs:
+                    await _deliver(self.sink, session, recs, self.batch_size)
+        except (ConnectionError, OSError) as e:
+            logger.info("session from %s failed: %s", peer, e)
+        finally:
+            del self.sessions[peer]
+            self.closed_stats["sessions"] += 1
+            _add_session_stats(self.closed_stats, session)
+            await _close_writer(writer)
+            logger.info("session from %s closed", peer)
+
+class UdpCollector(object):
+    """
+    An IPFIX Collecting Process for UDP, receiving from any number of
+    exporters on a single socket on an asyncio event loop. Use
+    :func:`for_udp` to get an instance.
+
+    Each exporter, identified by its source address and port, has its own
+    :class:`CollectorSession`, so templates are scoped per exporter and
+    observation domain. Templates not refreshed within template_lifetime
+    seconds expire, and sessions idle for as long are removed.
+
+    When the socket becomes readable, it is drained of up to batch_count
+    datagrams without returning to the event loop. Each datagram is
+    received into its own buffer and decoded in place; values decoded as
+    memoryviews (see :class:`ipfix.types.DecodePolicy`) remain valid until
+    the sink returns. Records are then passed to the sink, grouped by
+    session; while the sink runs, datagrams queue in the socket's receive
+    buffer, which is enlarged to rcvbuf bytes if possible.
+
+    Datagrams dropped by the kernel because the receive buffer was full are
+    counted where the platform reports them (SO_RXQ_OVFL on Linux).
+
+    """
+    def __init__(self, sink, host=None, port=4739, policy=None, ielist=None,
+                 recfilter=None, batch_size=4096, batch_count=64,
+                 rcvbuf=33554432, template_lifetime=1800, reuse_port=False):
+        self.sink = sink
+        self.host = host
+        self.port = port
+        self.policy = policy
+        self.ielist = ielist
+        self.recfilter = recfilter
+        self.batch_size = batch_size
+        self.template_lifetime = template_lifetime
+        self.rcvbuf = rcvbuf
+        self.reuse_port = reuse_port
+
+        self.sock = None
+        self.task = None
+        self.sessions = {}
+        self.kernel_drops = 0
+        self.closed_stats = {"sessions": 0, "messages": 0, "records": 0,
+                             "bytes": 0, "sequence_errors": 0,
+                             "lost_records": 0, "reordered_messages": 0,
+                             "unknown_sets": 0,
+                             "decode_errors": 0, "datagrams": 0,
+                             "truncated": 0, "expired_templates": 0}
+
+        # one receive buffer per datagram in a batch
+        self.buffers = [memoryview(bytearray(_max_datagram))
+                        for i in range(batch_count)]
+        self._ancbufsize = 0
+        self._more = False
+
+    def __repr__(self):
+        return "<UdpCollector on "+str(self.host)+":"+str(self.port)+", "+ \
+               str(len(self.sessions))+" sessions>"
+
+    def _make_socket(self):
+        (family, socktype, proto, canonname, addr) = socket.getaddrinfo(
+                self.host, self.port, 0, socket.SOCK_DGRAM, 0,
+                socket.AI_PASSIVE)[0]
+        sock = socket.socket(family, socktype, proto)
+        try:
+            for opt in _rcvbuf_opts:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, opt, self.rcvbuf)
+                    break
+                except OSError:
+                    pass
+            self.rcvbuf = sock.getsockopt(socket.SOL_SOCKET,
+                                          socket.SO_RCVBUF)
+
+            if _SO_RXQ_OVFL is not None and hasattr(sock, "recvmsg_into"):
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, _SO_RXQ_OVFL, 1)
+                    self._ancbufsize = socket.CMSG_SPACE(_ovfl_st.size)
+                except OSError:
+                    pass
+
+            if self.reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(addr)
+            sock.setblocking(False)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    async def start(self):
+        """
+        Bind the socket and start receiving on the current event loop.
+
+        """
+        self.sock = self._make_socket()
+        self.task = asyncio.get_running_loop().create_task(self._receive())
+
+    async def serve_forever(self):
+        """
+        Start the collector if necessary, and receive until cancelled.
+
+        """
+        if self.task is None:
+            await self.start()
+        try:
+            await self.task
+        finally:
+            self.close()
+            await self.wait_closed()
+
+    def close(self):
+        """
+        Stop receiving, and close the socket. Does not need a running event
+        loop, so it can be called from synchronous cleanup code.
+
+        """
+        if self.task is not None:
+            self.task.cancel()
+        if self.sock is not None:
+            if self.task is not None:
+                # stop watching the socket on the receiving task's loop,
+                # whether or not that loop is running
+                self.task.get_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+    async def wait_closed(self):
+        """Wait until the collector is closed."""
+        if self.task is not None:
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def addresses(self):
+        """Return the local addresses the collector is listening on."""
+        return [self.sock.getsockname()]
+
+    def stats(self):
+        """
+        Return a dict of counters over all current and expired sessions.
+
+        """
+        stats = dict(self.closed_stats)
+        stats["active"] = len(self.sessions)
+        stats["kernel_drops"] = self.kernel_drops
+        for session in self.sessions.values():
+            _add_session_stats(stats, session)
+        return stats
+
+    def expire(self, now=None):
+        """
+        Expire templates, and remove sessions, not refreshed within the
+        template lifetime. Called periodically while receiving.
+
+        :param now: current time, as returned by :func:`time.monotonic`
+
+        """
+        if now is None:
+            now = time.monotonic()
+        before = now - self.template_lifetime
+        for (peer, session) in list(self.sessions.items()):
+            self.closed_stats["expired_templates"] += \
+                    session.expire_templates(before)
+            if session.last_seen < before:
+                del self.sessions[peer]
+                self.closed_stats["sessions"] += 1
+                _add_session_stats(self.closed_stats, session)
+
+    async def _receive(self):
+        next_expiry = time.monotonic() + 1
+        while self.sock is not None:
+            batches = self._drain()
+            for (session, recs) in batches:
+                await _deliver(self.sink, session, recs, self.batch_size)
+
+            now = time.monotonic()
+            if now >= next_expiry:
+                self.expire(now)
+                next_expiry = now + 1
+
+            if not self._more:
+                await self._wait_readable(1)
+
+    async def _wait_readable(self, timeout):
+        # Wait for the socket to become readable, without watching it while
+        # records are being delivered
+        loop = asyncio.get_running_loop()
+        fd = self.sock.fileno()
+        ready = loop.create_future()
+        loop.add_reader(fd, _set_ready, ready)
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # unless close() has already done so
+            if self.sock is not None:
+                loop.remove_reader(fd)
+
+    def _drain(self):
+        # Receive up to one datagram per buffer, and return a list of
+        # (session, records) for consecutive datagrams from each session.
+        batches = []
+        session = None
+        self._more = True
+        for buf in self.buffers:
+            try:
+                if self._ancbufsize:
+                    (length, ancdata, flags, peer) = self.sock.recvmsg_into(
+                                                    [buf], self._ancbufsize)
+                    for (level, ctype, cdata) in ancdata:
+                        if level == socket.SOL_SOCKET and \
+                           ctype == _SO_RXQ_OVFL:
+                            self.kernel_drops = _ovfl_st.unpack(cdata)[0]
+                    truncated = flags & getattr(socket, "MSG_TRUNC", 0)
+                else:
+                    (length, peer) = self.sock.recvfrom_into(buf)
+                    truncated = False
+            except (BlockingIOError, InterruptedError):
+                self._more = False
+                break
+            except OSError as e:
+                logger.warning("receive failed: %s", e)
+                break
+
+            self.closed_stats["datagrams"] += 1
+            if truncated:
+                self.closed_stats["truncated"] += 1
+                continue
+
+            if session is None or session.peer != peer:
+                session = self.sessions.get(peer)
+                if session is None:
+                    session = CollectorSession(peer, self.policy,
+                                               self.ielist, self.recfilter)
+                    self.sessions[peer] = session
+                    logger.info("session from %s", peer)
+                recs = []
+                batches.append((session, recs))
+
+            try:
+                recs.extend(session.feed_datagram(buf[:length]))
+            except _decode_errors as e:
+                logger.debug("bad datagram from %s: %s", peer, e)
+                self.closed_stats["decode_errors"] += 1
+
+        return [(session, recs) for (session, recs) in batches if recs]
+
+class UdpCollectorPool(object):
+    """
+    A UDP Collecting Process spread over several worker processes, each
+    running a :class:`UdpCollector` bound to the same port with
+    SO_REUSEPORT. Use :func:`for_udp_pool` to get an instance.
+
+    The kernel distributes datagrams among the workers by hashing their
+    source and destination addresses, so each exporter is handled by a
+    single worker, which keeps the templates for the exporters it owns.
+    If the set of workers changes, exporters may move to another worker,
+    and their data sets cannot be decoded until their templates are
+    refreshed.
+
+    The sink is called in the worker processes, and must be picklable
+    (e.g. a module-level function) on platforms which do not fork. The
+    supervisor (the process creating the pool) only collects each
+    worker's stats, every stats_interval seconds.
+
+    """
+    def __init__(self, sink, host=None, port=4739, workers=None,
+                 policy=None, ielist=None, recfilter=None, batch_size=4096,
+                 batch_count=64, rcvbuf=33554432, template_lifetime=1800,
+                 stats_interval=1.0):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise NotImplementedError("collector pools require SO_REUSEPORT")
+
+        self.sink = sink
+        self.host = host
+        self.port = port
+        self.worker_count = workers or os.cpu_count() or 1
+        self.policy = policy
+        self.ielist = ielist
+        self.recfilter = recfilter
+        self.collector_args = (batch_size, batch_count, rcvbuf,
+                               template_lifetime)
+        self.stats_interval = stats_interval
+
+        self.workers = []
+        self.worker_stats = {}
+        self.worker_args = None
+        self.exited_stats = {"restarts": 0}
+        self.queue = None
+        self.stopping = None
+
+    def __repr__(self):
+        return "<UdpCollectorPool on "+str(self.host)+":"+str(self.port)+ \
+               ", "+str(len(self.workers))+" workers>"
+
+    def start(self, timeout=30):
+        """
+        Start the worker processes, and wait until all of them are
+        receiving.
+
+        :param timeout: seconds to wait for the workers to start
+        :raises: RuntimeError if a worker fails to start
+
+        """
+        if not self.port:
+            # find a free port, so that all workers bind the same one
+            (family, socktype, proto, canonname, addr) = socket.getaddrinfo(
+                    self.host, self.port, 0, socket.SOCK_DGRAM, 0,
+                    socket.AI_PASSIVE)[0]
+            with socket.socket(family, socktype, proto) as s:
+                s.bind(addr)
+                self.port = s.getsockname()[1]
+
+        if self.policy is None:
+            policy_options = None
+        else:
+            policy_options = self.policy.options
+        if self.ielist is None:
+            ielist_specs = None
+        else:
+            ielist_specs = [str(e) for e in self.ielist]
+        if self.recfilter is None:
+            filter_expr = None
+        else:
+            filter_expr = self.recfilter.expr
+        specs = [str(e) for e in ie.dump_infomodel()]
+
+        self.queue = multiprocessing.Queue()
+        self.stopping = multiprocessing.Event()
+        self.worker_args = (specs, self.sink, self.host, self.port,
+                            policy_options, ielist_specs, filter_expr,
+                            self.collector_args, self.stats_interval,
+                            self.queue, self.stopping)
+        self.workers = [self._start_worker(i)
+                        for i in range(self.worker_count)]
+
+        # each worker reports stats as soon as it is receiving
+        deadline = time.monotonic() + timeout
+        while len(self.worker_stats) < self.worker_count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not all(p.is_alive() for p in self.workers):
+                self.close()
+                raise RuntimeError("collector workers failed to start")
+            self._update_stats(min(remaining, 0.1))
+
+    def serve_forever(self):
+        """
+        Start the pool if necessary, and collect stats from the workers
+        until interrupted or closed. Workers which exit are restarted.
+
+        """
+        if not self.workers:
+            self.start()
+        try:
+            while not self.stopping.is_set():
+                self._update_stats(self.stats_interval)
+                self._restart_workers()
+        finally:
+            self.close()
+
+    def _start_worker(self, index):
+        p = multiprocessing.Process(target=_run_pool_worker,
+                                    args=(index,) + self.worker_args,
+                                    name="ipfix-collector-"+str(index))
+        p.daemon = True
+        p.start()
+        return p
+
+    def _restart_workers(self):
+        # Replace workers which have exited, keeping the counters they
+        # last reported
+        for (i, p) in enumerate(self.workers):
+            if p.is_alive() or self.stopping.is_set():
+                continue
+            p.join()
+            logger.warning("collector worker %d exited with code %s; "
+                           "restarting", i, p.exitcode)
+            self._update_stats(0)
+            wstats = self.worker_stats.pop(i, {})
+            wstats.pop("active", None)
+            for (key, value) in wstats.items():
+                self.exited_stats[key] = self.exited_stats.get(key, 0) + value
+            self.exited_stats["restarts"] += 1
+            self.workers[i] = self._start_worker(i)
+
+    def close(self, timeout=5):
+        """
+        Stop the workers, waiting up to timeout seconds for them to report
+        their final stats and exit before terminating them.
+
+        """
+        if self.stopping is not None:
+            self.stopping.set()
+        deadline = time.monotonic() + timeout
+        for p in self.workers:
+            while p.is_alive() and time.monotonic() < deadline:
+                self._update_stats(0.05)
+            if p.is_alive():
+                p.terminate()
+            p.join()
+        self._update_stats(0)
+        self.workers = []
+
+    def _update_stats(self, timeout):
+        # Wait for stats from a worker, then take all available stats
+        try:
+            block = timeout > 0
+            while True:
+                (i, stats) = self.queue.get(block, timeout)
+                self.worker_stats[i] = stats
+                block = False
+        except queue.Empty:
+            pass
+
+    def stats(self):
+        """
+        Return a dict of counters summed over all workers, as last reported
+        by each worker, including workers which have since exited; "workers"
+        is the number of workers reporting, and "restarts" the number of
+        workers restarted after exiting.
+
+        """
+        if self.workers:
+            self._update_stats(0)
+        stats = dict(self.exited_stats)
+        stats["workers"] = len(self.worker_stats)
+        for wstats in self.worker_stats.values():
+            for (key, value) in wstats.items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+def _run_pool_worker(index, specs, sink, host, port, policy_options,
+                     ielist_specs, filter_expr, collector_args,
+                     stats_interval, statq, stopping):
+    # Run a UdpCollector in a worker process of a UdpCollectorPool
+    for spec in specs:
+        ie.for_spec(spec)
+
+    if policy_options is None:
+        policy = None
+    else:
+        policy = types.DecodePolicy(**policy_options)
+    if ielist_specs is None:
+        ielist = None
+    else:
+        ielist = ie.spec_list(ielist_specs)
+    if filter_expr is None:
+        rf = None
+    else:
+        rf = recfilter.for_expression(filter_expr)
+
+    c = UdpCollector(sink, host, port, policy, ielist, rf,
+                     *collector_args, reuse_port=True)
+
+    async def run():
+        await c.start()
+        try:
+            while not stopping.is_set() and not c.task.done():
+                statq.put((index, c.stats()))
+                await asyncio.sleep(stats_interval)
+        finally:
+            c.close()
+            await c.wait_closed()
+            statq.put((index, c.stats()))
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+def _set_ready(future):
+    if not future.done():
+        future.set_result(None)
+
+async def _deliver(sink, session, recs, batch_size):
+    # Pass records to a sink in batches, awaiting it if it is a coroutine
+    for i in range(0, len(recs), batch_size):
+        result = sink(session, recs[i:i + batch_size])
+        if inspect.isawaitable(result):
+            await result
+
+async def _close_writer(writer):
+    # Close a TCP session's stream, waiting for the transport to close
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (ConnectionError, OSError):
+        pass
+
+def _add_session_stats(stats, session):
+    stats["messages"] += session.message_count
+    stats["records"] += session.record_count
+    stats["bytes"] += session.byte_count
+    stats["sequence_errors"] += session.sequence_errors
+    stats["lost_records"] += session.lost_records
+    stats["reordered_messages"] += session.reordered_messages
+    stats["unknown_sets"] += session.unknown_sets
+
+def _raise_nofile_limit(count):
+    # Raise the soft limit on open files, if possible, to allow count
+    # concurrent sessions
+    if resource is None:
+        return
+    try:
+        (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < count:
+            if hard != resource.RLIM_INFINITY:
+                count = min(count, hard)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (count, hard))
+    except (ValueError, OSError):
+        pass
+
+def for_tcp(sink, host=None, port=4739, policy=None, ielist=None,
+            recfilter=None, batch_size=4096, read_size=262144,
+            max_sessions=4096):
+    """
+    Get a TcpCollector delivering records to a given sink.
+
+    :param sink: function or coroutine function taking a
+                 :class:`CollectorSession` and a list of records, called
+                 for each batch of records received
+    :param host: address to listen on, or None for all addresses
+    :param port: port to listen on (default 4739); 0 for any free port
+    :param policy: :class:`ipfix.types.DecodePolicy` for decoding records,
+                   or None for the default representations
+    :param ielist: an optional :class:`ipfix.ie.InformationElementList`;
+                   if given, records are returned as tuples in ielist order
+                   and records not containing all its IEs are skipped.
+    :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                      if given, only matching records are returned.
+    :param batch_size: maximum number of records passed to the sink at once
+    :param read_size: maximum number of bytes read from a session at once
+    :param max_sessions: maximum number of concurrent sessions; further
+                         connections are closed immediately
+    :returns: a new :class:`TcpCollector`; await its
+              :meth:`TcpCollector.start` or
+              :meth:`TcpCollector.serve_forever` to run it.
+
+    """
+    return TcpCollector(sink, host, port, policy, ielist, recfilter,
+                        batch_size, read_size, max_sessions)
+
+def for_udp(sink, host=None, port=4739, policy=None, ielist=None,
+            recfilter=None, batch_size=4096, batch_count=64,
+            rcvbuf=33554432, template_lifetime=1800, reuse_port=False):
+    """
+    Get a UdpCollector delivering records to a given sink.
+
+    :param sink: function or coroutine function taking a
+                 :class:`CollectorSession` and a list of records, called
+                 for each batch of records received
+    :param host: address to listen on, or None for all addresses
+    :param port: port to listen on (default 4739); 0 for any free port
+    :param policy: :class:`ipfix.types.DecodePolicy` for decoding records,
+                   or None for the default representations
+    :param ielist: an optional :class:`ipfix.ie.InformationElementList`;
+                   if given, records are returned as tuples in ielist order
+                   and records not containing all its IEs are skipped.
+    :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                      if given, only matching records are returned.
+    :param batch_size: maximum number of records passed to the sink at once
+    :param batch_count: maximum number of datagrams received at once
+    :param rcvbuf: requested size of the socket receive buffer, in bytes
+    :param template_lifetime: seconds after which templates not refreshed
+                              by their exporter expire
+    :param reuse_port: if True, set SO_REUSEPORT on the socket, so that
+                       several collectors can share the port
+    :returns: a new :class:`UdpCollector`; await its
+              :meth:`UdpCollector.start` or
+              :meth:`UdpCollector.serve_forever` to run it.
+
+    """
+    return UdpCollector(sink, host, port, policy, ielist, recfilter,
+                        batch_size, batch_count, rcvbuf, template_lifetime,
+                        reuse_port)
+
+def for_udp_pool(sink, host=None, port=4739, workers=None, policy=None,
+                 ielist=None, recfilter=None, batch_size=4096, batch_count=64,
+                 rcvbuf=33554432, template_lifetime=1800, stats_interval=1.0):
+    """
+    Get a UdpCollectorPool delivering records to a given sink in each of
+    several worker processes.
+
+    :param sink: function or coroutine function taking a
+                 :class:`CollectorSession` and a list of records, called
+                 in a worker process for each batch of records received
+    :param workers: number of worker processes; defaults to the number of
+                    CPUs
+    :param stats_interval: seconds between stats reports from each worker
+
+    Other parameters are as for :func:`for_udp`.
+
+    :returns: a new :class:`UdpCollectorPool`; call its
+              :meth:`UdpCollectorPool.start` or
+              :meth:`UdpCollectorPool.serve_forever` to run it.
+
+    """
+    return UdpCollectorPool(sink, host, port, workers, policy, ielist,
+                            recfilter, batch_size, batch_count, rcvbuf,
+                            template_lifetime, stats_interval)
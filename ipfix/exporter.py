@@ -0,0 +1,820 @@
+#
+# python-ipfix (c) 2013-2014 Brian Trammell.
+#
+# Many thanks to the mPlane consortium (http://www.ict-mplane.eu) for
+# its material support of this effort.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Exporting processes for IPFIX over UDP, and over TCP or UDP with asyncio
+(see :rfc:`7011`).
+
+A :class:`UdpExporter` has the same interface as
+:class:`ipfix.writer.MessageStreamWriter`, but sends each message as a
+single datagram no larger than the path MTU, so that no message is
+fragmented and no record is split across datagrams. Templates are
+resent periodically, as UDP collectors expire templates that are not
+refreshed::
+
+    import ipfix.exporter
+    import ipfix.ie
+    import ipfix.template
+
+    ipfix.ie.use_iana_default()
+    tmpl = ipfix.template.for_specs(256, "sourceIPv4Address",
+                                    "octetDeltaCount")
+
+    e = ipfix.exporter.for_udp("collector.example.com", max_rate=10000)
+    e.add_template(tmpl)
+    e.set_export_template(256)
+    e.export_tuples(recs)
+    e.flush()
+
+Datagrams are sent in batches of batch_count, paced to at most max_rate
+datagrams per second on average, to avoid overflowing the buffers of
+routers and collectors with bursts. Datagrams the exporter could not send
+are counted (see :meth:`UdpExporter.stats`); datagrams lost in the network
+or at the collector can only be detected by the collector, from message
+sequence numbers.
+
+An :class:`AsyncExporter` exports records from coroutines without blocking
+the event loop. Each message is sent as soon as it is full, or once its
+first record has waited max_delay seconds, so records are batched at high
+rates without being delayed at low rates::
+
+    async def export(queue):
+        e = ipfix.exporter.for_tcp_async("collector.example.com",
+                                         max_delay=0.05)
+        await e.start()
+        await e.add_template(tmpl)
+        await e.set_export_template(256)
+        while True:
+            await e.export_tuple(await queue.get())
+
+Exporting coroutines wait when the transport's buffer is full, and the
+exporter reconnects and exports its templates again if its TCP connection
+is lost.
+
+"""
+
+
+from . import message, writer
+
+import asyncio
+import errno
+import socket
+import sys
+import time
+
+# socket option to get the path MTU of a connected socket, which the
+# socket module does not define
+if sys.platform.startswith("linux"):
+    _mtu_opts = {socket.AF_INET: (socket.IPPROTO_IP,
+                                  getattr(socket, "IP_MTU", 14)),
+                 socket.AF_INET6: (socket.IPPROTO_IPV6,
+                                   getattr(socket, "IPV6_MTU", 24))}
+else:
+    _mtu_opts = {}
+
+# IP and UDP header length, by address family
+_header_length = {socket.AF_INET: 28, socket.AF_INET6: 48}
+
+# MTU assumed if the path MTU is not available
+_default_mtu = 1500
+
+# message size used by an AsyncExporter over UDP until the path MTU is known
+_initial_udp_mtu = 1400
+
+# errors on send meaning a datagram was dropped locally, or refused by the
+# collector host
+_drop_errnos = set((errno.ENOBUFS, errno.EAGAIN, errno.EWOULDBLOCK,
+                    errno.ECONNREFUSED))
+
+class UdpExporter(writer.MessageStreamWriter):
+    """
+    Exports records to a collector as a sequence of IPFIX messages over
+    UDP. Use :func:`for_udp` to get an instance.
+
+    Each message is built in a pool buffer of at most mtu bytes, so each
+    datagram holds only whole records; by default, mtu is the path MTU to
+    the collector, less the IP and UDP headers.
+
+    The templates of the current observation domain are exported again at
+    the start of a message when template_refresh seconds have passed since
+    they were last exported (the template refresh timeout of :rfc:`7011`
+    section 8.4), or when template_refresh_packets messages have been sent
+    since, if given.
+
+    Finished messages are sent once batch_count are pending, or once the
+    oldest is batch_delay seconds old, if given; call :meth:`flush` to send
+    pending messages immediately. If max_rate is given, batches are
+    delayed as necessary to send at most max_rate datagrams per second on
+    average.
+
+    """
+    def __init__(self, sock, mtu, template_refresh=600,
+                 template_refresh_packets=None, batch_count=32,
+                 batch_delay=None, max_rate=None):
+        super(UdpExporter, self).__init__(sock, mtu, mtu * batch_count,
+                                          batch_delay)
+        self.sock = sock
+        self.template_refresh = template_refresh
+        self.template_refresh_packets = template_refresh_packets
+        self.batch_count = batch_count
+        self.max_rate = max_rate
+        self.pending_records = []
+
+        self.refresh_time = time.monotonic()
+        self.refresh_packets = 0
+        self.next_send = 0
+
+        self.datagrams_sent = 0
+        self.bytes_sent = 0
+        self.records_sent = 0
+        self.template_refreshes = 0
+        self.send_errors = 0
+        self.refused = 0
+        self.paced_time = 0.0
+
+    def __repr__(self):
+        return "<UdpExporter to "+repr(self.sock.getpeername())+" "+ \
+               str(self.datagrams_sent)+" datagrams sent>"
+
+    def _finish_message(self):
+        # Queue the current message, and send pending messages once a
+        # batch is complete
+        key = (self.msg.odid, self.msg.streamid)
+        self.pending_records.append(self.msg.sequences.get(key, 0) -
+                                    self.msg.sequence)
+        self._queue_message()
+        self.msgcount += 1
+        self.refresh_packets += 1
+        if len(self.pending) >= self.batch_count or \
+           (self.coalesce_delay is not None and
+            time.monotonic() - self.pending_since >= self.coalesce_delay):
+            self._write_pending()
+
+    def _write_pending(self):
+        # Send each pending message as a datagram, after pacing
+        if not self.pending:
+            return
+        self._pace(len(self.pending))
+        for (view, records) in zip(self.pending, self.pending_records):
+            try:
+                self.sock.send(view)
+            except OSError as e:
+                if e.errno not in _drop_errnos:
+                    raise
+                if e.errno == errno.ECONNREFUSED:
+                    self.refused += 1
+                else:
+                    self.send_errors += 1
+            else:
+                self.datagrams_sent += 1
+                self.bytes_sent += len(view)
+                self.records_sent += records
+        self.writecount += 1
+        self.pending_records = []
+        self._release_pending()
+
+    def _pace(self, count):
+        # Wait until count datagrams may be sent at max_rate
+        if not self.max_rate:
+            return
+        now = time.monotonic()
+        if self.next_send > now:
+            time.sleep(self.next_send - now)
+            self.paced_time += self.next_send - now
+            now = self.next_send
+        self.next_send = now + float(count) / self.max_rate
+
+    def _refresh_due(self):
+        if self.template_refresh is not None and \
+           time.monotonic() - self.refresh_time >= self.template_refresh:
+            return True
+        if self.template_refresh_packets is not None and \
+           self.refresh_packets >= self.template_refresh_packets:
+            return True
+        return False
+
+    def _refresh_templates(self):
+        # Export all templates in the current domain into the message,
+        # continuing in new messages if they don't fit
+        for tid in sorted(self.msg.active_template_ids()):
+            try:
+                self.msg.export_template(tid)
+            except message.EndOfMessage:
+                self._finish_message()
+                self.msg.begin_export()
+                self.msg.export_template(tid)
+        self.refresh_time = time.monotonic()
+        self.refresh_packets = 0
+        self.template_refreshes += 1
+
+    def _next_message(self):
+        # Finish the current message, refresh templates if necessary, and
+        # continue the current set in the next message
+        setid = self.msg.cursetid
+        self._finish_message()
+        self.msg.begin_export()
+        if self._refresh_due():
+            self._refresh_templates()
+        if setid is not None:
+            self.msg.export_ensure_set(setid)
+
+    def flush(self):
+        """
+        Send the in-progress message, if it contains any records or
+        templates, and any pending messages, immediately.
+
+        """
+        if self.msg.export_needs_flush():
+            self._next_message()
+        self._write_pending()
+
+    def close(self):
+        """Flush the exporter, and close its socket."""
+        self.flush()
+        self.sock.close()
+
+    def stats(self):
+        """
+        Get the exporter's counters.
+
+        :returns: a dict with the number of messages finished, datagrams,
+                  bytes and data records sent, template refreshes, datagrams
+                  dropped because the local send buffer was full
+                  (send_errors) or refused by the collector host (refused),
+                  their sum as an estimate of datagrams dropped (drops), and
+                  the total time in seconds spent waiting for pacing.
+
+        """
+        return {"messages": self.msgcount,
+                "datagrams": self.datagrams_sent,
+                "bytes": self.bytes_sent,
+                "records": self.records_sent,
+                "template_refreshes": self.template_refreshes,
+                "send_errors": self.send_errors,
+                "refused": self.refused,
+                "drops": self.send_errors + self.refused,
+                "paced_time": self.paced_time}
+
+def _path_mtu(sock):
+    # Get the largest datagram payload that should not be fragmented on
+    # the path of a connected socket
+    mtu = _default_mtu
+    if sock.family in _mtu_opts:
+        try:
+            mtu = sock.getsockopt(*_mtu_opts[sock.family])
+        except OSError:
+            pass
+    return min(mtu - _header_length.get(sock.family, 48), 65535)
+
+def for_udp(host, port=4739, mtu=None, template_refresh=600,
+            template_refresh_packets=None, batch_count=32, batch_delay=None,
+            max_rate=None, sndbuf=None):
+    """
+    Get a UdpExporter sending to a given collector.
+
+    :param host: address or name of the collector
+    :param port: port of the collector (default 4739)
+    :param mtu: maximum message size in bytes; defaults to the path MTU to
+                the collector less the IP and UDP headers, if available,
+                or to the payload of a 1500-byte packet.
+    :param template_refresh: seconds after which templates are exported
+                             again (default 600), or None to only refresh
+                             after template_refresh_packets.
+    :param template_refresh_packets: if given, export templates again after
+                                     this many messages.
+    :param batch_count: number of messages sent at once
+    :param batch_delay: if given, also send pending messages once the
+                        oldest is this many seconds old
+    :param max_rate: if given, maximum average rate in datagrams per second
+    :param sndbuf: if given, requested size of the socket send buffer,
+                   in bytes
+    :returns: a new :class:`UdpExporter`
+
+    """
+    (family, socktype, proto, canonname, addr) = socket.getaddrinfo(
+            host, port, 0, socket.SOCK_DGRAM)[0]
+    sock = socket.socket(family, socktype, proto)
+    try:
+        if sndbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        sock.connect(addr)
+        if mtu is None:
+            mtu = _path_mtu(sock)
+    except:
+        sock.close()
+        raise
+    return UdpExporter(sock, mtu, template_refresh, template_refresh_packets,
+                       batch_count, batch_delay, max_rate)
+
+class _StreamConnection(object):
+    # A TCP connection to a collector, from asyncio.open_connection
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def write(self, data):
+        self.writer.write(data)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def wait_lost(self):
+        # Collectors send nothing; read until the connection is closed
+        try:
+            while await self.reader.read(65536):
+                pass
+        except (ConnectionError, OSError):
+            pass
+
+    def socket(self):
+        return self.writer.get_extra_info("socket")
+
+    def send_errors(self):
+        return 0
+
+    def close(self):
+        self.writer.close()
+
+    async def wait_closed(self):
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    # Tracks flow control and errors on a datagram transport
+    def __init__(self):
+        self.lost = asyncio.get_running_loop().create_future()
+        self.paused = None
+        self.errors = 0
+
+    def connection_lost(self, exc):
+        if not self.lost.done():
+            self.lost.set_result(exc)
+        self.resume_writing()
+
+    def error_received(self, exc):
+        self.errors += 1
+
+    def pause_writing(self):
+        self.paused = asyncio.get_running_loop().create_future()
+
+    def resume_writing(self):
+        if self.paused is not None and not self.paused.done():
+            self.paused.set_result(None)
+        self.paused = None
+
+class _DatagramConnection(object):
+    # A connected UDP socket, from create_datagram_endpoint
+    def __init__(self, transport, protocol):
+        self.transport = transport
+        self.protocol = protocol
+
+    def write(self, data):
+        self.transport.sendto(data)
+
+    async def drain(self):
+        if self.protocol.paused is not None:
+            await asyncio.shield(self.protocol.paused)
+
+    async def wait_lost(self):
+        await asyncio.shield(self.protocol.lost)
+
+    def socket(self):
+        return self.transport.get_extra_info("socket")
+
+    def send_errors(self):
+        return self.protocol.errors
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await asyncio.shield(self.protocol.lost)
+
+class AsyncExporter(object):
+    """
+    Exports records to a collector from coroutines on an asyncio event
+    loop, over TCP or UDP. Use :func:`for_tcp_async` or
+    :func:`for_udp_async` to get an instance, then await :meth:`start`.
+
+    Records are encoded into an :class:`ipfix.message.MessageBuffer` as
+    they are exported, and the message is sent as soon as it is full, or
+    at most max_delay seconds after the first record was added to it: at
+    high rates, every message is full, and at low rates, no record waits
+    longer than max_delay. Sending a full message waits until the
+    transport's write buffer has drained, so exporting coroutines are
+    slowed to the rate the network and collector accept.
+
+    If the connection is lost, it is reestablished in the background,
+    waiting reconnect_delay seconds after the first failure and doubling
+    up to max_reconnect_delay. Exporting coroutines wait for the new
+    connection once the current message is full; the templates of the
+    current observation domain are exported again on the new connection
+    before any other message. If template_refresh is given, templates are
+    also exported again before a message when template_refresh seconds
+    have passed since they were last sent, as required for UDP.
+
+    Messages written to a connection that is then lost may not arrive;
+    as with UDP, the collector detects such loss from sequence numbers.
+
+    """
+    def __init__(self, connect, mtu=65535, max_delay=0.05,
+                 template_refresh=None, reconnect_delay=0.5,
+                 max_reconnect_delay=30):
+        self.connect = connect
+        self.msg = message.MessageBuffer()
+        # without an MTU, start conservatively and use the path MTU once
+        # connected
+        self.probe_mtu = mtu is None
+        self.msg.mtu = _initial_udp_mtu if mtu is None else mtu
+        # templates are sent in a separate message on (re)connection
+        self.tmsg = message.MessageBuffer()
+        self.tmsg.templates = self.msg.templates
+        self.max_delay = max_delay
+        self.template_refresh = template_refresh
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.curtid = None
+        self.conn = None
+        self.connected = None
+        self.task = None
+        self.timer = None
+        self.refresh_time = time.monotonic()
+
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.records_sent = 0
+        self.dwell_flushes = 0
+        self.template_exports = 0
+        self.connections = 0
+        self.connect_errors = 0
+        self.closed_errors = 0
+
+    def __repr__(self):
+        return "<AsyncExporter "+str(self.messages_sent)+" messages sent"+ \
+               ("" if self.conn else ", disconnected")+">"
+
+    async def start(self):
+        """
+        Connect to the collector, retrying as necessary, and keep the
+        connection up in the background until :meth:`close`.
+
+        """
+        loop = asyncio.get_running_loop()
+        if self.connected is None:
+            self.connected = asyncio.Event()
+        first = loop.create_future()
+        self.task = loop.create_task(self._maintain(first))
+        await first
+
+    async def _maintain(self, first):
+        # Connect, and reconnect whenever the connection is lost
+        delay = self.reconnect_delay
+        while True:
+            try:
+                conn = await self.connect()
+            except OSError:
+                self.connect_errors += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            delay = self.reconnect_delay
+
+            self.conn = conn
+            self.connections += 1
+            self._on_connect()
+            self.connected.set()
+            if not first.done():
+                first.set_result(None)
+
+            await conn.wait_lost()
+            self.connected.clear()
+            self.conn = None
+            self.closed_errors += conn.send_errors()
+            conn.close()
+
+    def _on_connect(self):
+        # Start a transport session: templates first, then any message
+        # held while disconnected
+        if self.connections == 1:
+            if self.probe_mtu:
+                self.msg.mtu = _path_mtu(self.conn.socket())
+            if not self.msg.length:
+                # nothing exported before start
+                self.msg.begin_export()
+        else:
+            self._send_templates()
+        if self.msg.export_needs_flush():
+            self._send_message()
+
+    def _send_templates(self):
+        # Send the templates of the current domain, in as many messages as
+        # necessary, numbered in sequence before the current message
+        self.tmsg.mtu = self.msg.mtu
+        self.tmsg.odid = self.msg.odid
+        self.tmsg.begin_export()
+        for tid in sorted(self.msg.active_template_ids()):
+            try:
+                self.tmsg.export_template(tid)
+            except message.EndOfMessage:
+                self._write(self.tmsg, self.msg.sequence)
+                self.tmsg.begin_export()
+                self.tmsg.export_template(tid)
+        if self.tmsg.export_needs_flush():
+            self._write(self.tmsg, self.msg.sequence)
+        self.refresh_time = time.monotonic()
+        self.template_exports += 1
+
+    def _write(self, msg, sequence):
+        # Write a message to the connection. asyncio transports may keep a
+        # reference to data they can't send at once, so write a copy.
+        msg.sequence = sequence
+        data = msg.to_bytes()
+        self.conn.write(data)
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+
+    def _send_message(self):
+        # Send the current message, and continue the current set in the
+        # next message
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.template_refresh is not None and \
+           time.monotonic() - self.refresh_time >= self.template_refresh:
+            self._send_templates()
+
+        setid = self.msg.cursetid
+        key = (self.msg.odid, self.msg.streamid)
+        self.records_sent += self.msg.sequences.get(key, 0) - \
+                             self.msg.sequence
+        self._write(self.msg, self.msg.sequence)
+        self.msg.begin_export()
+        if setid is not None:
+            self.msg.export_ensure_set(setid)
+
+    def _dwell_expired(self):
+        self.timer = None
+        if self.conn is not None and self.msg.export_needs_flush():
+            self._send_message()
+            self.dwell_flushes += 1
+
+    def _arm_timer(self):
+        # Bound the time the current message's first record waits
+        if self.timer is None and self.max_delay is not None:
+            self.timer = asyncio.get_running_loop().call_later(
+                    self.max_delay, self._dwell_expired)
+
+    async def _next_message(self):
+        # Send the current message once connected, and wait for the
+        # transport to accept it
+        if self.connected is None:
+            # exporting before start
+            self.connected = asyncio.Event()
+        while self.conn is None:
+            await self.connected.wait()
+        conn = self.conn
+        if self.msg.export_needs_flush():
+            # not already sent on reconnection
+            self._send_message()
+        try:
+            await conn.drain()
+        except ConnectionError:
+            # lost meanwhile; reconnection is under way
+            pass
+
+    async def _retry_after_flush(self, fn, *args):
+        try:
+            return fn(*args)
+        except message.EndOfMessage:
+            await self._next_message()
+            return fn(*args)
+
+    async def set_domain(self, odid):
+        """
+        Set the observation domain for subsequent messages; see
+        :meth:`ipfix.writer.MessageStreamWriter.set_domain`.
+
+        :param odid: Observation domain ID to use for export
+
+        """
+        if self.msg.export_needs_flush():
+            await self._next_message()
+        self.msg.begin_export(odid)
+
+    async def add_template(self, tmpl):
+        """
+        Add a template to this exporter, and export it.
+
+        :param tmpl: the template to add
+
+        """
+        await self._retry_after_flush(self.msg.add_template, tmpl)
+        self._arm_timer()
+
+    async def set_export_template(self, tid):
+        """
+        Set the template used to encode subsequently exported records.
+
+        :param tid: Template ID of a template added with
+                    :meth:`add_template`
+
+        """
+        self.curtid = tid
+        await self._retry_after_flush(self.msg.export_ensure_set, tid)
+
+    async def _export(self, fn, rec):
+        await self._retry_after_flush(self.msg.export_ensure_set, self.curtid)
+        await self._retry_after_flush(fn, rec)
+        self._arm_timer()
+
+    async def export_tuple(self, rec):
+        """
+        Export a record, as a tuple of values in template order, using the
+        current template.
+
+        """
+        await self._export(self.msg.export_tuple, rec)
+
+    async def export_namedict(self, rec):
+        """
+        Export a record, as a dictionary mapping IE names to values, using
+        the current template.
+
+        """
+        await self._export(self.msg.export_namedict, rec)
+
+    async def export_object(self, rec):
+        """
+        Export a record, as an object with an attribute named for each IE,
+        using the current template.
+
+        """
+        await self._export(self.msg.export_object, rec)
+
+    async def _export_many(self, recs, export_fn):
+        # Export a list of records, sending each message as it fills
+        await self._retry_after_flush(self.msg.export_ensure_set, self.curtid)
+        start = 0
+        flushed = False
+        while start < len(recs):
+            end = export_fn(recs, start)
+            if end == start:
+                if flushed:
+                    # doesn't fit into an empty message
+                    raise message.EndOfMessage()
+                await self._next_message()
+                flushed = True
+            else:
+                flushed = False
+            start = end
+        self._arm_timer()
+
+    async def export_tuples(self, recs):
+        """
+        Export a list of records, as tuples, using the current template,
+        packing as many into each message as fit.
+
+        """
+        await self._export_many(list(recs), self.msg.export_tuples)
+
+    async def export_namedicts(self, recs):
+        """
+        Export a list of records, as dictionaries, using the current
+        template, packing as many into each message as fit.
+
+        """
+        await self._export_many(list(recs), self.msg.export_namedicts)
+
+    async def export_objects(self, recs):
+        """
+        Export a list of records, as objects, using the current template,
+        packing as many into each message as fit.
+
+        """
+        await self._export_many(list(recs), self.msg.export_objects)
+
+    async def flush(self):
+        """
+        Send the current message immediately, if it contains any records
+        or templates, and wait for the transport to accept it.
+
+        """
+        if self.msg.export_needs_flush():
+            await self._next_message()
+
+    async def close(self):
+        """
+        Flush the exporter if connected, and close the connection.
+
+        """
+        if self.conn is not None:
+            await self.flush()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.conn is not None:
+            self.conn.close()
+            await self.conn.wait_closed()
+            self.conn = None
+
+    def stats(self):
+        """
+        Get the exporter's counters.
+
+        :returns: a dict with the number of messages, bytes and data records
+                  sent, messages sent because max_delay expired
+                  (dwell_flushes), template exports, connections made and
+                  failed connection attempts (connect_errors), and send
+                  errors reported on datagram transports.
+
+        """
+        send_errors = self.closed_errors
+        if self.conn is not None:
+            send_errors += self.conn.send_errors()
+        return {"messages": self.messages_sent,
+                "bytes": self.bytes_sent,
+                "records": self.records_sent,
+                "dwell_flushes": self.dwell_flushes,
+                "template_exports": self.template_exports,
+                "connections": self.connections,
+                "connect_errors": self.connect_errors,
+                "send_errors": send_errors}
+
+def for_tcp_async(host, port=4739, mtu=65535, max_delay=0.05,
+                  reconnect_delay=0.5, max_reconnect_delay=30, ssl=None):
+    """
+    Get an AsyncExporter sending to a collector over TCP.
+
+    :param host: address or name of the collector
+    :param port: port of the collector (default 4739)
+    :param mtu: maximum message size in bytes (default 65535)
+    :param max_delay: maximum time in seconds a record waits in an
+                      unfilled message before it is sent, or None to only
+                      send full messages and on :meth:`AsyncExporter.flush`
+    :param reconnect_delay: seconds to wait before reconnecting after the
+                            first failure; doubled after each failure
+    :param max_reconnect_delay: maximum seconds to wait before reconnecting
+    :param ssl: if given, an ssl.SSLContext for TLS (see :rfc:`7011`
+                section 11)
+    :returns: a new :class:`AsyncExporter`; await its
+              :meth:`AsyncExporter.start` to connect.
+
+    """
+    async def connect():
+        (reader, writer) = await asyncio.open_connection(host, port, ssl=ssl)
+        return _StreamConnection(reader, writer)
+    return AsyncExporter(connect, mtu, max_delay, None, reconnect_delay,
+                         max_reconnect_delay)
+
+def for_udp_async(host, port=4739, mtu=None, max_delay=0.05,
+                  template_refresh=600):
+    """
+    Get an AsyncExporter sending to a collector over UDP.
+
+    :param host: address or name of the collector
+    :param port: port of the collector (default 4739)
+    :param mtu: maximum message size in bytes; defaults to the path MTU to
+                the collector less the IP and UDP headers, as for
+                :func:`for_udp`. Until :meth:`AsyncExporter.start` has
+                connected, messages are limited to 1400 bytes.
+    :param max_delay: maximum time in seconds a record waits in an
+                      unfilled message before it is sent
+    :param template_refresh: seconds after which templates are exported
+                             again (default 600)
+    :returns: a new :class:`AsyncExporter`; await its
+              :meth:`AsyncExporter.start` to connect.
+
+    """
+    async def connect():
+        (transport, protocol) = await asyncio.get_running_loop(). \
+                create_datagram_endpoint(_DatagramProtocol,
+                                         remote_addr=(host, port))
+        return _DatagramConnection(transport, protocol)
+    return AsyncExporter(connect, mtu, max_delay, template_refresh)
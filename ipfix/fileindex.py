@@ -0,0 +1,395 @@
+#
+# python-ipfix (c) 2013-2014 Brian Trammell.
+#
+# Many thanks to the mPlane consortium (http://www.ict-mplane.eu) for
+# its material support of this effort.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Persistent sidecar indexes for IPFIX files (see :rfc:`5655`).
+
+An index describes each message in a file: its byte offset, export time,
+observation domain, the IDs of the templates it defines and of the data sets
+it contains, its record count, and the range of values of some time IEs in
+its records. Indexes are built once, e.g. when a file is rotated, and written
+next to the file; see :func:`for_file` and the ipfixindex script.
+
+A :class:`ipfix.reader.MessageStreamReader` on the (seekable) file can then
+use the index to read only the messages relevant to a query, replaying just
+the template sets needed to decode them:
+
+>>> import io
+>>> import ipfix.fileindex
+>>> import ipfix.reader
+>>> import ipfix.testutils
+>>> from datetime import datetime
+>>> f = io.BytesIO()
+>>> ipfix.testutils.mktest_file(f, msg_count=64)
+>>> idx = ipfix.fileindex.build_index(f, ["flowStartMilliseconds"])
+>>> len(idx)
+64
+>>> msgnums = idx.messages_between(datetime(2009, 2, 20, 0, 0, 0, 100000),
+...                                datetime(2009, 2, 20, 0, 0, 0, 130000),
+...                                "flowStartMilliseconds")
+>>> msgnums
+[6, 7, 8]
+>>> r = ipfix.reader.from_stream(f)
+>>> r.select_messages(idx, msgnums)
+>>> len(list(r.namedict_iterator()))
+48
+
+"""
+
+
+from . import ie, types, template, message
+from .template import IpfixDecodeError
+from .compat import xrange
+
+import array
+import bisect
+import os
+import struct
+
+_idxhdr_st = struct.Struct("!8sHHL")
+_idxmagic = b"IPFIXIDX"
+_idxversion = 2
+_strlen_st = struct.Struct("!H")
+
+# file offsets need 64 bits
+try:
+    array.array("Q")
+    _offset_typecode = "Q"
+    _time_typecode = "q"
+except ValueError:
+    _offset_typecode = "d"
+    _time_typecode = "d"
+
+_no_min = 2**63 - 1
+_no_max = -2**63
+
+SIDECAR_SUFFIX = ".idx"
+
+class FileIndex(object):
+    """
+    An index of the messages in an IPFIX file. Use :func:`build_index`,
+    :func:`from_stream` or :func:`for_file` to get an instance.
+
+    Each attribute holds one entry per message, in file order: offsets,
+    export_epochs (seconds since the epoch), odids, and record_counts.
+    Message numbers count from 0.
+
+    """
+    def __init__(self, timeies=()):
+        self.timeies = [ie.for_spec(spec) if not
+                        isinstance(spec, ie.InformationElement) else spec
+                        for spec in timeies]
+        for e in self.timeies:
+            if e.type.num not in (14, 15, 16, 17):
+                raise ValueError("can't index non-time IE "+str(e))
+
+        self.offsets = array.array(_offset_typecode)
+        self.export_epochs = array.array("L")
+        self.odids = array.array("L")
+        self.record_counts = array.array("L")
+
+        # minimum and maximum of each time IE, in milliseconds
+        self.time_mins = [array.array(_time_typecode) for e in self.timeies]
+        self.time_maxs = [array.array(_time_typecode) for e in self.timeies]
+
+        # template IDs defined, and data set IDs present, in each message;
+        # the IDs for message i are at [starts[i]:starts[i+1]]
+        self.template_tids = array.array("H")
+        self.template_starts = array.array("L", [0])
+        self.set_tids = array.array("H")
+        self.set_starts = array.array("L", [0])
+
+        self._definitions = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __repr__(self):
+        return "<FileIndex "+str(len(self))+" messages, time IEs "+ \
+               ", ".join(e.name for e in self.timeies)+">"
+
+    def _append(self, msg, offset, counts, mins, maxs, tids, setids):
+        self.offsets.append(offset)
+        self.export_epochs.append(msg.export_epoch)
+        self.odids.append(msg.odid)
+        self.record_counts.append(counts)
+        for i in xrange(len(self.timeies)):
+            self.time_mins[i].append(mins[i])
+            self.time_maxs[i].append(maxs[i])
+        self.template_tids.extend(tids)
+        self.template_starts.append(len(self.template_tids))
+        self.set_tids.extend(setids)
+        self.set_starts.append(len(self.set_tids))
+        self._definitions = None
+
+    def templates_defined(self, msgnum):
+        """Return the IDs of the templates defined in a message."""
+        return list(self.template_tids[self.template_starts[msgnum]:
+                                       self.template_starts[msgnum + 1]])
+
+    def sets_present(self, msgnum):
+        """Return the IDs of the data sets in a message."""
+        return list(self.set_tids[self.set_starts[msgnum]:
+                                  self.set_starts[msgnum + 1]])
+
+    def time_range(self, msgnum, timeie):
+        """
+        Return the range of values of a time IE in the records of a message.
+
+        :param msgnum: message number
+        :param timeie: name of, or IE, one of the time IEs of the index
+        :returns: a tuple of the (min, max) time, as datetimes, or None if
+                  no record in the message contains the IE.
+
+        """
+        i = self._timeie_index(timeie)
+        if self.time_mins[i][msgnum] > self.time_maxs[i][msgnum]:
+            return None
+        return (types._decode_msec(self.time_mins[i][msgnum]),
+                types._decode_msec(self.time_maxs[i][msgnum]))
+
+    def _timeie_index(self, timeie):
+        if not isinstance(timeie, ie.InformationElement):
+            timeie = ie.for_spec(timeie)
+        try:
+            return self.timeies.index(timeie)
+        except ValueError:
+            raise ValueError("IE "+str(timeie)+" not in index")
+
+    def messages_between(self, start=None, end=None, timeie=None):
+        """
+        Get the numbers of the messages relevant to a time range.
+
+        :param start: start of the range, as a datetime, or None for no
+                      lower bound
+        :param end: time after the range, as a datetime, or None for no
+                    upper bound
+        :param timeie: name of, or IE, one of the time IEs of the index;
+                       selects messages containing records with values of
+                       this IE in the range. If None, selects messages
+                       exported in the range.
+        :returns: a list of message numbers, in file order
+
+        """
+        if timeie is None:
+            lo = 0 if start is None else types._encode_sec(start)
+            hi = 2**32 if end is None else types._encode_sec(end)
+            return [i for (i, epoch) in enumerate(self.export_epochs)
+                    if lo <= epoch < hi]
+
+        t = self._timeie_index(timeie)
+        lo = _no_max if start is None else types._encode_msec(start)
+        hi = _no_min if end is None else types._encode_msec(end)
+        return [i for (i, tmin, tmax) in
+                    zip(xrange(len(self)), self.time_mins[t], self.time_maxs[t])
+                if tmin < hi and tmax >= lo]
+
+    def definition_before(self, odid, tid, msgnum):
+        """
+        Find the last message before a given message defining a template.
+
+        :returns: a message number, or None if the template is not
+                  defined before the message.
+
+        """
+        if self._definitions is None:
+            self._definitions = {}
+            for i in xrange(len(self)):
+                for deftid in self.templates_defined(i):
+                    self._definitions.setdefault((self.odids[i], deftid),
+                                                 []).append(i)
+
+        defs = self._definitions.get((odid, tid), ())
+        pos = bisect.bisect_left(defs, msgnum)
+        if pos:
+            return defs[pos - 1]
+        return None
+
+    def write(self, stream):
+        """
+        Write this index to a stream.
+
+        :param stream: binary stream to write to
+
+        """
+        stream.write(_idxhdr_st.pack(_idxmagic, _idxversion,
+                                     len(self.timeies), len(self)))
+        for e in self.timeies:
+            spec = str(e).encode("utf-8")
+            stream.write(_strlen_st.pack(len(spec)))
+            stream.write(spec)
+
+        for (a, stel) in zip(self._arrays(), self._array_stels()):
+            stream.write(struct.pack("!L", len(a)))
+            stream.write(struct.pack("!%u%s" % (len(a), stel), *a))
+
+    def _arrays(self):
+        return ([self.offsets, self.export_epochs, self.odids,
+                 self.record_counts] + self.time_mins + self.time_maxs +
+                [self.template_tids, self.template_starts,
+                 self.set_tids, self.set_starts])
+
+    def _array_stels(self):
+        # struct elements for each of _arrays() in an index file; fixed
+        # width and big-endian, whatever the width of array typecodes on
+        # this platform
+        return (["Q", "L", "L", "L"] + ["q"] * (2 * len(self.timeies)) +
+                ["H", "L", "H", "L"])
+
+def build_index(stream, timeies=()):
+    """
+    Build an index of an IPFIX file, by reading it from the start.
+
+    :param stream: seekable binary stream containing the file
+    :param timeies: names of (or IEs) dateTime IEs to record value ranges
+                    for
+    :returns: a new :class:`FileIndex`
+    :raises: IpfixDecodeError
+
+    """
+    idx = FileIndex(timeies)
+    msg = message.MessageBuffer(policy=types.DecodePolicy(timestamps="ms"))
+    timelists = [ie.InformationElementList([e]) for e in idx.timeies]
+
+    stream.seek(0)
+    while True:
+        offset = stream.tell()
+        try:
+            msg.read_message(stream)
+        except EOFError:
+            break
+
+        tids = [tid for (setoff, setid, setlen) in msg.setlist
+                if setid in (template.TEMPLATE_SET_ID, template.OPTIONS_SET_ID)
+                for tid in _template_ids(msg.mbuf, setoff, setid, setlen)]
+        setids = [setid for (setoff, setid, setlen) in msg.setlist
+                  if setid >= 256]
+
+        count = 0
+        mins = [_no_min] * len(timelists)
+        maxs = [_no_max] * len(timelists)
+        for (tmpl, setoff, setend) in \
+                msg._data_set_iterator(message.accept_all_templates):
+            if tmpl.varlenslice is None:
+                count += (setend - setoff) // tmpl.minlength
+            else:
+                count += len(tmpl.record_offsets(msg.mbuf, setoff, setend))
+            for i, ielist in enumerate(timelists):
+                if ielist[0] in tmpl.ies:
+                    vals = [rec[0] for rec in
+                            tmpl.decode_tuples_from(msg.mbuf, setoff, setend,
+                                                    recinf=ielist)]
+                    if vals:
+                        mins[i] = min(mins[i], min(vals))
+                        maxs[i] = max(maxs[i], max(vals))
+
+        idx._append(msg, offset, count, mins, maxs, tids, setids)
+
+    return idx
+
+def _template_ids(buf, setoff, setid, setlen):
+    # IDs of the templates in a template set, without decoding them
+    for (tid, start, end) in template._template_records(buf,
+                setoff + message._sethdr_st.size, setoff + setlen, setid):
+        yield tid
+
+def from_stream(stream):
+    """
+    Read an index from a stream written by :meth:`FileIndex.write`.
+
+    :param stream: binary stream to read from
+    :returns: a new :class:`FileIndex`
+    :raises: IpfixDecodeError if the stream does not contain an index
+
+    """
+    hdr = stream.read(_idxhdr_st.size)
+    if len(hdr) < _idxhdr_st.size:
+        raise IpfixDecodeError("Short read in index header")
+    (magic, version, timeiecount, msgcount) = _idxhdr_st.unpack(hdr)
+    if magic != _idxmagic or version != _idxversion:
+        raise IpfixDecodeError("Not an IPFIX file index, or unsupported "+
+                               "index version")
+
+    timeies = []
+    for i in xrange(timeiecount):
+        speclen = _strlen_st.unpack(stream.read(_strlen_st.size))[0]
+        timeies.append(stream.read(speclen).decode("utf-8"))
+
+    idx = FileIndex(timeies)
+    for (a, stel) in zip(idx._arrays(), idx._array_stels()):
+        count = struct.unpack("!L", stream.read(4))[0]
+        st = struct.Struct("!%u%s" % (count, stel))
+        data = stream.read(st.size)
+        if len(data) < st.size:
+            raise IpfixDecodeError("Short read in index")
+        del a[:]
+        a.extend(st.unpack(data))
+
+    if len(idx) != msgcount:
+        raise IpfixDecodeError("Index message count mismatch")
+
+    return idx
+
+def sidecar_filename(filename):
+    """Return the name of the sidecar index file for an IPFIX file."""
+    return filename + SIDECAR_SUFFIX
+
+def for_file(filename, timeies=(), create=True):
+    """
+    Get the index for an IPFIX file from its sidecar index file, building
+    and writing the index if the sidecar is missing, older than the file, in
+    an unsupported format, or indexing other time IEs than those given.
+
+    :param filename: name of the IPFIX file
+    :param timeies: time IEs the index must record value ranges for
+    :param create: if False, raise an error instead of building the index
+    :returns: a :class:`FileIndex`
+    :raises: IOError/OSError if the index is missing or indexes other time
+             IEs, and create is False
+
+    """
+    timeies = FileIndex(timeies).timeies
+    idxname = sidecar_filename(filename)
+    if os.path.exists(idxname) and \
+       os.path.getmtime(idxname) >= os.path.getmtime(filename):
+        with open(idxname, mode="rb") as f:
+            try:
+                idx = from_stream(f)
+            except IpfixDecodeError:
+                # e.g. an index written by an older version; rebuild it
+                if not create:
+                    raise
+                idx = None
+        if idx is not None:
+            if idx.timeies == timeies:
+                return idx
+            if not create:
+                raise IOError("index for "+filename+" records time IEs "+
+                              ", ".join(e.name for e in idx.timeies)+
+                              ", not "+", ".join(e.name for e in timeies))
+
+    if not create:
+        raise IOError("no current index for "+filename)
+
+    with open(filename, mode="rb") as f:
+        idx = build_index(f, timeies)
+    with open(idxname, mode="wb") as f:
+        idx.write(f)
+    return idx
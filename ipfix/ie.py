@@ -73,7 +73,6 @@ Most client code will only need the :func:`use_iana_default`,
 client code using tuple interfaces will need :func:`spec_list` as well.
 
 """
-from __future__ import with_statement, unicode_literals
 import re
 import os.path
 from . import types, compat
@@ -89,7 +88,19 @@ _iespec_re = re.compile('^([^\s\[\<\(]+)?(\(((\d+)\/)?(\d+)\))?'
 _ieForName = {}
 _ieForNum = {}
 
+# Interned reduced-length variants of registered IEs, by (pen, num, length)
+_ieForLength = {}
+
 def _register_ie(ie):
+    # a new IE (e.g. an unknown IE registered while decoding a template)
+    # can't appear in anything built from the information model before, so
+    # only replacing an IE invalidates cached templates
+    if (ie.pen, ie.num) in _ieForNum or ie.name in _ieForName:
+        # forget variants of the IE being replaced
+        for key in [k for k in _ieForLength if k[0:2] == (ie.pen, ie.num)]:
+            del _ieForLength[key]
+        types._infomodel_changed()
+
     _ieForName[ie.name] = ie
     _ieForNum[(ie.pen, ie.num)] = ie
 
@@ -107,9 +118,11 @@ class InformationElement(object):
     for representing the values as strings; if not set, these default to
 
     InformationElement instances should be obtained using the :func:`for_spec`
-    or :func:`for_template_entry` functions.
+    or :func:`for_template_entry` functions. These return the same instance
+    for every request for a given known IE and length.
 
     """
+    __slots__ = ("name", "length", "pen", "num", "type", "valparse", "valstr")
 
     def __init__(self, name, pen, num, ietype=types._roottypes[0], length=None, valstr=None, valparse=None):
         if name:
@@ -135,7 +148,8 @@ class InformationElement(object):
         Two IEs are considered equal if they share a PEN, number, and length.
 
         """
-        return ((self.pen, self.num) == (other.pen, other.num))
+        return (self is other) or \
+               ((self.pen, self.num) == (other.pen, other.num))
 
     def __lt__(self, other):
         return ((self.pen, self.num) < (other.pen, other.num))
@@ -157,14 +171,25 @@ class InformationElement(object):
         Used to support reduced-length encoding (RLE).
 
         :param length: length of the new IE
-        :returns: this IE if length matches, or a new IE for the length
+        :returns: this IE if length matches, or an IE for the length,
+                  interned if this IE is a known IE
         :raises: ValueError
         """
 
         if not length or length == self.length:
             return self
-        else:
-            return self.__class__(self.name, self.pen, self.num, self.type, length)
+
+        key = (self.pen, self.num, length)
+        try:
+            return _ieForLength[key]
+        except KeyError:
+            pass
+
+        ie = self.__class__(self.name, self.pen, self.num, self.type, length,
+                            self.valstr, self.valparse)
+        if _ieForNum.get(key[0:2]) is self:
+            _ieForLength[key] = ie
+        return ie
 
     def unparse(self, v):
         """
@@ -295,8 +320,11 @@ def for_spec(spec):
         return _ieForName[name].for_length(length)
 
     if num and (pen, num) in _ieForNum:
-        # lookup in number registry
-        return _ieForNum[(pen, num)].for_length(length)
+        # lookup in number registry, unless a full IEspec names an IE only
+        # known from a template entry
+        known = _ieForNum[(pen, num)]
+        if not (name and typename and known.name == "_ipfix_%u_%u" % (pen, num)):
+            return known.for_length(length)
 
     # try to create new registered IE
     if not typename:
@@ -344,6 +372,8 @@ def clear_infomodel():
     """Reset the cache of known Information Elements."""
     _ieForName.clear()
     _ieForNum.clear()
+    _ieForLength.clear()
+    types._infomodel_changed()
 
 def dump_infomodel():
     return sorted([_ieForNum[x] for x in _ieForNum])
@@ -396,3 +426,9 @@ def test_ie_internals():
         pass
 
     assert for_template_entry(35566,9999,4) == InformationElement(None, 35566, 9999, length=4)
+
+    # reduced-length variants of known IEs are interned
+    e = for_spec("rleTestElement(35566/9997)<unsigned64>")
+    assert for_spec("rleTestElement[4]") is for_template_entry(35566, 9997, 4)
+    assert for_spec("rleTestElement[4]").type is types.for_name("unsigned64").for_length(4)
+    assert for_spec("rleTestElement[4]").type.valstr is e.type.valstr
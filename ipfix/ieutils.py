@@ -18,7 +18,6 @@
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from __future__ import with_statement
 import xml.etree.ElementTree as etree
 from warnings import warn
 
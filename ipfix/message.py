@@ -28,7 +28,6 @@ records automatically from/to streams, see :mod:`ipfix.reader` and
 
 To create a message buffer:
 
->>> from __future__ import unicode_literals
 >>> import ipfix.message
 >>> msg = ipfix.message.MessageBuffer()
 >>> msg
@@ -184,7 +183,6 @@ Grüezi, Y'all
 
 """
 
-from __future__ import unicode_literals
 from . import template, types, compat
 from .template import IpfixEncodeError, IpfixDecodeError
 from .compat import timezone, ifilter, reduce
@@ -210,15 +208,116 @@ class EndOfMessage(Exception):
 def accept_all_templates(tmpl):
     return True
 
+# per-record equivalents of batch decode functions, for filtered batches
+_record_decode_fns = {
+    template.Template.decode_namedicts_from:
+        template.Template.decode_namedict_from,
+    template.Template.decode_tuples_from:
+        template.Template.decode_tuple_from}
+
+# exceptions raised when encoding a record with missing or bad values, or
+# running off the end of the buffer
+_record_encode_errors = (struct.error, IndexError, ValueError, KeyError,
+                         TypeError, AttributeError)
+
+def _record_encode_error(index, e):
+    # An IpfixEncodeError for the record at a given index of a bulk export;
+    # its index attribute tells the caller where to resume
+    err = IpfixEncodeError("can't encode record "+str(index)+": "+repr(e))
+    err.index = index
+    return err
+
+_scratch = []
+
+def _scratch_buffer():
+    # A buffer large enough to hold any record that fits in a message, for
+    # encoding records whose length is unknown; contents are discarded.
+    if not _scratch:
+        _scratch.append(compat.get_buffer(bytearray(65536)))
+    return _scratch[0]
+
+@compat.lru_cache(maxsize = 256)
+def _array_dtypes(layout):
+    # Get a big-endian dtype for reading records with the given
+    # TemplatePackingPlan.array_layout() from a buffer, and a compact,
+    # native-endian dtype for the resulting arrays.
+    numpy = compat.get_numpy()
+    (names, formats, offsets, itemsize) = layout
+    wire = numpy.dtype({"names": names, "formats": formats,
+                        "offsets": offsets, "itemsize": itemsize})
+    native = numpy.dtype([(name, numpy.dtype(fmt).newbyteorder("="))
+                          for name, fmt in zip(names, formats)])
+    return (wire, native)
+
+def _wire_column(e, col):
+    # Convert a column of values for an IE to its wire representation, as
+    # in TemplatePackingPlan.array_layout(); datetime64 columns are
+    # converted to the units of the IE's timestamp type.
+    numpy = compat.get_numpy()
+    col = numpy.asarray(col)
+    if col.dtype.kind != "M":
+        return col
+    if e.type.num == 14:
+        return col.astype("datetime64[s]").astype(numpy.int64)
+    elif e.type.num == 15:
+        return col.astype("datetime64[ms]").astype(numpy.int64)
+    elif e.type.num in (16, 17):
+        # round the fraction up, as types._encode_ns_ntp
+        (sec, frac) = numpy.divmod(col.astype("datetime64[ns]")
+                                      .astype(numpy.int64), 1000000000)
+        return (((sec + types.NTP_EPOCH_TO_UNIX_EPOCH).astype(numpy.uint64)
+                 << numpy.uint64(32)) +
+                (-((-frac << 32) // 1000000000)).astype(numpy.uint64))
+    else:
+        raise IpfixEncodeError("can't export datetime64 values as "+str(e))
+
+def _wire_array(tmpl, columns, count):
+    # Build an array of records in a template's wire layout from columns,
+    # given as a structured array or a mapping of IE name to array
+    (wire, native) = _array_dtypes(tmpl.packplan.array_layout())
+    arr = compat.get_numpy().empty(count, dtype=wire)
+    for e in tmpl.ies:
+        try:
+            col = columns[e.name]
+        except (KeyError, ValueError):
+            raise IpfixEncodeError("no column for "+e.name)
+        col = _wire_column(e, col)
+        _check_wire_column(e, col, wire.fields[e.name][0])
+        arr[e.name] = col
+    return arr
+
+def _check_wire_column(e, col, dtype):
+    # Refuse integer columns that won't fit the IE's wire type, as struct
+    # does when exporting records one by one; assignment would wrap them.
+    if dtype.kind not in "iu":
+        return
+    numpy = compat.get_numpy()
+    if col.dtype.kind in "iu":
+        if col.size:
+            info = numpy.iinfo(dtype)
+            (lo, hi) = (int(col.min()), int(col.max()))
+            if lo < info.min or hi > info.max:
+                raise IpfixEncodeError("value out of range for "+str(e)+
+                                       ": "+str(lo if lo < info.min else hi))
+    elif not numpy.can_cast(col.dtype, dtype, casting="safe"):
+        raise IpfixEncodeError("can't export "+str(col.dtype)+
+                               " values as "+str(e))
+
 class MessageBuffer(object):
     """
     Implements a buffer for reading or writing IPFIX messages.
 
+    Records read from the buffer are decoded according to the given
+    :class:`ipfix.types.DecodePolicy`, or to the default representation
+    for each type if None.
+
     """
-    def __init__(self, buf_sz=65536):
+    def __init__(self, buf_sz=65536, policy=None):
         """Create a new MessageBuffer instance."""
 
-        self.mbuf = compat.get_buffer(bytearray(buf_sz))
+        self.ownbuf = compat.get_buffer(bytearray(buf_sz))
+        self.mbuf = self.ownbuf
+        self.policy = policy
         self.length = 0
         self.sequence = None
         self.export_epoch = None
@@ -236,7 +335,7 @@ class MessageBuffer(object):
         self.cursetid = None
         self.curtmpl = None
 
-        self.last_tuple_iterator_ielist = None
+        self.last_accept_key = None
 
         self.mtu = 65535
 
@@ -285,9 +384,9 @@ class MessageBuffer(object):
         self.export_epoch = types._encode_sec(dt)
         self.auto_export_time = False
 
-    def _increment_sequence(self):
+    def _increment_sequence(self, inc = 1):
         self.sequences.setdefault((self.odid, self.streamid), 0)
-        self.sequences[(self.odid, self.streamid)] += 1
+        self.sequences[(self.odid, self.streamid)] += inc
 
     def _scan_setlist(self):
         # We've read a message. Discard all export state.
@@ -301,58 +400,84 @@ class MessageBuffer(object):
 
         while (offset < self.length):
             (setid, setlen) = _sethdr_st.unpack_from(self.mbuf, offset)
+            if setlen < _sethdr_st.size:
+                raise IpfixDecodeError("Illegal set length " + str(setlen))
             if offset + setlen > self.length:
                 raise IpfixDecodeError("Set too long for message")
             self.setlist.append((offset, setid, setlen))
             offset += setlen
 
+    def _read_into(self, stream, start, end):
+        # Read from a stream into the message buffer, directly if the stream
+        # supports readinto, returning the number of bytes read.
+        readinto = getattr(stream, "readinto", None)
+        if readinto is None or not isinstance(self.mbuf, memoryview):
+            data = stream.read(end - start)
+            self.mbuf[start:start+len(data)] = data
+            return len(data)
+
+        offset = start
+        while offset < end:
+            count = readinto(self.mbuf[offset:end])
+            if not count:
+                break
+            offset += count
+        return offset - start
+
+    def _parse_header(self):
+        # parse the message header in the message buffer
+        (version, self.length, self.export_epoch, self.sequence, self.odid) = \
+                _msghdr_st.unpack_from(self.mbuf, 0)
+
+        # verify version and length
+        if version != 10:
+            raise IpfixDecodeError("Illegal or unsupported version " +
+                                       str(version))
+
+        if self.length < 20:
+            raise IpfixDecodeError("Illegal message length" +
+                                       str(self.length))
+
+    def _message_read(self):
+        # call the message header hook
+        if self.message_header_hook:
+            self.message_header_hook(self)
+
+        # populate setlist
+        self._scan_setlist()
+
     def read_message(self, stream):
         """Read a IPFIX message from a stream.
 
         This populates message header fields and the internal setlist.
         Call for each new message before iterating over records when reading
-        from a stream.
+        from a stream. The message is read directly into the buffer if the
+        stream supports readinto().
 
         :param stream: stream to read from
         :raises: IpfixDecodeError
 
         """
+        self.mbuf = self.ownbuf
 
         # deframe and parse message header
-        msghdr = stream.read(_msghdr_st.size)
-        if (len(msghdr) == 0):
+        hdrlen = self._read_into(stream, 0, _msghdr_st.size)
+        if (hdrlen == 0):
             raise EOFError()
-        elif (len(msghdr) < _msghdr_st.size):
+        elif (hdrlen < _msghdr_st.size):
             raise IpfixDecodeError("Short read in message header ("+
-                                       str(len(msghdr)) +")")
+                                       str(hdrlen) +")")
 
-        self.mbuf[0:_msghdr_st.size] = msghdr
-        (version, self.length, self.export_epoch, self.sequence, self.odid) = \
-                _msghdr_st.unpack_from(self.mbuf, 0)
-
-        # verify version and length
-        if version != 10:
-            raise IpfixDecodeError("Illegal or unsupported version " +
-                                       str(version))
-
-        if self.length < 20:
-            raise IpfixDecodeError("Illegal message length" +
-                                       str(self.length))
+        self._parse_header()
 
         # read the rest of the message into the buffer
-        msgbody = stream.read(self.length-_msghdr_st.size)
-        if len(msgbody) < self.length - _msghdr_st.size:
+        bodylen = self._read_into(stream, _msghdr_st.size, self.length)
+        if bodylen < self.length - _msghdr_st.size:
             raise IpfixDecodeError("Short read in message body (got "+
-                                   str(len(msgbody))+", expected "+
+                                   str(bodylen)+", expected "+
                                    str(self.length - _msghdr_st.size)+")")
-        self.mbuf[_msghdr_st.size:self.length] = msgbody
-        
-        # call the message header hook
-        if self.message_header_hook:
-            self.message_header_hook(self)
 
-        # populate setlist
-        self._scan_setlist()
+        self._message_read()
 
     def from_bytes(self, str_):
         """
@@ -360,18 +485,75 @@ class MessageBuffer(object):
 
         This populates message header fields and the internal setlist.
         Call for each new message before iterating over records when reading
-        from a byte array.
+        from a byte array. The message is copied into the buffer; see
+        :meth:`from_buffer` to decode a message in place.
 
         :param bytes: a byte array containing a complete IPFIX message.
         :raises: IpfixDecodeError
 
         """
-        return self.read_message(io.BytesIO(str_))
-            
+        self.mbuf = self.ownbuf
+
+        if len(str_) == 0:
+            raise EOFError()
+        elif len(str_) < _msghdr_st.size:
+            raise IpfixDecodeError("Short read in message header ("+
+                                       str(len(str_)) +")")
+
+        self.mbuf[0:_msghdr_st.size] = str_[0:_msghdr_st.size]
+        self._parse_header()
+
+        if len(str_) < self.length:
+            raise IpfixDecodeError("Short read in message body (got "+
+                                   str(len(str_) - _msghdr_st.size)+
+                                   ", expected "+
+                                   str(self.length - _msghdr_st.size)+")")
+        self.mbuf[_msghdr_st.size:self.length] = \
+                str_[_msghdr_st.size:self.length]
+
+        self._message_read()
+
+    def from_buffer(self, buf):
+        """
+        Read an IPFIX message in place from a buffer, without copying it.
+
+        This populates message header fields and the internal setlist, like
+        :meth:`from_bytes`, but decodes records directly from the given
+        buffer, e.g. a received datagram or a region of a memory-mapped
+        file. The buffer must not be modified while records are being read
+        from the message; record views and values decoded as memoryviews
+        refer to it. The next message exported resets the MessageBuffer to
+        its own buffer.
+
+        :param buf: an object supporting the buffer protocol (e.g. a
+                    memoryview), starting with a complete IPFIX message;
+                    any data following the message is ignored.
+        :raises: IpfixDecodeError
+
+        """
+        buf = memoryview(buf)
+        if len(buf) == 0:
+            raise EOFError()
+        elif len(buf) < _msghdr_st.size:
+            raise IpfixDecodeError("Short read in message header ("+
+                                       str(len(buf)) +")")
+
+        self.mbuf = buf
+        self._parse_header()
+
+        if len(buf) < self.length:
+            raise IpfixDecodeError("Short read in message body (got "+
+                                   str(len(buf) - _msghdr_st.size)+
+                                   ", expected "+
+                                   str(self.length - _msghdr_st.size)+")")
+
+        self._message_read()
+
     def record_iterator(self, 
                         decode_fn=template.Template.decode_namedict_from, 
                         tmplaccept_fn=accept_all_templates, 
-                        recinf=None):
+                        recinf=None,
+                        recfilter=None):
         """
         Low-level interface to record iteration.
 
@@ -390,9 +572,102 @@ class MessageBuffer(object):
                               templates for which this function returns False
                               will be skipped.
         :param recinf: Record information opaquely passed to decode function
+        :param recfilter: An :class:`ipfix.recfilter.RecordFilter`; if given,
+                          only records matching the filter are decoded.
+                          tmplaccept_fn must reject templates the filter
+                          does not accept.
         :returns: an iterator over records decoded by decode_fn.
 
         """
+        if recfilter is not None:
+            for rec in self._filtered_record_iterator(decode_fn, tmplaccept_fn,
+                                                      recinf, recfilter):
+                yield rec
+            return
+
+        for (tmpl, offset, setend) in self._data_set_iterator(tmplaccept_fn):
+            while offset + tmpl.minlength <= setend:
+                (rec, offset) = decode_fn(tmpl, self.mbuf, offset,
+                                          recinf = recinf)
+                yield rec
+                self._increment_sequence()
+
+    def _filtered_record_iterator(self, decode_fn, tmplaccept_fn,
+                                  recinf, recfilter):
+        # Iterate over records matching a filter; non-matching records are
+        # skipped without decoding.
+        for (tmpl, offset, setend) in self._data_set_iterator(tmplaccept_fn):
+            for rec in self._filtered_set_iterator(tmpl, offset, setend,
+                                                   decode_fn, recinf,
+                                                   recfilter):
+                yield rec
+
+    def _filtered_set_iterator(self, tmpl, offset, setend,
+                               decode_fn, recinf, recfilter):
+        # Iterate over the records in one data set matching a filter
+        match = recfilter.matcher_for(tmpl)
+        if tmpl.varlenslice is None:
+            skip = None
+        else:
+            skip = tmpl.scanplan.decode_tuple
+        while offset + tmpl.minlength <= setend:
+            if match(self.mbuf, offset):
+                (rec, offset) = decode_fn(tmpl, self.mbuf, offset,
+                                          recinf = recinf)
+                yield rec
+            elif skip:
+                offset = skip(self.mbuf, offset)[1]
+            else:
+                offset += tmpl.minlength
+            self._increment_sequence()
+
+    def record_batch_iterator(self,
+                        decode_fn=template.Template.decode_namedicts_from,
+                        tmplaccept_fn=accept_all_templates,
+                        recinf=None,
+                        recfilter=None):
+        """
+        Low-level interface to batch record iteration.
+
+        Like :meth:`record_iterator`, but decodes each data set in the
+        message at once, and yields a list of records per set. Sequence
+        numbers are accounted once per set. For templates without
+        variable-length IEs, the entire set is unpacked in one pass.
+
+        :param decode_fn: Function used to decode a set of records;
+                          must be an (unbound) batch "decode" instance method
+                          of the :class:`ipfix.template.Template` class, i.e.
+                          decode_namedicts_from or decode_tuples_from.
+        :param tmplaccept_fn: Function returning True if the given template
+                              is of interest to the caller, False if not.
+                              Default accepts all templates.
+        :param recinf: Record information opaquely passed to decode function
+        :param recfilter: An :class:`ipfix.recfilter.RecordFilter`; if given,
+                          only records matching the filter are decoded,
+                          one at a time, and sets with no matching records
+                          yield empty lists. tmplaccept_fn must reject
+                          templates the filter does not accept.
+        :returns: an iterator over lists of records decoded by decode_fn.
+
+        """
+        if recfilter is not None:
+            record_decode_fn = _record_decode_fns[decode_fn]
+            for (tmpl, offset, setend) in \
+                    self._data_set_iterator(tmplaccept_fn):
+                yield list(self._filtered_set_iterator(tmpl, offset, setend,
+                                                       record_decode_fn,
+                                                       recinf, recfilter))
+            return
+
+        for (tmpl, offset, setend) in self._data_set_iterator(tmplaccept_fn):
+            recs = decode_fn(tmpl, self.mbuf, offset, setend, recinf = recinf)
+            self._increment_sequence(len(recs))
+            yield recs
+
+    def _data_set_iterator(self, tmplaccept_fn):
+        # Iterate over sets in the message, handling templates in set order,
+        # and yield (template, offset of first record, end offset) for each
+        # data set described by an accepted template.
         for (offset, setid, setlen) in self.setlist:
             setend = offset + setlen
             offset += _sethdr_st.size # skip set header in decode
@@ -400,8 +675,14 @@ class MessageBuffer(object):
                setid == template.OPTIONS_SET_ID:
                 while offset < setend:
                     (tmpl, offset) = template.decode_template_from(
-                                              self.mbuf, offset, setid)
-                    # FIXME handle withdrawal
+                                              self.mbuf, offset, setid,
+                                              self.policy)
+                    if not tmpl.count():
+                        # template withdrawal: no fields
+                        self.templates.pop((self.odid, tmpl.tid), None)
+                        self.accepted_tids.discard((self.odid, tmpl.tid))
+                        continue
+
                     self.templates[(self.odid, tmpl.tid)] = tmpl
                     if tmplaccept_fn(tmpl):
                         self.accepted_tids.add((self.odid, tmpl.tid))
@@ -416,65 +697,230 @@ class MessageBuffer(object):
             else:
                 try:
                     tmpl = self.templates[(self.odid, setid)]
-                    if (self.odid, setid) in self.accepted_tids:
-                        while offset + tmpl.minlength <= setend:
-                            (rec, offset) = decode_fn(tmpl, self.mbuf, offset,
-                                                      recinf = recinf)
-                            yield rec
-                            self._increment_sequence()
-                    elif self.ignored_data_set_hook:
-                        # not in accepted tids - ignored data set
-                        self.ignored_data_set_hook(self, tmpl,
-                                     self.mbuf[offset-_sethdr_st.size:setend])
-                except KeyError as e:
+                except KeyError:
                     if self.unknown_data_set_hook:
                         # KeyError on template lookup - unknown data set
                         self.unknown_data_set_hook(self,
                                      self.mbuf[offset-_sethdr_st.size:setend])
+                    continue
+
+                if not tmpl.minlength:
+                    # records of no length can't be counted or decoded
+                    warn("skipping data set for empty template "+str(setid))
+                    continue
 
-    def namedict_iterator(self):
+                if (self.odid, setid) in self.accepted_tids:
+                    yield (tmpl, offset, setend)
+                elif self.ignored_data_set_hook:
+                    # not in accepted tids - ignored data set
+                    self.ignored_data_set_hook(self, tmpl,
+                                 self.mbuf[offset-_sethdr_st.size:setend])
+
+    def namedict_iterator(self, recfilter=None):
         """
         Iterate over all records in the Message, as dicts mapping IE names
         to values.
 
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
         :returns: a name dictionary iterator
 
         """
 
         return self.record_iterator(
-                decode_fn = template.Template.decode_namedict_from)
+                decode_fn = template.Template.decode_namedict_from,
+                tmplaccept_fn = self._accept_fn(None, recfilter),
+                recfilter = recfilter)
+
+    def namedict_batch_iterator(self, recfilter=None):
+        """
+        Iterate over all data sets in the Message, as lists of dicts mapping
+        IE names to values, one list per set.
+
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
+        :returns: a name dictionary list iterator
+
+        """
+
+        return self.record_batch_iterator(
+                decode_fn = template.Template.decode_namedicts_from,
+                tmplaccept_fn = self._accept_fn(None, recfilter),
+                recfilter = recfilter)
+
+    def view_iterator(self):
+        """
+        Iterate over all records in the Message, as
+        :class:`ipfix.template.RecordView` instances, which decode IEs only
+        when accessed by name. Views are only valid until the next message
+        is read into this MessageBuffer.
+
+        :returns: a record view iterator
+
+        """
+
+        return self.record_iterator(
+                decode_fn = template.Template.decode_view_from,
+                tmplaccept_fn = self._accept_fn())
 
     def _recache_accepted_tids(self, tmplaccept_fn):
-        for tid in self.active_template_ids():
-            if tmplaccept_fn(self.templates[(self.odid, tid)]):
-                self.accepted_tids.add((self.odid, tid))
+        # reevaluate acceptance of templates in all domains
+        for (tkey, tmpl) in self.templates.items():
+            if tmplaccept_fn(tmpl):
+                self.accepted_tids.add(tkey)
             else:
-                self.accepted_tids.discard((self.odid, tid))
+                self.accepted_tids.discard(tkey)
 
-    def tuple_iterator(self, ielist):
+    def set_templates(self, templates):
+        """
+        Replace the templates known to this MessageBuffer, e.g. to continue
+        reading a file from a point after its templates were defined.
+
+        :param templates: dict mapping (odid, template ID) to
+                          :class:`ipfix.template.Template`
+
+        """
+        self.templates = dict(templates)
+        self.accepted_tids = set()
+        self.last_accept_key = None
+
+    def _accept_fn(self, ielist=None, recfilter=None):
+        # get a template acceptance function for templates containing all
+        # IEs in ielist (if given) and accepted by recfilter (if given),
+        # recaching accepted templates if either has changed
+        if ielist is None:
+            ielist = ()
+        if recfilter is None:
+            tmplaccept_fn = lambda tmpl: \
+                    all(ie in tmpl.ies for ie in ielist)
+        else:
+            tmplaccept_fn = lambda tmpl: \
+                    recfilter.accepts(tmpl) and \
+                    all(ie in tmpl.ies for ie in ielist)
+
+        last = self.last_accept_key
+        if ((last is None) or
+            (ielist is not last[0]) or (recfilter is not last[1])):
+                self._recache_accepted_tids(tmplaccept_fn)
+        self.last_accept_key = (ielist, recfilter)
+
+        return tmplaccept_fn
+
+    def tuple_iterator(self, ielist, recfilter=None):
         """
         Iterate over all records in the Message containing all the IEs in
         the given ielist. Records are returned as tuples in ielist order.
 
         :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
                        listing IEs to return as a tuple
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
         :returns: a tuple iterator for tuples as in ielist order
 
         """
 
-        tmplaccept_fn = lambda tmpl: \
-                reduce(operator.__and__,
-                                 (ie in tmpl.ies for ie in ielist))
-
-        if ((not self.last_tuple_iterator_ielist) or
-            (ielist is not self.last_tuple_iterator_ielist)):
-                self._recache_accepted_tids(tmplaccept_fn)
-        self.last_tuple_iterator_ielist = ielist
+        tmplaccept_fn = self._accept_fn(ielist, recfilter)
 
         return self.record_iterator(
                 decode_fn = template.Template.decode_tuple_from,
                 tmplaccept_fn = tmplaccept_fn,
-                recinf = ielist)
+                recinf = ielist,
+                recfilter = recfilter)
+
+    def tuple_batch_iterator(self, ielist, recfilter=None):
+        """
+        Iterate over all data sets in the Message described by templates
+        containing all the IEs in the given ielist. Records are returned as
+        lists of tuples in ielist order, one list per set.
+
+        :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
+                       listing IEs to return as a tuple
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
+        :returns: a tuple list iterator for tuples as in ielist order
+
+        """
+        tmplaccept_fn = self._accept_fn(ielist, recfilter)
+
+        return self.record_batch_iterator(
+                decode_fn = template.Template.decode_tuples_from,
+                tmplaccept_fn = tmplaccept_fn,
+                recinf = ielist,
+                recfilter = recfilter)
+
+    def set_array_iterator(self,
+                           tmplaccept_fn=accept_all_templates,
+                           recinf=None):
+        """
+        Low-level interface to array iteration.
+
+        Iterate over data sets in an IPFIX message previously read with
+        :meth:`read_message()` or :meth:`from_bytes()`, returning the records
+        in each set as a single NumPy structured array, without creating a
+        Python object per record. Automatically handles templates in set
+        order. Only sets described by templates without variable-length IEs
+        can be decoded this way; other sets are skipped.
+
+        Array fields are named after IEs, and hold values in their wire
+        representation; see
+        :meth:`ipfix.template.TemplatePackingPlan.array_layout`. Arrays are
+        copies in native byte order, and remain valid after the next message
+        is read.
+
+        Requires NumPy.
+
+        :param tmplaccept_fn: Function returning True if the given template
+                              is of interest to the caller, False if not.
+                              Default accepts all templates.
+        :param recinf: an :class:`ipfix.ie.InformationElementList` listing IEs
+                       to return as array fields, or None to return all IEs
+                       in the template.
+        :returns: an iterator over structured arrays, one per data set.
+
+        """
+        numpy = compat.get_numpy()
+        if numpy is None:
+            raise ImportError("array decoding requires numpy")
+
+        for (tmpl, offset, setend) in self._data_set_iterator(tmplaccept_fn):
+            if tmpl.varlenslice is not None:
+                continue
+
+            if recinf:
+                packplan = tmpl.packplan_for_ielist(recinf)
+            else:
+                packplan = tmpl.packplan
+
+            count = (setend - offset) // tmpl.minlength
+            (wire, native) = _array_dtypes(packplan.array_layout())
+            yield numpy.frombuffer(self.mbuf, dtype=wire, count=count,
+                                   offset=offset).astype(native)
+            self._increment_sequence(count)
+
+    def array_iterator(self, ielist):
+        """
+        Iterate over all data sets in the Message described by templates
+        containing all the IEs in the given ielist and no variable-length IEs.
+        Records in each set are returned as a NumPy structured array with
+        fields named after the IEs in ielist, in ielist order; see
+        :meth:`set_array_iterator`.
+
+        :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
+                       listing IEs to return as array fields
+        :returns: an iterator over structured arrays, one per data set
+
+        """
+
+        tmplaccept_fn = lambda tmpl: \
+                tmpl.varlenslice is None and \
+                all(ie in tmpl.ies for ie in ielist)
+
+        # acceptance differs from the tuple interface; recache both ways
+        self._recache_accepted_tids(tmplaccept_fn)
+        self.last_accept_key = None
+
+        return self.set_array_iterator(tmplaccept_fn = tmplaccept_fn,
+                                       recinf = ielist)
 
     def to_bytes(self):
         """
@@ -484,6 +930,17 @@ class MessageBuffer(object):
 
         :returns: message as a byte array
 
+        """
+        return self.to_view().tobytes()
+
+    def to_view(self):
+        """
+        Finalize this MessageBuffer as for :meth:`to_bytes`, and return a
+        memoryview of the message in the buffer, without copying it. The
+        view is only valid until the next call to :meth:`begin_export`.
+
+        :returns: message as a memoryview
+
         """
 
         # Close final set
@@ -495,16 +952,17 @@ class MessageBuffer(object):
             self.export_epoch = int(compat.datetime_to_timestamp(dt))
 
         # Update message header in buffer
-        _msghdr_st.pack_into(self.mbuf, 0, 10, self.length, 
+        _msghdr_st.pack_into(self.mbuf, 0, 10, self.length,
                              self.export_epoch, self.sequence, self.odid)
-        
-        return self.mbuf[0:self.length].tobytes()
+
+        return self.mbuf[0:self.length]
 
     def write_message(self, stream):
         """
-        Convenience method to write a message to a stream; see :meth:`to_bytes`.
+        Convenience method to write a message to a stream, directly from the
+        message buffer; see :meth:`to_view`.
         """
-        stream.write(self.to_bytes())
+        stream.write(self.to_view())
 
     def add_template(self, tmpl, export=True):
         """
@@ -587,6 +1045,7 @@ class MessageBuffer(object):
             self.odid = odid
 
         # reset message and zero header
+        self.mbuf = self.ownbuf
         self.length = _msghdr_st.size
         self.cursetoff = self.length
         self.mbuf[0:_msghdr_st.size] = bytearray([0] * _msghdr_st.size)
@@ -753,3 +1212,165 @@ class MessageBuffer(object):
 
         """
         self.export_record(rec, template.Template.encode_tuple_to)
+
+    def export_object(self, rec):
+        """
+        Export a record to the message, using the template for the current Set
+        ID. The record is an object with an attribute named for each IE in
+        the template, e.g. a namedtuple.
+
+        :param rec: the record to export, as an object
+        :raises: EndOfMessage
+
+        """
+        self.export_record(rec, template.Template.encode_object_to)
+
+    def _export_records(self, recs, start, encode_index):
+        # Encode records from recs[start:] into the current set until the
+        # message is full, and return the index of the first record not
+        # exported.
+        tmpl = self.curtmpl
+        if tmpl is None:
+            raise IpfixEncodeError("can't export records without a data set")
+        encode = tmpl.compiled_encoders()[encode_index]
+        buf = self.mbuf
+        length = self.length
+        limit = min(self.mtu, len(buf))
+
+        if tmpl.varlenslice is None:
+            # every record has the same length: export as many as fit
+            end = min(len(recs), start + (limit - length) // tmpl.minlength)
+            try:
+                for rec in recs[start:end]:
+                    length = encode(buf, length, rec)
+            except _record_encode_errors as e:
+                # keep the records before the one we can't encode
+                count = (length - self.length) // tmpl.minlength
+                self.length = length
+                self._increment_sequence(count)
+                raise _record_encode_error(start + count, e)
+        else:
+            end = start
+            for rec in recs[start:]:
+                try:
+                    reclength = encode(buf, length, rec)
+                except _record_encode_errors:
+                    # the record runs off the end of the buffer, or has a
+                    # value that can't be encoded: find out which by
+                    # encoding it on its own.
+                    try:
+                        reclength = length + encode(_scratch_buffer(), 0, rec)
+                    except _record_encode_errors as e:
+                        # keep the records before the one we can't encode
+                        self.length = length
+                        self._increment_sequence(end - start)
+                        raise _record_encode_error(end, e)
+                if reclength > limit:
+                    break
+                length = reclength
+                end += 1
+
+        self.length = length
+        self._increment_sequence(end - start)
+        return end
+
+    def export_tuples(self, recs, start=0):
+        """
+        Export as many records as fit into the message, using the template
+        for the current Set ID. Each record is a tuple of values in template
+        order. For templates without variable-length IEs, the number of
+        records that fit is computed up front.
+
+        :param recs: the records to export, as a list of tuples
+        :param start: index of the first record in recs to export
+        :returns: the index of the first record not exported; equal to
+                  len(recs) if all records were exported.
+        :raises: IpfixEncodeError if a record can't be encoded; the records
+                 before it are exported, and the exception's index
+                 attribute is the index of the record.
+
+        """
+        return self._export_records(recs, start, 0)
+
+    def export_namedicts(self, recs, start=0):
+        """
+        Export as many records as fit into the message, using the template
+        for the current Set ID. Each record is a dictionary mapping IE names
+        to values, as for :meth:`export_namedict`.
+
+        :param recs: the records to export, as a list of dicts
+        :param start: index of the first record in recs to export
+        :returns: the index of the first record not exported; equal to
+                  len(recs) if all records were exported.
+        :raises: IpfixEncodeError if a record can't be encoded; the records
+                 before it are exported, and the exception's index
+                 attribute is the index of the record.
+
+        """
+        return self._export_records(recs, start, 1)
+
+    def export_array(self, arr, start=0):
+        """
+        Export as many records as fit into the message from a NumPy
+        structured array, using the template for the current Set ID, which
+        must not contain variable-length IEs. Records are converted to the
+        template's wire layout in bulk, and copied into the message at once.
+
+        The array must have a field named for each IE in the template,
+        holding values in the representation returned by
+        :meth:`set_array_iterator`: timestamps as integers in the units of
+        their type (or as datetime64), IPv4 addresses as integers, and other
+        octet arrays as bytes. Requires NumPy.
+
+        :param arr: the records to export, as a structured array
+        :param start: index of the first record in arr to export
+        :returns: the index of the first record not exported; equal to
+                  len(arr) if all records were exported.
+        :raises: IpfixEncodeError
+
+        """
+        numpy = compat.get_numpy()
+        if numpy is None:
+            raise ImportError("array export requires numpy")
+
+        tmpl = self.curtmpl
+        if tmpl is None:
+            raise IpfixEncodeError("can't export records without a data set")
+        if tmpl.varlenslice is not None:
+            raise IpfixEncodeError("can't export array with "+repr(tmpl)+
+                                   " with variable-length IEs")
+
+        limit = min(self.mtu, len(self.mbuf))
+        count = min(len(arr) - start,
+                    (limit - self.length) // tmpl.minlength)
+        if count <= 0:
+            return start
+
+        chunk = arr[start:start + count]
+        if chunk.dtype != _array_dtypes(tmpl.packplan.array_layout())[0]:
+            chunk = _wire_array(tmpl, chunk, count)
+        else:
+            chunk = numpy.ascontiguousarray(chunk)
+
+        size = count * tmpl.minlength
+        self.mbuf[self.length:self.length + size] = chunk.view(numpy.uint8)
+        self.length += size
+        self._increment_sequence(count)
+        return start + count
+
+    def export_objects(self, recs, start=0):
+        """
+        Export as many records as fit into the message, using the template
+        for the current Set ID. Each record is an object with an attribute
+        named for each IE in the template, as for :meth:`export_object`.
+
+        :param recs: the records to export, as a list of objects
+        :param start: index of the first record in recs to export
+        :returns: the index of the first record not exported; equal to
+                  len(recs) if all records were exported.
+        :raises: IpfixEncodeError if a record can't be encoded; the records
+                 before it are exported, and the exception's index
+                 attribute is the index of the record.
+
+        """
+        return self._export_records(recs, start, 2)
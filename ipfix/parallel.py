@@ -0,0 +1,300 @@
+#
+# python-ipfix (c) 2013-2014 Brian Trammell.
+#
+# Many thanks to the mPlane consortium (http://www.ict-mplane.eu) for
+# its material support of this effort.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Parallel decoding of IPFIX files (see :rfc:`5655`) on multiple processes.
+
+A :class:`ParallelFileReader` splits a file into chunks at message
+boundaries, and decodes the chunks in a pool of worker processes. Each
+worker is given the template records valid at the start of its chunk,
+so chunks can be decoded independently of each other. Results are
+returned per chunk, as lists of tuples or dicts, or as NumPy arrays,
+in file order or as they become available:
+
+>>> import ipfix.ie
+>>> import ipfix.parallel
+>>> import ipfix.testutils
+>>> import tempfile
+>>> ipfix.ie.use_iana_default()
+>>> f = tempfile.NamedTemporaryFile()
+>>> ipfix.testutils.mktest_file(f, msg_count=64)
+>>> f.flush()
+>>> r = ipfix.parallel.from_file(f.name, max_workers=2, chunk_size=4096)
+>>> ielist = ipfix.ie.spec_list(["packetDeltaCount"])
+>>> sum(len(recs) for recs in r.tuple_batch_iterator(ielist))
+1024
+
+Records are pickled to be returned from the workers. Returning arrays,
+or tuples with a :class:`ipfix.types.DecodePolicy` representing values as
+integers, is much faster than returning Python objects.
+
+"""
+
+
+from . import ie, types, template, message, reader, recfilter, compat
+
+import collections
+import os
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+def _init_worker(specs):
+    # Load the parent's information model into a worker process.
+    for spec in specs:
+        ie.for_spec(spec)
+
+def _decode_chunk(filename, start, end, tmplrecs, policy_options,
+                  mode, ielist_specs, filter_expr):
+    # Decode the messages in a chunk of a file, given the template records
+    # valid at its start. Runs in a worker process.
+    if policy_options is None:
+        policy = None
+    else:
+        policy = types.DecodePolicy(**policy_options)
+
+    if ielist_specs is None:
+        ielist = None
+    else:
+        ielist = ie.spec_list(ielist_specs)
+
+    if filter_expr is None:
+        rf = None
+    else:
+        rf = recfilter.for_expression(filter_expr)
+
+    with open(filename, mode="rb") as f:
+        f.seek(start)
+        buf = memoryview(f.read(end - start))
+
+    msg = message.MessageBuffer(policy=policy)
+    msg.set_templates(dict(((odid, tid), template.decode_template_from(
+                                                 rec, 0, setid, policy)[0])
+                           for ((odid, tid), (setid, rec)) in
+                           tmplrecs.items()))
+
+    results = []
+    offset = 0
+    while offset < len(buf):
+        msg.from_buffer(buf[offset:])
+        offset += msg.length
+        if mode == "tuples":
+            if rf is None:
+                for recs in msg.tuple_batch_iterator(ielist):
+                    results.extend(recs)
+            else:
+                results.extend(msg.tuple_iterator(ielist, rf))
+        elif mode == "namedicts":
+            if rf is None:
+                for recs in msg.namedict_batch_iterator():
+                    results.extend(recs)
+            else:
+                results.extend(msg.namedict_iterator(rf))
+        else:
+            results.extend(msg.array_iterator(ielist))
+
+    if mode == "arrays":
+        if not results:
+            return None
+        return _concatenate_arrays(results)
+    return results
+
+def _concatenate_arrays(arrays):
+    # Concatenate structured arrays from different templates, whose fields
+    # may have different types (e.g. the same IE in different reduced
+    # lengths), converting them to a common type first.
+    numpy = compat.get_numpy()
+    dtypes = list(set(arr.dtype for arr in arrays))
+    if len(dtypes) > 1:
+        err = ValueError("can't combine arrays of types " +
+                         ", ".join(str(dtype) for dtype in dtypes))
+        names = dtypes[0].names
+        if any(dtype.names != names for dtype in dtypes):
+            raise err
+        try:
+            common = numpy.dtype([
+                (name, numpy.result_type(*[dtype[name] for dtype in dtypes]))
+                for name in names])
+        except TypeError:
+            raise err
+        arrays = [arr.astype(common) for arr in arrays]
+    return numpy.concatenate(arrays)
+
+class ParallelFileReader(object):
+    """
+    Reads records from an IPFIX file in parallel, on a pool of worker
+    processes. Use :func:`from_file` to get an instance.
+
+    The file is indexed when the reader is created, in a single pass over
+    its message and set headers (see :class:`ipfix.reader.MappedFileReader`),
+    then split into chunks of about chunk_size bytes. Records are decoded
+    according to the given :class:`ipfix.types.DecodePolicy`, if any.
+
+    """
+    def __init__(self, filename, policy=None, max_workers=None,
+                 chunk_size=8388608):
+        self.filename = filename
+        self.policy = policy
+        self.max_workers = max_workers
+        self.chunks = []
+
+        with open(filename, mode="rb") as f:
+            with reader.MappedFileReader(f) as mfr:
+                self._split(mfr, chunk_size)
+
+    def _split(self, mfr, chunk_size):
+        # Split the file into chunks, recording the raw template records
+        # valid at the start of each chunk.
+        tmplrecs = {}
+        tsetidx = 0
+        chunkstart = None
+        for msgnum in range(len(mfr) + 1):
+            if msgnum < len(mfr):
+                offset = mfr.offsets[msgnum]
+            else:
+                offset = len(mfr.mview)
+
+            if chunkstart is None:
+                (chunkstart, chunktmpl) = (offset, dict(tmplrecs))
+            elif offset - chunkstart >= chunk_size or msgnum == len(mfr):
+                self.chunks.append((chunkstart, offset, chunktmpl))
+                (chunkstart, chunktmpl) = (offset, dict(tmplrecs))
+
+            # track template records defined or withdrawn in this message
+            while tsetidx < len(mfr.tsets) and \
+                  mfr.tsets[tsetidx][0] == msgnum:
+                (tmsgnum, setoff, setid, setlen) = mfr.tsets[tsetidx]
+                odid = mfr.odids[msgnum]
+                for (tid, start, end) in template._template_records(mfr.mview,
+                        setoff + message._sethdr_st.size, setoff + setlen,
+                        setid):
+                    if template._tmplhdr_st.unpack_from(mfr.mview, start)[1]:
+                        tmplrecs[(odid, tid)] = (setid,
+                                                 mfr.mview[start:end].tobytes())
+                    else:
+                        # template withdrawal: no fields
+                        tmplrecs.pop((odid, tid), None)
+                tsetidx += 1
+
+    def _iterate(self, mode, ielist, filter_expr, ordered):
+        if self.policy is None:
+            policy_options = None
+        else:
+            policy_options = self.policy.options
+        if ielist is None:
+            ielist_specs = None
+        else:
+            ielist_specs = [str(e) for e in ielist]
+        specs = [str(e) for e in ie.dump_infomodel()]
+
+        with ProcessPoolExecutor(max_workers=self.max_workers,
+                                 initializer=_init_worker,
+                                 initargs=(specs,)) as executor:
+            # keep a bounded number of chunks in flight
+            window = 2 * (self.max_workers or os.cpu_count() or 1)
+            pending = collections.deque()
+            chunks = iter(self.chunks)
+            while True:
+                for (start, end, tmplrecs) in chunks:
+                    pending.append(executor.submit(_decode_chunk,
+                                        self.filename, start, end, tmplrecs,
+                                        policy_options, mode, ielist_specs,
+                                        filter_expr))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    return
+
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done = wait(pending, return_when=FIRST_COMPLETED)[0]
+                    for future in done:
+                        pending.remove(future)
+
+                for future in done:
+                    result = future.result()
+                    if result is not None:
+                        yield result
+
+    def tuple_batch_iterator(self, ielist, recfilter=None, ordered=True):
+        """
+        Iterate over the records in the file described by templates
+        containing all the IEs in the given ielist. Records are returned as
+        lists of tuples in ielist order, one list per chunk.
+
+        :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
+                       listing IEs to return as a tuple
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
+        :param ordered: if True, return chunks in file order; otherwise,
+                        return chunks as soon as they are decoded.
+        :returns: an iterator over lists of tuples
+
+        """
+        return self._iterate("tuples", ielist,
+                             recfilter.expr if recfilter else None, ordered)
+
+    def namedict_batch_iterator(self, recfilter=None, ordered=True):
+        """
+        Iterate over the records in the file, as lists of dicts mapping
+        IE names to values, one list per chunk.
+
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
+        :param ordered: if True, return chunks in file order; otherwise,
+                        return chunks as soon as they are decoded.
+        :returns: an iterator over lists of dicts
+
+        """
+        return self._iterate("namedicts", None,
+                             recfilter.expr if recfilter else None, ordered)
+
+    def array_iterator(self, ielist, ordered=True):
+        """
+        Iterate over the records in the file described by templates
+        containing all the IEs in the given ielist and no variable-length
+        IEs, as NumPy structured arrays with fields in ielist order, one
+        array per chunk; see
+        :meth:`ipfix.message.MessageBuffer.set_array_iterator`.
+
+        :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
+                       listing IEs to return as array fields
+        :param ordered: if True, return chunks in file order; otherwise,
+                        return chunks as soon as they are decoded.
+        :returns: an iterator over structured arrays
+
+        """
+        return self._iterate("arrays", ielist, None, ordered)
+
+def from_file(filename, policy=None, max_workers=None, chunk_size=8388608):
+    """
+    Get a ParallelFileReader for a given file
+
+    :param filename: name of the IPFIX file to read
+    :param policy: :class:`ipfix.types.DecodePolicy` for decoding records,
+                   or None for the default representations
+    :param max_workers: number of worker processes; defaults to the number
+                        of CPUs
+    :param chunk_size: approximate size in bytes of the chunks of the file
+                       decoded by each worker task
+    :return: a :class:`ParallelFileReader` for the file.
+
+    """
+    return ParallelFileReader(filename, policy, max_workers, chunk_size)
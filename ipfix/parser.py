@@ -0,0 +1,237 @@
+#
+# python-ipfix (c) 2013-2014 Brian Trammell.
+#
+# Many thanks to the mPlane consortium (http://www.ict-mplane.eu) for
+# its material support of this effort.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Incremental, I/O-free parsing of IPFIX messages.
+
+An :class:`IpfixParser` is fed data as it arrives, in chunks of any size
+(e.g. from a non-blocking TCP socket) or as whole datagrams, and returns
+the records of each message as soon as the message is complete. It does
+no I/O itself, so it can be used with asyncio, selectors, or any other
+event loop; use one parser per transport session.
+
+>>> import ipfix.ie
+>>> import ipfix.parser
+>>> import ipfix.testutils
+>>> data = ipfix.testutils.mktest_message().to_bytes()
+>>> ielist = ipfix.ie.spec_list(["octetDeltaCount", "packetDeltaCount"])
+>>> p = ipfix.parser.IpfixParser(ielist=ielist)
+>>> p.feed(data[:100])
+[]
+>>> recs = p.feed(data[100:])
+>>> len(recs)
+128
+>>> recs[27]
+(27, 0)
+
+Complete messages are decoded in place in the data given to :meth:`feed`;
+only the parts of messages split across calls are buffered and copied.
+
+"""
+
+
+from . import message
+from .template import IpfixDecodeError
+
+import struct
+
+_msglen_st = struct.Struct("!HH")
+
+class IpfixParser(object):
+    """
+    A push parser for a stream or sequence of datagrams of IPFIX messages.
+
+    Records are returned as tuples in ielist order if an ielist is given,
+    and as dicts mapping IE names to values otherwise. If a recfilter is
+    given, only matching records are returned. Records are decoded
+    according to the given :class:`ipfix.types.DecodePolicy`, if any.
+
+    The underlying :class:`ipfix.message.MessageBuffer` is available as
+    :attr:`msg`, e.g. to set hooks or examine templates.
+
+    """
+    def __init__(self, policy=None, ielist=None, recfilter=None):
+        self.msg = message.MessageBuffer(policy=policy)
+        self.ielist = ielist
+        self.recfilter = recfilter
+        self.pending = bytearray()
+        self.msgcount = 0
+
+        # (buffer, offset) of data not yet framed by the current call to
+        # messages(), kept if iteration stops early
+        self._unread = None
+        self._stopped = False
+
+    def __repr__(self):
+        return "<IpfixParser "+str(self.msgcount)+" messages, "+ \
+               str(len(self.pending))+" bytes pending>"
+
+    def reset(self):
+        """
+        Discard any partial message, e.g. when the transport session is
+        restarted. Partial data is discarded on decode errors. Templates
+        are kept.
+
+        """
+        self._unread = None
+        self._stopped = False
+        del self.pending[:]
+
+    def _save_unread(self):
+        # Keep the data not yet framed by a call to messages() which
+        # stopped early; it may contain complete messages
+        if self._unread is not None:
+            (buf, offset) = self._unread
+            self._unread = None
+            self.pending += buf[offset:]
+            self._stopped = True
+
+    def _message_length(self, buf, offset):
+        # Get the length of a message from its first four bytes
+        (version, length) = _msglen_st.unpack_from(buf, offset)
+        if version != 10:
+            raise IpfixDecodeError("Illegal or unsupported version " +
+                                   str(version))
+        if length < 20:
+            raise IpfixDecodeError("Illegal message length" + str(length))
+        return length
+
+    def messages(self, data):
+        """
+        Add data to the parser, and iterate over the messages it completes.
+        If iteration stops early (e.g. the caller fails to decode a
+        message), data following the last message yielded is kept, and
+        framed on the next call.
+
+        :param data: bytes, or any buffer, following the data previously
+                     fed to the parser
+        :returns: an iterator over the parser's
+                  :class:`ipfix.message.MessageBuffer`, holding each
+                  complete message in turn; valid until the next iteration.
+        :raises: IpfixDecodeError
+
+        """
+        self._save_unread()
+        if self._stopped:
+            # a previous call stopped early; frame the rest of its data first
+            self._stopped = False
+            self.pending += data
+            (data, self.pending) = (self.pending, bytearray())
+        buf = memoryview(data)
+        offset = 0
+
+        try:
+            if self.pending:
+                # complete a message started in a previous call
+                if len(self.pending) < _msglen_st.size:
+                    offset = _msglen_st.size - len(self.pending)
+                    self.pending += buf[0:offset]
+                    if len(self.pending) < _msglen_st.size:
+                        return
+                length = self._message_length(self.pending, 0)
+                end = min(len(buf), offset + length - len(self.pending))
+                self.pending += buf[offset:end]
+                offset = end
+                if len(self.pending) < length:
+                    return
+
+                # the message is consumed whether or not it can be read
+                self._unread = (buf, offset)
+                try:
+                    self.msg.from_bytes(self.pending)
+                finally:
+                    del self.pending[:]
+                self.msgcount += 1
+                yield self.msg
+
+            # decode complete messages in place
+            while len(buf) - offset >= _msglen_st.size:
+                length = self._message_length(buf, offset)
+                if len(buf) - offset < length:
+                    break
+                offset += length
+                self._unread = (buf, offset)
+                self.msg.from_buffer(buf[offset - length:offset])
+                self.msgcount += 1
+                yield self.msg
+
+            # keep the start of the next message
+            self._unread = None
+            self.pending += buf[offset:]
+        except IpfixDecodeError:
+            # don't fail the next call on the same data
+            self.reset()
+            raise
+        finally:
+            # unless a later call has already kept it
+            if self._unread is not None and self._unread[0] is buf:
+                self._save_unread()
+            # drop references to the caller's buffer
+            self.msg.mbuf = self.msg.ownbuf
+
+    def feed(self, data):
+        """
+        Add data to the parser, and decode the records in the messages it
+        completes.
+
+        :param data: bytes, or any buffer, following the data previously
+                     fed to the parser
+        :returns: a list of records, as tuples or dicts
+        :raises: IpfixDecodeError
+
+        """
+        recs = []
+        for msg in self.messages(data):
+            recs.extend(self.decode(msg))
+        return recs
+
+    def decode(self, msg):
+        """
+        Decode the records in a message yielded by :meth:`messages`.
+
+        :returns: a list of records, as tuples or dicts
+
+        """
+        if self.ielist is None:
+            return list(msg.namedict_iterator(self.recfilter))
+        else:
+            return list(msg.tuple_iterator(self.ielist, self.recfilter))
+
+    def feed_batches(self, data):
+        """
+        Add data to the parser, and decode the records in the messages it
+        completes as batches, one list of records per data set. If a
+        recfilter is given, batches hold only matching records, and may be
+        empty.
+
+        :param data: bytes, or any buffer, following the data previously
+                     fed to the parser
+        :returns: a list of lists of records, as tuples or dicts
+        :raises: IpfixDecodeError
+
+        """
+        batches = []
+        for msg in self.messages(data):
+            if self.ielist is None:
+                batches.extend(msg.namedict_batch_iterator(self.recfilter))
+            else:
+                batches.extend(msg.tuple_batch_iterator(self.ielist,
+                                                        self.recfilter))
+        return batches
@@ -19,11 +19,24 @@
 #
 
 """
-Interface to read IPFIX Messages from a stream.
+Interface to read IPFIX Messages from a stream, or with random access from
+a file.
 
 """
 
-from . import message
+from . import message, template, types
+from .template import IpfixDecodeError
+
+import array
+import bisect
+import mmap
+
+# file offsets need 64 bits
+try:
+    array.array("Q")
+    _offset_typecode = "Q"
+except ValueError:
+    _offset_typecode = "d"
 
 class MessageStreamReader(object):
     """
@@ -35,55 +48,460 @@ class MessageStreamReader(object):
 
     Suitable for reading from IPFIX files (see :rfc:`5655`) as well as from
     UDP or TCP sockets with :class:`socketserver.StreamRequestHandler`.
-    When opening a stream from a file, use mode='rb'.
+    When opening a stream from a file, use mode='rb'. Records are decoded
+    according to the given :class:`ipfix.types.DecodePolicy`, if any.
 
     """
-    def __init__(self, stream):
+    def __init__(self, stream, policy=None):
         self.stream = stream
-        self.msg = message.MessageBuffer()
+        self.msg = message.MessageBuffer(policy=policy)
         self.msgcount = 0
+        self.selection = None
 
-    def namedict_iterator(self):
+    def select_messages(self, index, msgnums):
+        """
+        Restrict the next iteration to the given messages, using an index
+        of the stream (see :mod:`ipfix.fileindex`). Before each message is
+        read, the stream is positioned at the message, after reading the
+        messages defining the templates it needs; other messages are not
+        read. The stream must be seekable.
+
+        :param index: a :class:`ipfix.fileindex.FileIndex` of the stream
+        :param msgnums: message numbers to read, in order, e.g. as returned
+                        by :meth:`ipfix.fileindex.FileIndex.messages_between`;
+                        None to read the whole stream again.
+
+        """
+        if msgnums is None:
+            self.selection = None
+            self.stream.seek(0)
+        else:
+            self.selection = (index, list(msgnums))
+
+    def _read_messages(self):
+        # Read each message of the stream, or of the selection, in turn.
+        if self.selection is None:
+            try:
+                while(True):
+                    self.msg.read_message(self.stream)
+                    yield self.msg
+            except EOFError:
+                return
+
+        (index, msgnums) = self.selection
+        self.selection = None
+        loaded = {}
+        for msgnum in msgnums:
+            odid = index.odids[msgnum]
+
+            # replay the template definitions for the data sets in the
+            # message, reading each defining message once, in file order,
+            # and taking only the templates needed from it
+            needed = {}
+            for tid in index.sets_present(msgnum):
+                defnum = index.definition_before(odid, tid, msgnum)
+                if defnum is not None and loaded.get((odid, tid)) != defnum:
+                    needed.setdefault(defnum, []).append(tid)
+            if needed:
+                templates = dict(self.msg.templates)
+                for defnum in sorted(needed):
+                    self._read_message_at(index, defnum)
+                    for _ in self.msg._data_set_iterator(lambda tmpl: False):
+                        pass
+                    for tid in needed[defnum]:
+                        tmpl = self.msg.templates.get((odid, tid))
+                        if tmpl is None:
+                            templates.pop((odid, tid), None)
+                        else:
+                            templates[(odid, tid)] = tmpl
+                        loaded[(odid, tid)] = defnum
+                    self.msg.set_templates(templates)
+
+            self._read_message_at(index, msgnum)
+            for deftid in index.templates_defined(msgnum):
+                loaded[(odid, deftid)] = msgnum
+            yield self.msg
+
+    def _read_message_at(self, index, msgnum):
+        self.stream.seek(index.offsets[msgnum])
+        self.msg.read_message(self.stream)
+
+    def namedict_iterator(self, recfilter=None):
         """
         Iterate over all records in the stream, as dicts mapping IE names
         to values.
 
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
         :returns: a name dictionary iterator
 
         """
-        try:
-            while(True):
-                self.msg.read_message(self.stream)
-                for name in self.msg.namedict_iterator():
-                    yield name
-                    self.msgcount += 1
-        except EOFError:
-            return
+        for msg in self._read_messages():
+            for name in msg.namedict_iterator(recfilter):
+                yield name
+                self.msgcount += 1
 
-    def tuple_iterator(self, ielist):
+    def view_iterator(self):
+        """
+        Iterate over all records in the stream, as
+        :class:`ipfix.template.RecordView` instances, which decode IEs only
+        when accessed by name. Views are only valid until the iterator moves
+        on to the next message, which may happen on any subsequent
+        iteration; use :meth:`ipfix.template.RecordView.as_namedict` to
+        keep a record.
+
+        :returns: a record view iterator
+
+        """
+        for msg in self._read_messages():
+            for view in msg.view_iterator():
+                yield view
+                self.msgcount += 1
+
+    def tuple_iterator(self, ielist, recfilter=None):
         """
         Iterate over all records in the stream containing all the IEs in
         the given ielist. Records are returned as tuples in ielist order.
 
         :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
                        listing IEs to return as a tuple
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
         :returns: a tuple iterator for tuples in ielist order
         """
-        try:
-            while(True):
-                self.msg.read_message(self.stream)
-                for tuple_ in self.msg.tuple_iterator(ielist):
-                    yield tuple_
-                    self.msgcount += 1
-        except EOFError:
-            return
-
-def from_stream(stream):
+        for msg in self._read_messages():
+            for tuple_ in msg.tuple_iterator(ielist, recfilter):
+                yield tuple_
+                self.msgcount += 1
+
+    def namedict_batch_iterator(self):
+        """
+        Iterate over all data sets in the stream, as lists of dicts mapping
+        IE names to values, one list per set.
+
+        :returns: a name dictionary list iterator
+
+        """
+        for msg in self._read_messages():
+            for recs in msg.namedict_batch_iterator():
+                yield recs
+                self.msgcount += 1
+
+    def tuple_batch_iterator(self, ielist):
+        """
+        Iterate over all data sets in the stream described by templates
+        containing all the IEs in the given ielist. Records are returned as
+        lists of tuples in ielist order, one list per set.
+
+        :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
+                       listing IEs to return as a tuple
+        :returns: a tuple list iterator for tuples in ielist order
+        """
+        for msg in self._read_messages():
+            for recs in msg.tuple_batch_iterator(ielist):
+                yield recs
+                self.msgcount += 1
+
+    def array_iterator(self, ielist):
+        """
+        Iterate over all data sets in the stream described by templates
+        containing all the IEs in the given ielist and no variable-length
+        IEs. Records in each set are returned as a NumPy structured array
+        with fields in ielist order;
+        see :meth:`ipfix.message.MessageBuffer.set_array_iterator`.
+
+        :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
+                       listing IEs to return as array fields
+        :returns: an iterator over structured arrays, one per data set
+        """
+        for msg in self._read_messages():
+            for array in msg.array_iterator(ielist):
+                yield array
+                self.msgcount += 1
+
+def from_stream(stream, policy=None):
     """
     Get a MessageStreamReader for a given stream
 
     :param stream: stream to read
+    :param policy: :class:`ipfix.types.DecodePolicy` for decoding records,
+                   or None for the default representations
     :return: a :class:`MessageStreamReader` wrapped around the stream.
 
     """
-    return MessageStreamReader(stream)
+    return MessageStreamReader(stream, policy)
+
+class MappedFileReader(object):
+    """
+    Reads records with random access from an IPFIX file (see :rfc:`5655`).
+
+    The file is memory-mapped, and indexed in a single pass over message
+    and set headers when opened: the index stores the offset, export time
+    and observation domain of each message, and the location of each
+    template set. Messages are then decoded in place from the mapping
+    (see :meth:`ipfix.message.MessageBuffer.from_buffer`), by message
+    number or by export time, with the templates valid at that point in the
+    file. Use :func:`from_file` to get an instance.
+
+    Records are decoded according to the given
+    :class:`ipfix.types.DecodePolicy`, if any. Record views and values
+    decoded as memoryviews refer to the mapping, and must be released before
+    the reader is closed.
+
+    """
+    # template state is checkpointed every this many template sets
+    checkpoint_interval = 256
+
+    def __init__(self, stream, policy=None):
+        self.stream = stream
+        self.policy = policy
+        self.msg = message.MessageBuffer(policy=policy)
+
+        try:
+            self.mmap = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mview = memoryview(self.mmap)
+        except ValueError:
+            # empty file
+            self.mmap = None
+            self.mview = memoryview(b"")
+
+        # message index
+        self.offsets = array.array(_offset_typecode)
+        self.export_epochs = array.array("L")
+        self.odids = array.array("L")
+
+        # template sets, by (message number, set offset, set id)
+        self.tsets = []
+
+        # template state checkpoints, by index into tsets
+        self.checkpoint_tsets = [0]
+        self.checkpoints = [{}]
+
+        self._templates = None
+        self._index()
+
+    def __len__(self):
+        return len(self.export_epochs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _index(self):
+        # Walk message and set headers, building the message index.
+        msghdr_st = message._msghdr_st
+        sethdr_st = message._sethdr_st
+        tsetids = (template.TEMPLATE_SET_ID, template.OPTIONS_SET_ID)
+        buf = self.mview
+        end = len(buf)
+        offset = 0
+        self.time_sorted = True
+        last_epoch = 0
+
+        while offset + msghdr_st.size <= end:
+            (version, length, epoch, sequence, odid) = \
+                    msghdr_st.unpack_from(buf, offset)
+            if version != 10:
+                raise IpfixDecodeError("Illegal or unsupported version " +
+                                       str(version) + " at offset " +
+                                       str(offset))
+            if length < 20 or offset + length > end:
+                raise IpfixDecodeError("Illegal message length " +
+                                       str(length) + " at offset " +
+                                       str(offset))
+
+            msgnum = len(self.export_epochs)
+            setoff = offset + msghdr_st.size
+            msgend = offset + length
+            while setoff < msgend:
+                (setid, setlen) = sethdr_st.unpack_from(buf, setoff)
+                if setlen < sethdr_st.size or setoff + setlen > msgend:
+                    raise IpfixDecodeError("Set too long for message at " +
+                                           "offset " + str(offset))
+                if setid in tsetids:
+                    self.tsets.append((msgnum, setoff, setid, setlen))
+                setoff += setlen
+
+            self.offsets.append(offset)
+            self.export_epochs.append(epoch)
+            self.odids.append(odid)
+            if epoch < last_epoch:
+                self.time_sorted = False
+            last_epoch = epoch
+            offset = msgend
+
+        if offset < end:
+            raise IpfixDecodeError("Short read in message header at offset " +
+                                   str(offset))
+
+    def close(self):
+        """
+        Close the reader, unmapping the file.
+
+        """
+        self.msg.mbuf = self.msg.ownbuf
+        self._templates = None
+        if self.mmap is not None:
+            if hasattr(self.mview, "release"):
+                self.mview.release()
+            self.mmap.close()
+            self.mmap = None
+
+    def export_time(self, msgnum):
+        """
+        Get the export time of a message.
+
+        :param msgnum: message number, counting from 0
+        :returns: the export time of the message, as a datetime
+
+        """
+        return types._decode_sec(self.export_epochs[msgnum])
+
+    def messages_between(self, start=None, end=None):
+        """
+        Get the numbers of the messages exported in a time range.
+
+        :param start: earliest export time, as a datetime, or None for no
+                      lower bound
+        :param end: export time after the range, as a datetime, or None for
+                    no upper bound
+        :returns: a list of message numbers, in file order
+
+        """
+        lo = 0 if start is None else types._encode_sec(start)
+        hi = 1 << 32 if end is None else types._encode_sec(end)
+        if self.time_sorted:
+            return list(range(bisect.bisect_left(self.export_epochs, lo),
+                              bisect.bisect_left(self.export_epochs, hi)))
+        else:
+            return [i for (i, epoch) in enumerate(self.export_epochs)
+                    if lo <= epoch < hi]
+
+    def _templates_before(self, msgnum):
+        # Get the template state valid at the start of a message, from the
+        # nearest checkpoint before it.
+        last = bisect.bisect_left(self.tsets, (msgnum,))
+        checkpoint = bisect.bisect_right(self.checkpoint_tsets, last) - 1
+        templates = dict(self.checkpoints[checkpoint])
+        self._apply_tsets(templates, self.checkpoint_tsets[checkpoint], last)
+        return templates
+
+    def _apply_tsets(self, templates, first, last):
+        # Apply template sets first to last (exclusive) in the index to a
+        # template state, checkpointing it as we go.
+        for i in range(first, last):
+            (tmsgnum, setoff, setid, setlen) = self.tsets[i]
+            odid = self.odids[tmsgnum]
+            offset = setoff + message._sethdr_st.size
+            while offset < setoff + setlen:
+                (tmpl, offset) = template.decode_template_from(
+                                    self.mview, offset, setid, self.policy)
+                if tmpl.count():
+                    templates[(odid, tmpl.tid)] = tmpl
+                else:
+                    # template withdrawal: no fields
+                    templates.pop((odid, tmpl.tid), None)
+            if (i + 1) % self.checkpoint_interval == 0 and \
+               (i + 1) > self.checkpoint_tsets[-1]:
+                self.checkpoint_tsets.append(i + 1)
+                self.checkpoints.append(dict(templates))
+
+    def message_at(self, msgnum):
+        """
+        Read a message by number, with the templates valid at its position
+        in the file.
+
+        :param msgnum: message number, counting from 0
+        :returns: the reader's :class:`ipfix.message.MessageBuffer`, holding
+                  the message; valid until the next message is read.
+
+        """
+        for msg in self.message_iterator([msgnum]):
+            return msg
+
+    def message_iterator(self, msgnums=None):
+        """
+        Iterate over messages by number, in the given order.
+        Template state is carried over between consecutive messages, and
+        rebuilt from the index otherwise, whether or not the records in
+        each message are read.
+
+        :param msgnums: an iterable of message numbers, or None for all
+                        messages in the file
+        :returns: an iterator over the reader's
+                  :class:`ipfix.message.MessageBuffer`, holding each message
+                  in turn
+
+        """
+        if msgnums is None:
+            msgnums = range(len(self))
+
+        msg = self.msg
+        last = None
+        for msgnum in msgnums:
+            if msgnum < 0:
+                msgnum += len(self)
+            if last is None or msgnum != last + 1:
+                templates = self._templates_before(msgnum)
+                msg.set_templates(templates)
+            else:
+                # apply the template sets in the last message
+                first = bisect.bisect_left(self.tsets, (last,))
+                end = bisect.bisect_left(self.tsets, (msgnum,))
+                if first < end:
+                    self._apply_tsets(templates, first, end)
+                    msg.set_templates(templates)
+            msg.from_buffer(self.mview[self.offsets[msgnum]:])
+            last = msgnum
+            yield msg
+
+    def namedict_iterator(self, start=None, end=None, recfilter=None):
+        """
+        Iterate over all records in messages exported in the given time
+        range, as dicts mapping IE names to values. Note that the export
+        time of a message is not the time of the flows it describes; use a
+        recfilter on flow time IEs to select by flow time.
+
+        :param start: earliest export time, as a datetime, or None
+        :param end: export time after the range, as a datetime, or None
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
+        :returns: a name dictionary iterator
+
+        """
+        for msg in self.message_iterator(self.messages_between(start, end)):
+            for rec in msg.namedict_iterator(recfilter):
+                yield rec
+
+    def tuple_iterator(self, ielist, start=None, end=None, recfilter=None):
+        """
+        Iterate over all records in messages exported in the given time
+        range containing all the IEs in the given ielist. Records are
+        returned as tuples in ielist order.
+
+        :param ielist: an instance of :class:`ipfix.ie.InformationElementList`
+                       listing IEs to return as a tuple
+        :param start: earliest export time, as a datetime, or None
+        :param end: export time after the range, as a datetime, or None
+        :param recfilter: an optional :class:`ipfix.recfilter.RecordFilter`;
+                          if given, only matching records are returned.
+        :returns: a tuple iterator for tuples in ielist order
+
+        """
+        for msg in self.message_iterator(self.messages_between(start, end)):
+            for rec in msg.tuple_iterator(ielist, recfilter):
+                yield rec
+
+def from_file(stream, policy=None):
+    """
+    Get a MappedFileReader for a given file
+
+    :param stream: file to read, opened in binary mode
+    :param policy: :class:`ipfix.types.DecodePolicy` for decoding records,
+                   or None for the default representations
+    :return: a :class:`MappedFileReader` indexing the file.
+
+    """
+    return MappedFileReader(stream, policy)
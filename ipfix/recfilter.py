@@ -0,0 +1,254 @@
+#
+# python-ipfix (c) 2013-2014 Brian Trammell.
+#
+# Many thanks to the mPlane consortium (http://www.ict-mplane.eu) for
+# its material support of this effort.
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Record filters, for selecting records by IE value before decoding them.
+
+A filter is written as a Python boolean expression over IE names, using
+comparisons between IEs and literal values, ``and``, ``or`` and ``not``:
+
+>>> import ipfix.ie
+>>> import ipfix.recfilter
+>>> ipfix.ie.use_iana_default()
+>>> f = ipfix.recfilter.for_expression(
+...     "protocolIdentifier == 6 and destinationTransportPort in {80, 443}")
+>>> f
+<RecordFilter 'protocolIdentifier == 6 and destinationTransportPort in {80, 443}'>
+
+For each template, the filter is compiled into comparisons on the undecoded
+record in the message buffer: literals are converted to the wire
+representation of the IE they are compared with, so IEs before the first
+variable-length IE in a template are compared without being decoded at all.
+String literals are parsed as by :meth:`ipfix.ie.InformationElement.parse`,
+so addresses and timestamps can be written as strings. Literals are
+always in the default representation of values, even when records are
+decoded with a :class:`ipfix.types.DecodePolicy`:
+
+>>> f = ipfix.recfilter.for_expression(
+...     "sourceIPv4Address == '10.1.2.3' and not packetDeltaCount < 30")
+
+Pass a filter as the recfilter argument to the iterators of
+:class:`ipfix.message.MessageBuffer` or
+:class:`ipfix.reader.MessageStreamReader`; only matching records are
+decoded. Sets described by templates not containing every IE named in the
+filter are skipped entirely.
+
+>>> import ipfix.message
+>>> import ipfix.testutils
+>>> msg = ipfix.message.MessageBuffer()
+>>> msg.from_bytes(ipfix.testutils.mktest_message().to_bytes())
+>>> f = ipfix.recfilter.for_expression("packetDeltaCount == 26")
+>>> ielist = ipfix.ie.spec_list(["sourceIPv4Address", "packetDeltaCount"])
+>>> for rec in msg.tuple_iterator(ielist, recfilter=f):
+...     print(rec)
+...
+(IPv4Address('127.0.0.26'), 26)
+(IPv4Address('127.0.0.53'), 26)
+(IPv4Address('127.0.0.80'), 26)
+(IPv4Address('127.0.0.107'), 26)
+
+"""
+
+from . import ie, template, compat
+from .compat import xrange, lru_cache
+
+import ast
+import struct
+
+_ops = { ast.Eq: "==", ast.NotEq: "!=",
+         ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=",
+         ast.In: "in", ast.NotIn: "not in" }
+
+_literal_names = ("True", "False", "None")
+
+class RecordFilter(object):
+    """
+    A filter selecting records by the values of their IEs.
+    Use :func:`for_expression` to get an instance.
+
+    """
+    def __init__(self, expr):
+        self.expr = expr
+        try:
+            self.tree = ast.parse(expr.strip(), mode="eval").body
+        except SyntaxError:
+            raise ValueError("can't parse filter "+repr(expr))
+
+        # find the IEs the filter refers to
+        self.ies = []
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Name) and node.id not in _literal_names:
+                e = ie.for_spec(node.id)
+                if e not in self.ies:
+                    self.ies.append(e)
+
+        # make sure the expression is one we can compile
+        self._render(self.tree, {}, {})
+
+    def __repr__(self):
+        return "<RecordFilter "+repr(str(self.expr))+">"
+
+    def accepts(self, tmpl):
+        """
+        Return True if records described by a template can be filtered, i.e.
+        if the template contains all the IEs the filter refers to.
+
+        """
+        for e in self.ies:
+            if e not in tmpl.ies:
+                return False
+        return True
+
+    def _render(self, node, fields, ns):
+        # Render an expression node to Python source, given a map of IE
+        # name to (variable name, wire) where wire is True if the value of
+        # the IE is available in its wire representation. Constants are
+        # added to ns.
+        if isinstance(node, ast.BoolOp):
+            op = " and " if isinstance(node.op, ast.And) else " or "
+            return "(" + op.join(self._render(v, fields, ns)
+                                 for v in node.values) + ")"
+
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return "(not " + self._render(node.operand, fields, ns) + ")"
+
+        elif isinstance(node, ast.Compare):
+            operands = [node.left] + list(node.comparators)
+            names = [n.id for n in operands if isinstance(n, ast.Name) and
+                                               n.id not in _literal_names]
+            if len(names) != 1:
+                raise ValueError("comparison in filter "+repr(self.expr)+
+                                 " must refer to exactly one IE")
+            e = ie.for_spec(names[0])
+            (var, wire) = fields.get(e.name, ("_v", True))
+
+            src = []
+            for i, n in enumerate(operands):
+                if i:
+                    try:
+                        src.append(_ops[type(node.ops[i-1])])
+                    except KeyError:
+                        raise ValueError("unsupported operator in filter "+
+                                         repr(self.expr))
+                if isinstance(n, ast.Name) and n.id not in _literal_names:
+                    src.append(var)
+                else:
+                    cname = "_c%u" % len(ns)
+                    ns[cname] = self._constant(n, e, wire)
+                    src.append(cname)
+            return "(" + " ".join(src) + ")"
+
+        else:
+            raise ValueError("unsupported expression in filter "+
+                             repr(self.expr))
+
+    def _constant(self, node, e, wire):
+        # Convert a literal node to a value comparable with values of the
+        # given IE, in wire or decoded representation.
+        try:
+            val = ast.literal_eval(node)
+        except ValueError:
+            raise ValueError("unsupported expression in filter "+
+                             repr(self.expr))
+
+        def convert(v):
+            try:
+                if v is None:
+                    raise TypeError()
+                if isinstance(v, compat.string_types):
+                    v = e.parse(v)
+                if wire:
+                    v = e.type.valenc(v)
+            except (AttributeError, TypeError, ValueError):
+                raise ValueError("can't compare "+e.name+" with "+repr(v)+
+                                 " in filter "+repr(self.expr))
+            return v
+
+        if isinstance(val, (set, frozenset, list, tuple)):
+            return frozenset(convert(v) for v in val)
+        else:
+            return convert(val)
+
+    @lru_cache(maxsize = 256)
+    def matcher_for(self, tmpl):
+        """
+        Compile and cache this filter for a given template.
+
+        :param tmpl: a template accepted by :meth:`accepts`
+        :returns: a function taking a buffer and the offset of a record
+                  described by the template, returning True if the record
+                  matches the filter.
+
+        """
+        ns = {}
+        fields = {}
+        body = []
+
+        # IEs at fixed offsets are unpacked, without decoding, with a single
+        # struct; others are decoded.
+        indices = sorted(set(tmpl.ies.index(e) for e in self.ies))
+        fixidx = [i for i in indices if i < tmpl.fixlen_count()]
+        if fixidx:
+            packstring = "!"
+            for i in xrange(fixidx[-1] + 1):
+                if i in fixidx:
+                    packstring += tmpl.ies[i].type.stel
+                else:
+                    packstring += tmpl.ies[i].type.skipel
+            ns["_st_unpack_from"] = struct.Struct(packstring).unpack_from
+            body.append("    (%s,) = _st_unpack_from(buf, offset)" %
+                        ", ".join("f%u" % i for i in fixidx))
+            for i in fixidx:
+                fields[tmpl.ies[i].name] = ("f%u" % i, True)
+
+        # IEs after a variable-length IE are decoded in the default
+        # representation, in which literals are given, whatever the
+        # template's DecodePolicy.
+        dtmpl = tmpl
+        if tmpl.policy is not None and len(fixidx) < len(indices):
+            dtmpl = template.from_ielist(tmpl.tid, tmpl.ies)
+
+        for i in indices:
+            if i in fixidx:
+                continue
+            e = tmpl.ies[i]
+            ns["_p%u" % i] = dtmpl.packplan_for_ielist(
+                                    ie.InformationElementList([e]))
+            body.append("    f%u = _p%u.decode_tuple(buf, offset)[0][0]" %
+                        (i, i))
+            fields[e.name] = ("f%u" % i, False)
+
+        expr = self._render(self.tree, fields, ns)
+        return template._compile_function("match",
+            ["def match(buf, offset):"] + body +
+            ["    return %s" % expr], ns)
+
+def for_expression(expr):
+    """
+    Get a RecordFilter for a given filter expression.
+
+    :param expr: a Python boolean expression comparing IEs (by name)
+                 with literal values.
+    :returns: a new :class:`RecordFilter`
+    :raises: ValueError if the expression is not a supported filter, or
+             refers to unknown IEs.
+
+    """
+    return RecordFilter(expr)
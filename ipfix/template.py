@@ -31,6 +31,8 @@ See :mod:`ipfix.message` for examples.
 from . import ie, types, compat
 from .compat import izip, xrange, lru_cache
 
+import codecs
+import operator
 import struct
 
 
@@ -59,11 +61,267 @@ _otmplhdr_st = struct.Struct("!HHH")
 _iespec_st = struct.Struct("!HH")
 _iepen_st = struct.Struct("!L")
 
+# struct element to (big-endian) NumPy array type string, for array_layout
+_stel_dtype = { 'B' : 'u1', 'H' : '>u2', 'L' : '>u4', 'Q' : '>u8',
+                'b' : 'i1', 'h' : '>i2', 'l' : '>i4', 'q' : '>i8',
+                'f' : '>f4', 'd' : '>f8' }
+
+def _compile_function(name, lines, namespace):
+    """
+    Compile a generated function from a list of source lines, using the
+    given namespace for its globals. Used internally by TemplatePackingPlan.
+
+    """
+    exec("\n".join(lines), namespace)
+    return namespace[name]
+
+def _convert_lines(ns, layout, indices):
+    # Generate value conversion statements for the given indices, eliding
+    # identity conversions.
+    lines = []
+    for i in indices:
+        valdec = layout[i][3]
+        if valdec is not types._identity:
+            ns["_d%u" % i] = valdec
+            lines.append("    v%u = _d%u(v%u)" % (i, i, i))
+    return lines
+
+@lru_cache(maxsize = 256)
+def _compile_decoders(layout, fixlen_count, indices):
+    """
+    Generate decoder functions for a record layout and a set of indices.
+    The layout is a tuple of (name, length, stel, valdec) for each IE in a
+    template; since it does not depend on template identity, templates with
+    the same layout share compiled decoders. Used internally by
+    TemplatePackingPlan.
+
+    """
+    # Generate the body of a decoder: one struct unpack for the fixed-length
+    # part of the record, then the variable-length part. Each value is
+    # bound to a local named for its index in the template, so the return
+    # expression can place it anywhere.
+    st = struct.Struct("!" + "".join(layout[i][2] if i in indices
+                                     else "%ux" % layout[i][1]
+                                     for i in xrange(fixlen_count)))
+    ns = { "_st_unpack_from": st.unpack_from,
+           "_varlen2_unpack_from": types._varlen2_st.unpack_from,
+           "_utf8_decode": codecs.utf_8_decode }
+    body = []
+    decoded = []
+
+    fixidx = [i for i in xrange(fixlen_count) if i in indices]
+    if fixidx:
+        body.append("    (%s,) = _st_unpack_from(buf, offset)" %
+                    ", ".join("v%u" % i for i in fixidx))
+        body.extend(_convert_lines(ns, layout, fixidx))
+        decoded.extend(fixidx)
+    if st.size:
+        body.append("    offset += %u" % st.size)
+
+    # Variable-length part: walk length prefixes inline, decoding only the
+    # IEs in indices. Runs of fixed-length IEs between variable-length IEs
+    # are unpacked together with a single struct.
+    run = []
+    for i in list(xrange(fixlen_count, len(layout))) + [None]:
+        if i is not None and layout[i][1] != types.VARLEN:
+            run.append(i)
+            continue
+
+        if run:
+            runfmt = "!" + "".join(layout[j][2] if j in indices
+                                   else "%ux" % layout[j][1] for j in run)
+            runidx = [j for j in run if j in indices]
+            if runidx:
+                ns["_u%u" % run[0]] = struct.Struct(runfmt).unpack_from
+                body.append("    (%s,) = _u%u(buf, offset)" %
+                            (", ".join("v%u" % j for j in runidx), run[0]))
+                body.extend(_convert_lines(ns, layout, runidx))
+                decoded.extend(runidx)
+            body.append("    offset += %u" % struct.calcsize(runfmt))
+            run = []
+
+        if i is None:
+            break
+
+        body.extend(["    length = buf[offset]",
+                     "    if length == 255:",
+                     "        length = _varlen2_unpack_from(buf, offset + 1)[0]",
+                     "        offset += 3",
+                     "    else:",
+                     "        offset += 1"])
+        if i in indices:
+            valdec = layout[i][3]
+            if valdec is types._decode_utf8:
+                # decode strings straight from the buffer without a copy
+                body.append("    v%u = _utf8_decode(buf[offset:offset+length])[0]" % i)
+            elif valdec is types._decode_buffer:
+                body.append("    v%u = buf[offset:offset+length]" % i)
+            elif valdec is types._identity:
+                body.append("    v%u = buf[offset:offset+length].tobytes()" % i)
+            else:
+                ns["_d%u" % i] = valdec
+                body.append("    v%u = _d%u(buf[offset:offset+length].tobytes())"
+                            % (i, i))
+            decoded.append(i)
+        body.append("    offset += length")
+
+    # values in template order, for decode_from
+    decode_list = _compile_function("decode_list",
+        ["def decode_list(buf, offset):"] + body +
+        ["    return ([%s], offset)" %
+            ", ".join("v%u" % i for i in decoded)], dict(ns))
+
+    # values in the order of indices, for decode_tuple_from
+    decode_tuple = _compile_function("decode_tuple",
+        ["def decode_tuple(buf, offset):"] + body +
+        ["    return ((%s), offset)" %
+            "".join("v%u, " % i for i in indices)], dict(ns))
+
+    # values keyed by IE name, for decode_namedict_from
+    for i in decoded:
+        ns["_n%u" % i] = layout[i][0]
+    decode_namedict = _compile_function("decode_namedict",
+        ["def decode_namedict(buf, offset):"] + body +
+        ["    return ({%s}, offset)" %
+            ", ".join("_n%u: v%u" % (i, i) for i in decoded)], dict(ns))
+
+    # Batch decoders for a run of records in a set. Only for templates
+    # without variable-length IEs, where every record has the same layout:
+    # these unpack the whole run with struct.iter_unpack, and apply
+    # conversions in a single comprehension.
+    if fixlen_count < len(layout):
+        return (decode_list, decode_tuple, decode_namedict, None, None)
+
+    ns["_iter_unpack"] = compat.iter_unpack
+    ns["_st"] = st
+    run = "_iter_unpack(_st, buf[offset:offset+count*%u])" % st.size
+    target = "".join("v%u, " % i for i in decoded)
+    valexpr = dict((i, "_d%u(v%u)" % (i, i) if ("_d%u" % i) in ns
+                       else "v%u" % i) for i in decoded)
+
+    if not indices:
+        tuples_expr = "[()] * count"
+    elif list(indices) == decoded and not any(("_d%u" % i) in ns for i in decoded):
+        # records come out of struct unpacking just as we want them
+        tuples_expr = "list(%s)" % run
+    else:
+        tuples_expr = "[(%s) for (%s) in %s]" % (
+            "".join("%s, " % valexpr[i] for i in indices), target, run)
+    decode_tuples = _compile_function("decode_tuples",
+        ["def decode_tuples(buf, offset, count):",
+         "    return %s" % tuples_expr], dict(ns))
+
+    if not indices:
+        namedicts_expr = "[{} for i in range(count)]"
+    else:
+        namedicts_expr = "[{%s} for (%s) in %s]" % (
+            ", ".join("_n%u: %s" % (i, valexpr[i]) for i in decoded),
+            target, run)
+    decode_namedicts = _compile_function("decode_namedicts",
+        ["def decode_namedicts(buf, offset, count):",
+         "    return %s" % namedicts_expr], dict(ns))
+
+    return (decode_list, decode_tuple, decode_namedict,
+            decode_tuples, decode_namedicts)
+
+def _identity_get(rec):
+    return rec
+
+@lru_cache(maxsize = 256)
+def _compile_encoders(enclayout, fixlen_count):
+    """
+    Generate encoder functions for a record layout. The layout is a tuple
+    of (name, length, stel, valenc) for each IE in a template, as returned
+    by :meth:`Template.encode_layout`; templates with the same layout share
+    compiled encoders. Used internally by Template.
+
+    Returns functions encoding a record from a sequence of values in
+    template order, from a dict keyed by IE name, and from an object with
+    attributes named for IEs. Values are extracted with a single
+    itemgetter or attrgetter call, the fixed-length part of the record is
+    packed with a single struct, and each variable-length value is
+    encoded exactly once.
+
+    """
+    ns = { "_st_pack_into": struct.Struct("!" + "".join(
+                        enclayout[i][2] for i in xrange(fixlen_count))).pack_into,
+           "_varlen2_pack_into": types._varlen2_st.pack_into }
+    names = [e[0] for e in enclayout]
+    count = len(enclayout)
+
+    def valexpr(i):
+        valenc = enclayout[i][3]
+        if valenc is types._identity:
+            return "v%u" % i
+        ns["_e%u" % i] = valenc
+        return "_e%u(v%u)" % (i, i)
+
+    body = []
+    fixsize = struct.calcsize("!" + "".join(enclayout[i][2]
+                                            for i in xrange(fixlen_count)))
+    if fixlen_count:
+        body.append("    _st_pack_into(buf, offset, %s)" %
+                    ", ".join(valexpr(i) for i in xrange(fixlen_count)))
+        body.append("    offset += %u" % fixsize)
+
+    for i in xrange(fixlen_count, count):
+        (name, length, stel, valenc) = enclayout[i]
+        if length != types.VARLEN:
+            ns["_p%u" % i] = struct.Struct("!" + stel).pack_into
+            body.append("    _p%u(buf, offset, %s)" % (i, valexpr(i)))
+            body.append("    offset += %u" % length)
+        else:
+            body.extend(["    enc = %s" % valexpr(i),
+                         "    length = len(enc)",
+                         "    if length < 255:",
+                         "        buf[offset] = length",
+                         "        offset += 1",
+                         "    else:",
+                         "        buf[offset] = 255",
+                         "        _varlen2_pack_into(buf, offset + 1, length)",
+                         "        offset += 3",
+                         "    buf[offset:offset+length] = enc",
+                         "    offset += length"])
+    body.append("    return offset")
+
+    # extract values, in template order, with a single getter call
+    target = "(%s,)" % ", ".join("v%u" % i for i in xrange(count))
+    if count == 0:
+        ns["_index_get"] = ns["_name_get"] = ns["_attr_get"] = _identity_get
+        target = "_"
+    elif count == 1:
+        ns["_index_get"] = operator.itemgetter(0)
+        ns["_name_get"] = operator.itemgetter(names[0])
+        ns["_attr_get"] = operator.attrgetter(names[0])
+        target = "v0"
+    else:
+        ns["_index_get"] = operator.itemgetter(*xrange(count))
+        ns["_name_get"] = operator.itemgetter(*names)
+        ns["_attr_get"] = operator.attrgetter(*names)
+
+    encode_tuple = _compile_function("encode_tuple",
+        ["def encode_tuple(buf, offset, rec):",
+         "    %s = _index_get(rec)" % target] + body, dict(ns))
+    encode_namedict = _compile_function("encode_namedict",
+        ["def encode_namedict(buf, offset, rec):",
+         "    %s = _name_get(rec)" % target] + body, dict(ns))
+    encode_object = _compile_function("encode_object",
+        ["def encode_object(buf, offset, rec):",
+         "    %s = _attr_get(rec)" % target] + body, dict(ns))
+
+    return (encode_tuple, encode_namedict, encode_object)
+
 class TemplatePackingPlan(object):
     """
     Plan to pack/unpack a specific set of indices for a template.
     Used internally by Templates for efficient encoding and decoding.
 
+    Each packing plan has a specialized decoder function for its template
+    layout and set of indices, which decodes a record in a single
+    straight-line pass; see :meth:`Template.decode_from` and
+    :meth:`Template.decode_tuple_from`. Decoders are compiled on first use
+    of a layout and shared among all plans with the same layout.
+
     """
     def __init__(self, tmpl, indices):
         self.tmpl = tmpl
@@ -71,25 +329,169 @@ class TemplatePackingPlan(object):
         self.ranks = sorted(xrange(len(indices)), key=indices.__getitem__)
         self.valenc = []
         self.valdec = []
+        self.tailenc = []
 
         packstring = "!"
         for i, t in enumerate(e.type for e in tmpl.ies):
+            if tmpl.policy:
+                (stel, valenc) = tmpl.policy.encoder_for(t)
+            else:
+                (stel, valenc) = (getattr(t, "stel", None), t.valenc)
             if i >= tmpl.fixlen_count():
-                break
+                # (index, encoder, length or None) for IEs after the first
+                # variable-length IE, encoded one at a time
+                if i in indices:
+                    self.tailenc.append((i, valenc, stel and
+                                         struct.Struct("!"+stel)))
+                continue
             if i in indices:
-                packstring += t.stel
-                self.valenc.append(t.valenc)
+                packstring += stel
+                self.valenc.append(valenc)
                 self.valdec.append(t.valdec)
             else:
                 packstring += t.skipel
 
         self.st = struct.Struct(packstring)
 
+        (self.decode_list, self.decode_tuple, self.decode_namedict,
+         self.decode_tuples, self.decode_namedicts) = \
+                _compile_decoders(tmpl.layout(), tmpl.fixlen_count(),
+                                  tuple(indices))
+
+    def array_layout(self):
+        """
+        Describe the records handled by this plan as a NumPy structured
+        array type, for decoding whole sets of fixed-length records at once.
+        Values appear in their wire representation: timestamps as integers
+        in the units of their type, IPv4 addresses as integers, and other
+        octet arrays as bytes.
+
+        :returns: a tuple of (names, formats, offsets, itemsize), suitable
+                  for creating a big-endian numpy.dtype.
+        :raises: IpfixDecodeError if the template has variable-length IEs
+
+        """
+        tmpl = self.tmpl
+        if tmpl.varlenslice is not None:
+            raise IpfixDecodeError("no array layout for "+repr(tmpl)+
+                                   " with variable-length IEs")
+
+        ieoffsets = [0]
+        for e in tmpl.ies:
+            ieoffsets.append(ieoffsets[-1] + e.length)
+
+        names = []
+        formats = []
+        offsets = []
+        for i in self.indices:
+            e = tmpl.ies[i]
+            if e.type.num == 18:
+                # ipv4Address, as in types.use_integer_ipv4()
+                formats.append(">u4")
+            elif e.type.stel[-1] == "s":
+                formats.append("S%u" % e.length)
+            else:
+                formats.append(_stel_dtype[e.type.stel])
+            names.append(e.name)
+            offsets.append(ieoffsets[i])
+
+        return (tuple(names), tuple(formats), tuple(offsets), tmpl.minlength)
+
     def __repr__(self):
         return "<TemplatePackingPlan "+repr(self.tmpl) +\
                 " pack " + str(self.st.format) +\
                 " indices " + " ".join(str(i) for i in self.indices)+">"
 
+class RecordView(object):
+    """
+    A lazy view of a single record in a buffer, decoding each IE only when
+    it is accessed, by name as a key or as an attribute. Returned by
+    :meth:`Template.decode_view_from`; used to examine a few IEs in many
+    records without decoding the rest.
+
+    A view refers directly to the buffer it was decoded from, and is only
+    valid as long as that buffer is unchanged; for a
+    :class:`ipfix.message.MessageBuffer`, until the next message is read.
+    Use :meth:`as_namedict` or :meth:`as_tuple` to keep a record.
+
+    """
+    __slots__ = ("tmpl", "buf", "offset", "_varoffsets")
+
+    def __init__(self, tmpl, buf, offset):
+        self.tmpl = tmpl
+        self.buf = buf
+        self.offset = offset
+        self._varoffsets = None
+
+    def __repr__(self):
+        return "<RecordView "+repr(self.tmpl)+" offset "+str(self.offset)+">"
+
+    def _scan_varoffsets(self):
+        # find (offset, length) for each IE in the variable-length part
+        tmpl = self.tmpl
+        offset = self.offset + tmpl.packplan.st.size
+        varoffsets = []
+        for e in tmpl.ies[tmpl.varlenslice:]:
+            length = e.length
+            if length == types.VARLEN:
+                (length, offset) = types.decode_varlen(self.buf, offset)
+            varoffsets.append((offset, length))
+            offset += length
+        self._varoffsets = varoffsets
+
+    def __getitem__(self, name):
+        (i, reloff, unpack_from, valdec) = self.tmpl.view_fields()[name]
+        if reloff is not None:
+            return valdec(unpack_from(self.buf, self.offset + reloff)[0])
+
+        if self._varoffsets is None:
+            self._scan_varoffsets()
+        (offset, length) = self._varoffsets[i - self.tmpl.varlenslice]
+        if unpack_from:
+            return valdec(unpack_from(self.buf, offset)[0])
+        elif valdec is types._decode_buffer:
+            return self.buf[offset:offset+length]
+        else:
+            return valdec(self.buf[offset:offset+length].tobytes())
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __contains__(self, name):
+        return name in self.tmpl.view_fields()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.tmpl.view_fields())
+
+    def keys(self):
+        """Return the names of the IEs in this record, in template order"""
+        return [e.name for e in self.tmpl.ies]
+
+    def get(self, name, default=None):
+        """Return the value of the named IE, or default if not present"""
+        if name in self:
+            return self[name]
+        else:
+            return default
+
+    def as_namedict(self):
+        """Decode the whole record into a dict keyed by IE name"""
+        return self.tmpl.decode_namedict_from(self.buf, self.offset)[0]
+
+    def as_tuple(self, ielist=None):
+        """
+        Decode the record into a tuple, ordered as the IEs in the given
+        InformationElementList, or in template order if None.
+
+        """
+        return self.tmpl.decode_tuple_from(self.buf, self.offset, ielist)[0]
+
 class Template(object):
     """
     An IPFIX Template.
@@ -97,16 +499,20 @@ class Template(object):
     A template is an ordered list of IPFIX Information Elements with an ID.
 
     """
-    def __init__(self, tid = 0, iterable = None):
+    def __init__(self, tid = 0, iterable = None, policy = None):
         if tid < 256 or tid > 65535:
             raise ValueError("bad template ID "+str(tid))
 
         self.tid = tid
+        self.policy = policy
         self.minlength = 0
         self.enclength = 0
         self.scopecount = 0
         self.varlenslice = None
         self.packplan = None
+        self.scanplan = None
+        self.viewfields = None
+        self.encoders = None
 
         self.ies = []
         if iterable:
@@ -134,6 +540,7 @@ class Template(object):
     def append(self, ie):
         """Append an IE to this Template"""
         self.ies.append(ie)
+        self.encoders = None
 
         if ie.length == types.VARLEN:
             self.minlength += 1
@@ -150,6 +557,51 @@ class Template(object):
         """Count IEs in this template"""
         return len(self.ies)
 
+    def layout(self):
+        """
+        Return the layout of a record described by this template, as a
+        tuple of (name, length, struct element, decoder) for each IE,
+        according to the template's :class:`ipfix.types.DecodePolicy`.
+        Used internally to share compiled decoders among templates.
+
+        """
+        if self.policy:
+            return tuple((e.name, e.length) + self.policy.field_for(e.type)
+                         for e in self.ies)
+        else:
+            return tuple((e.name, e.length, getattr(e.type, "stel", None),
+                          e.type.valdec) for e in self.ies)
+
+    def encode_layout(self):
+        """
+        Return the layout of a record described by this template, as a
+        tuple of (name, length, struct element, encoder) for each IE,
+        according to the template's :class:`ipfix.types.DecodePolicy`.
+        Used internally to share compiled encoders among templates.
+
+        """
+        if self.policy:
+            return tuple((e.name, e.length) + self.policy.encoder_for(e.type)
+                         for e in self.ies)
+        else:
+            return tuple((e.name, e.length, getattr(e.type, "stel", None),
+                          e.type.valenc) for e in self.ies)
+
+    def compiled_encoders(self):
+        """
+        Get the encoder functions for this template, compiled on first use
+        of its layout; see :meth:`encode_tuple_to`.
+
+        :returns: a tuple of functions (encode_tuple, encode_namedict,
+                  encode_object), each taking a buffer, an offset and a
+                  record, and returning the offset after the record.
+
+        """
+        if self.encoders is None:
+            self.encoders = _compile_encoders(self.encode_layout(),
+                                              self.fixlen_count())
+        return self.encoders
+
     def fixlen_count(self):
         """
         Count of fixed-length IEs in this template before the first
@@ -165,6 +617,32 @@ class Template(object):
     def finalize(self):
         """Compile a default packing plan. Called after append()ing all IEs."""
         self.packplan = TemplatePackingPlan(self, xrange(self.count()))
+        self.scanplan = TemplatePackingPlan(self, ())
+
+    def view_fields(self):
+        """
+        Get the field table used by :class:`RecordView` for this template,
+        mapping each IE name to a tuple of (index, offset relative to the
+        start of the record or None if not fixed, unpack function or None
+        for variable-length IEs, value decoder). Built on first use.
+
+        """
+        if self.viewfields is None:
+            viewfields = {}
+            reloff = 0
+            for i, (name, length, stel, valdec) in enumerate(self.layout()):
+                if length == types.VARLEN:
+                    reloff = None
+                    field = (i, None, None, valdec)
+                else:
+                    field = (i, reloff, struct.Struct("!"+stel).unpack_from,
+                             valdec)
+                    if reloff is not None:
+                        reloff += length
+                viewfields.setdefault(name, field)
+            self.viewfields = viewfields
+
+        return self.viewfields
 
     @lru_cache(maxsize = 32)
     def packplan_for_ielist(self, ielist):
@@ -175,6 +653,28 @@ class Template(object):
         """
         return TemplatePackingPlan(self, [self.ies.index(ie) for ie in ielist])
 
+    def record_offsets(self, buf, offset, setend):
+        """
+        Scan a set for record boundaries in a single pass over the length
+        prefixes of its variable-length IEs, without decoding any values.
+
+        :param buf: buffer containing the set
+        :param offset: offset of the first record in the set
+        :param setend: offset of the end of the set
+        :returns: list of the offsets of each record in the set
+
+        """
+        if self.varlenslice is None:
+            return list(xrange(offset, setend - self.minlength + 1,
+                               self.minlength))
+
+        skip = self.scanplan.decode_tuple
+        offsets = []
+        while offset + self.minlength <= setend:
+            offsets.append(offset)
+            offset = skip(buf, offset)[1]
+        return offsets
+
     def decode_from(self, buf, offset, packplan = None):
         """Decodes a record into a tuple containing values in template order"""
 
@@ -182,31 +682,11 @@ class Template(object):
         if not packplan:
             packplan = self.packplan
 
-        # decode fixed values
-        vals = [f(v) for f, v in izip(packplan.valdec, packplan.st.unpack_from(buf, offset))]
-        offset += packplan.st.size
-
-        # short circuit on no varlen
-        if not self.varlenslice:
-            return (vals, offset)
-
-        # direct iteration over remaining IEs
-        for i, ie in izip(xrange(self.varlenslice, self.count()),
-                         self.ies[self.varlenslice:]):
-            length = ie.length
-            if length == types.VARLEN:
-                (length, offset) = types.decode_varlen(buf, offset)
-            if i in packplan.indices:
-                vals.append(ie.type.decode_single_value_from(
-                                    buf, offset, length))
-            offset += length
-
-        return (vals, offset)
+        return packplan.decode_list(buf, offset)
 
     def decode_namedict_from(self, buf, offset, recinf = None):
         """Decodes a record from a buffer into a dict keyed by IE name."""
-        (vals, offset) = self.decode_from(buf, offset)
-        return (dict(( k, v) for k,v in izip((ie.name for ie in self.ies), vals)), offset)
+        return self.packplan.decode_namedict(buf, offset)
 
     def decode_tuple_from(self, buf, offset, recinf = None):
         """
@@ -219,19 +699,68 @@ class Template(object):
         else:
             packplan = self.packplan
 
-        (vals, offset) = self.decode_from(buf, offset, packplan = packplan)
+        return packplan.decode_tuple(buf, offset)
+
+    def decode_namedicts_from(self, buf, offset, setend, recinf = None):
+        """
+        Decodes all the records in a set from a buffer into a list of dicts
+        keyed by IE name. For templates without variable-length IEs, the
+        whole set is unpacked at once.
+
+        """
+        if self.varlenslice is None:
+            count = (setend - offset) // self.minlength
+            return self.packplan.decode_namedicts(buf, offset, count)
+
+        decode = self.packplan.decode_namedict
+        recs = []
+        while offset + self.minlength <= setend:
+            (rec, offset) = decode(buf, offset)
+            recs.append(rec)
+        return recs
+
+    def decode_tuples_from(self, buf, offset, setend, recinf = None):
+        """
+        Decodes all the records in a set from a buffer into a list of tuples,
+        ordered as the IEs in the InformationElementList given as recinf.
+        For templates without variable-length IEs, the whole set is unpacked
+        at once.
+
+        """
+        if recinf:
+            packplan = self.packplan_for_ielist(recinf)
+        else:
+            packplan = self.packplan
+
+        if self.varlenslice is None:
+            count = (setend - offset) // self.minlength
+            return packplan.decode_tuples(buf, offset, count)
+
+        decode = packplan.decode_tuple
+        recs = []
+        while offset + self.minlength <= setend:
+            (rec, offset) = decode(buf, offset)
+            recs.append(rec)
+        return recs
 
-        outvals = tuple(v for i,v in sorted(izip(packplan.ranks, vals)))
+    def decode_view_from(self, buf, offset, recinf = None):
+        """
+        Returns a :class:`RecordView` of a record in a buffer, which decodes
+        IEs only on access.
 
-        # re-sort values in same order as packplan indices
-        return (outvals, offset)
+        """
+        if self.varlenslice is None:
+            end = offset + self.minlength
+        else:
+            end = self.scanplan.decode_tuple(buf, offset)[1]
+        return (RecordView(self, buf, offset), end)
 
     def encode_to(self, buf, offset, vals, packplan = None):
         """Encodes a record from a tuple containing values in template order"""
 
-        # use default packplan unless someone hacked us not to
+        # use the compiled encoder unless someone hacked us not to
         if not packplan:
-            packplan = self.packplan
+            return self.compiled_encoders()[0](buf, offset, vals)
 
         # encode fixed values
         fixvals = [f(v) for f,v in izip(packplan.valenc, vals)]
@@ -239,30 +768,26 @@ class Template(object):
         offset += packplan.st.size
 
         # shortcircuit no varlen
-        if not self.varlenslice:
+        if self.varlenslice is None:
             return offset
 
-        # direct iteration over remaining IEs
-        for i, ie, val in izip(xrange(self.varlenslice, self.count()),
-                              self.ies[self.varlenslice:],
-                              vals[self.varlenslice:]):
-            if i in packplan.indices:
-                #print("    encoding "+str(ie))
-                if ie.length == types.VARLEN:
-                    # FIXME this arrangement requires double-encode of varlen
-                    # values, one to get the length, one to do the encode.
-                    # Fixing this requires a rearrangement of type encoding
-                    # though. For now we'll just say that if you're exporting
-                    # varlen you get to put up with some inefficiency. :)
-                    offset = types.encode_varlen(buf, offset,
-                                                 len(ie.type.valenc(val)))
-                offset = ie.type.encode_single_value_to(val, buf, offset)
+        # remaining IEs: each varlen value is encoded once, then its
+        # length and value are written
+        for (i, valenc, st) in packplan.tailenc:
+            if st:
+                st.pack_into(buf, offset, valenc(vals[i]))
+                offset += st.size
+            else:
+                enc = valenc(vals[i])
+                offset = types.encode_varlen(buf, offset, len(enc))
+                buf[offset:offset+len(enc)] = enc
+                offset += len(enc)
 
         return offset
 
     def encode_namedict_to(self, buf, offset, rec, recinf = None):
         """Encodes a record from a dict containing values keyed by IE name"""
-        return self.encode_to(buf, offset, [rec[ie.name] for ie in self.ies])
+        return self.compiled_encoders()[1](buf, offset, rec)
 
     def encode_tuple_to(self, buf, offset, rec, recinf = None):
         """
@@ -270,7 +795,15 @@ class Template(object):
         in the template.
 
         """
-        return self.encode_to(buf, offset, rec)
+        return self.compiled_encoders()[0](buf, offset, rec)
+
+    def encode_object_to(self, buf, offset, rec, recinf = None):
+        """
+        Encodes a record from an object with an attribute named for each IE
+        in the template, e.g. a namedtuple or a flow table entry.
+
+        """
+        return self.compiled_encoders()[2](buf, offset, rec)
 
     def encode_template_to(self, buf, offset, setid):
         """
@@ -326,13 +859,43 @@ def encode_withdrawal_to(buf, offset, setid, tid):
 
     return offset
 
-def decode_template_from(buf, offset, setid):
-    """
-    Decodes a template from a buffer.
-    Decodes as a Template if setid is TEMPLATE_SET_ID,
-    as an Options Template if setid is OPTIONS_SET_ID.
+def _template_record_end(buf, offset, setid):
+    # Find the end of a template record without decoding it.
+    if (setid == TEMPLATE_SET_ID) or (setid == V9_TEMPLATE_SET_ID):
+        count = _tmplhdr_st.unpack_from(buf, offset)[1]
+        offset += _tmplhdr_st.size
+    elif (setid == OPTIONS_SET_ID) or (setid == V9_OPTIONS_SET_ID):
+        count = _otmplhdr_st.unpack_from(buf, offset)[1]
+        offset += _otmplhdr_st.size
+    else:
+        raise IpfixDecodeError("bad template set id "+str(setid))
 
-    """
+    while count:
+        if _iespec_st.unpack_from(buf, offset)[0] & 0x8000:
+            offset += _iespec_st.size + _iepen_st.size
+        else:
+            offset += _iespec_st.size
+        count -= 1
+
+    return offset
+
+def _template_records(buf, offset, setend, setid):
+    # Iterate over (template ID, start, end) of each template record in a
+    # template set, without decoding them.
+    while offset < setend:
+        end = _template_record_end(buf, offset, setid)
+        yield (_tmplhdr_st.unpack_from(buf, offset)[0], offset, end)
+        offset = end
+
+@lru_cache(maxsize = 4096)
+def _decode_template_record(record, setid, policy, generation):
+    # Decode a template record from its raw bytes; cached, so that
+    # templates resent unchanged are only decoded once. Keyed on the
+    # information model generation, so templates decoded before their IEs
+    # were registered are decoded again afterward.
+    return _decode_template_uncached(record, 0, setid, policy)[0]
+
+def _decode_template_uncached(buf, offset, setid, policy):
     if (setid == TEMPLATE_SET_ID) or (setid == V9_TEMPLATE_SET_ID):
         (tid, count) = _tmplhdr_st.unpack_from(buf, offset);
         scopecount = 0
@@ -343,7 +906,7 @@ def decode_template_from(buf, offset, setid):
     else:
         raise IpfixDecodeError("bad template set id "+str(setid))
 
-    tmpl = Template(tid)
+    tmpl = Template(tid, policy=policy)
     tmpl.scopecount = scopecount
 
     while count:
@@ -362,9 +925,52 @@ def decode_template_from(buf, offset, setid):
 
     return (tmpl, offset)
 
-def from_ielist(tid, ielist):
+def decode_template_from(buf, offset, setid, policy=None):
+    """
+    Decodes a template from a buffer.
+    Decodes as a Template if setid is TEMPLATE_SET_ID,
+    as an Options Template if setid is OPTIONS_SET_ID.
+    Records will be decoded according to the given
+    :class:`ipfix.types.DecodePolicy`, if any.
+
+    Decoded templates are interned by the raw bytes of their template
+    record: a template resent unchanged (by the same or by any other
+    exporter) returns the same Template instance, along with its compiled
+    decoders, without being decoded again. Templates must therefore not be
+    modified once decoded. Templates are decoded again after changes to the
+    information model (see :mod:`ipfix.ie`); use
+    :func:`clear_template_cache` to release cached templates.
+
+    """
+    end = _template_record_end(buf, offset, setid)
+    if setid == V9_TEMPLATE_SET_ID:
+        setid = TEMPLATE_SET_ID
+    elif setid == V9_OPTIONS_SET_ID:
+        setid = OPTIONS_SET_ID
+    return (_decode_template_record(bytes(buf[offset:end]), setid, policy,
+                                    types._infomodel_generation), end)
+
+def clear_template_cache():
+    """
+    Clear the cache of decoded templates used by
+    :func:`decode_template_from`.
 
-    tmpl = Template(tid, ielist)
+    """
+    _decode_template_record.cache_clear()
+
+def from_ielist(tid, ielist, policy = None):
+    """
+    Create a template from a template ID and an InformationElementList
+
+    :param tid: Template ID, must be between 256 and 65535.
+    :param ielist: List of IEs
+    :param policy: optional :class:`ipfix.types.DecodePolicy` selecting the
+                   representation of values encoded and decoded with the
+                   template
+    :return: A new Template, ready to use for writing to a Message
+
+    """
+    tmpl = Template(tid, ielist, policy)
 
     tmpl.finalize()
 
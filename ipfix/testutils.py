@@ -19,14 +19,18 @@
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from __future__ import unicode_literals, division
-from . import ie, template, message, compat
+from . import ie, types, template, message, reader, recfilter, fileindex, parser, archive, parallel, compat
 from .template import IpfixEncodeError, IpfixDecodeError
 from .compat import xrange
 from datetime import datetime, timedelta
 from ipaddress import ip_address
 import base64
 import io
+import os
+import struct
+import tempfile
+import unittest
+import warnings
 
 _stored_test_message = base64.b64decode(b'AAoPe0mfAfkAAAAAAAAgcAACACABAQAFAAgABACYAAj//v//AACK7gABAAQAAgAIAQEPS38AAAAAAAEfkPtEAARhbGZhAAAAAAAAAAAAAAAAfwAAAQAAAR+Q+0QBBWJyYXZvAAAAAQAAAAAAAAABfwAAAgAAAR+Q+0QCB2NoYXJsaWUAAAACAAAAAAAAAAJ/AAADAAABH5D7RAMFZGVsdGEAAAADAAAAAAAAAAN/AAAEAAABH5D7RAQEZWNobwAAAAQAAAAAAAAABH8AAAUAAAEfkPtEBQdmb3h0cm90AAAABQAAAAAAAAAFfwAABgAAAR+Q+0QGB2dyw7xlemkAAAAGAAAAAAAAAAZ/AAAHAAABH5D7RAcEYWxmYQAAAAcAAAAAAAAAB38AAAgAAAEfkPtECAVicmF2bwAAAAgAAAAAAAAACH8AAAkAAAEfkPtECQdjaGFybGllAAAACQAAAAAAAAAJfwAACgAAAR+Q+0QKBWRlbHRhAAAACgAAAAAAAAAKfwAACwAAAR+Q+0QLBGVjaG8AAAALAAAAAAAAAAt/AAAMAAABH5D7RAwHZm94dHJvdAAAAAwAAAAAAAAADH8AAA0AAAEfkPtEDQdncsO8ZXppAAAADQAAAAAAAAANfwAADgAAAR+Q+0QOBGFsZmEAAAAOAAAAAAAAAA5/AAAPAAABH5D7RA8FYnJhdm8AAAAPAAAAAAAAAA9/AAAQAAABH5D7RBAHY2hhcmxpZQAAABAAAAAAAAAAEH8AABEAAAEfkPtEEQVkZWx0YQAAABEAAAAAAAAAEX8AABIAAAEfkPtEEgRlY2hvAAAAEgAAAAAAAAASfwAAEwAAAR+Q+0QTB2ZveHRyb3QAAAATAAAAAAAAABN/AAAUAAABH5D7RBQHZ3LDvGV6aQAAABQAAAAAAAAAFH8AABUAAAEfkPtEFQRhbGZhAAAAFQAAAAAAAAAVfwAAFgAAAR+Q+0QWBWJyYXZvAAAAFgAAAAAAAAAWfwAAFwAAAR+Q+0QXB2NoYXJsaWUAAAAXAAAAAAAAABd/AAAYAAABH5D7RBgFZGVsdGEAAAAYAAAAAAAAABh/AAAZAAABH5D7RBkEZWNobwAAABkAAAAAAAAAGX8AABoAAAEfkPtEGgdmb3h0cm90AAAAGgAAAAAAAAAafwAAGwAAAR+Q+0QbB2dyw7xlemkAAAAbAAAAAAAAAAB/AAAcAAABH5D7RBwEYWxmYQAAABwAAAAAAAAAAX8AAB0AAAEfkPtEHQVicmF2bwAAAB0AAAAAAAAAAn8AAB4AAAEfkPtEHgdjaGFybGllAAAAHgAAAAAAAAADfwAAHwAAAR+Q+0QfBWRlbHRhAAAAHwAAAAAAAAAEfwAAIAAAAR+Q+0QgBGVjaG8AAAAgAAAAAAAAAAV/AAAhAAABH5D7RCEHZm94dHJvdAAAAAAAAAAAAAAABn8AACIAAAEfkPtEIgdncsO8ZXppAAAAAQAAAAAAAAAHfwAAIwAAAR+Q+0QjBGFsZmEAAAACAAAAAAAAAAh/AAAkAAABH5D7RCQFYnJhdm8AAAADAAAAAAAAAAl/AAAlAAABH5D7RCUHY2hhcmxpZQAAAAQAAAAAAAAACn8AACYAAAEfkPtEJgVkZWx0YQAAAAUAAAAAAAAAC38AACcAAAEfkPtEJwRlY2hvAAAABgAAAAAAAAAMfwAAKAAAAR+Q+0QoB2ZveHRyb3QAAAAHAAAAAAAAAA1/AAApAAABH5D7RCkHZ3LDvGV6aQAAAAgAAAAAAAAADn8AACoAAAEfkPtEKgRhbGZhAAAACQAAAAAAAAAPfwAAKwAAAR+Q+0QrBWJyYXZvAAAACgAAAAAAAAAQfwAALAAAAR+Q+0QsB2NoYXJsaWUAAAALAAAAAAAAABF/AAAtAAABH5D7RC0FZGVsdGEAAAAMAAAAAAAAABJ/AAAuAAABH5D7RC4EZWNobwAAAA0AAAAAAAAAE38AAC8AAAEfkPtELwdmb3h0cm90AAAADgAAAAAAAAAUfwAAMAAAAR+Q+0QwB2dyw7xlemkAAAAPAAAAAAAAABV/AAAxAAABH5D7RDEEYWxmYQAAABAAAAAAAAAAFn8AADIAAAEfkPtEMgVicmF2bwAAABEAAAAAAAAAF38AADMAAAEfkPtEMwdjaGFybGllAAAAEgAAAAAAAAAYfwAANAAAAR+Q+0Q0BWRlbHRhAAAAEwAAAAAAAAAZfwAANQAAAR+Q+0Q1BGVjaG8AAAAUAAAAAAAAABp/AAA2AAABH5D7RDYHZm94dHJvdAAAABUAAAAAAAAAAH8AADcAAAEfkPtENwdncsO8ZXppAAAAFgAAAAAAAAABfwAAOAAAAR+Q+0Q4BGFsZmEAAAAXAAAAAAAAAAJ/AAA5AAABH5D7RDkFYnJhdm8AAAAYAAAAAAAAAAN/AAA6AAABH5D7RDoHY2hhcmxpZQAAABkAAAAAAAAABH8AADsAAAEfkPtEOwVkZWx0YQAAABoAAAAAAAAABX8AADwAAAEfkPtEPARlY2hvAAAAGwAAAAAAAAAGfwAAPQAAAR+Q+0Q9B2ZveHRyb3QAAAAcAAAAAAAAAAd/AAA+AAABH5D7RD4HZ3LDvGV6aQAAAB0AAAAAAAAACH8AAD8AAAEfkPtEPwRhbGZhAAAAHgAAAAAAAAAJfwAAQAAAAR+Q+0RABWJyYXZvAAAAHwAAAAAAAAAKfwAAQQAAAR+Q+0RBB2NoYXJsaWUAAAAgAAAAAAAAAAt/AABCAAABH5D7REIFZGVsdGEAAAAAAAAAAAAAAAx/AABDAAABH5D7REMEZWNobwAAAAEAAAAAAAAADX8AAEQAAAEfkPtERAdmb3h0cm90AAAAAgAAAAAAAAAOfwAARQAAAR+Q+0RFB2dyw7xlemkAAAADAAAAAAAAAA9/AABGAAABH5D7REYEYWxmYQAAAAQAAAAAAAAAEH8AAEcAAAEfkPtERwVicmF2bwAAAAUAAAAAAAAAEX8AAEgAAAEfkPtESAdjaGFybGllAAAABgAAAAAAAAASfwAASQAAAR+Q+0RJBWRlbHRhAAAABwAAAAAAAAATfwAASgAAAR+Q+0RKBGVjaG8AAAAIAAAAAAAAABR/AABLAAABH5D7REsHZm94dHJvdAAAAAkAAAAAAAAAFX8AAEwAAAEfkPtETAdncsO8ZXppAAAACgAAAAAAAAAWfwAATQAAAR+Q+0RNBGFsZmEAAAALAAAAAAAAABd/AABOAAABH5D7RE4FYnJhdm8AAAAMAAAAAAAAABh/AABPAAABH5D7RE8HY2hhcmxpZQAAAA0AAAAAAAAAGX8AAFAAAAEfkPtEUAVkZWx0YQAAAA4AAAAAAAAAGn8AAFEAAAEfkPtEUQRlY2hvAAAADwAAAAAAAAAAfwAAUgAAAR+Q+0RSB2ZveHRyb3QAAAAQAAAAAAAAAAF/AABTAAABH5D7RFMHZ3LDvGV6aQAAABEAAAAAAAAAAn8AAFQAAAEfkPtEVARhbGZhAAAAEgAAAAAAAAADfwAAVQAAAR+Q+0RVBWJyYXZvAAAAEwAAAAAAAAAEfwAAVgAAAR+Q+0RWB2NoYXJsaWUAAAAUAAAAAAAAAAV/AABXAAABH5D7RFcFZGVsdGEAAAAVAAAAAAAAAAZ/AABYAAABH5D7RFgEZWNobwAAABYAAAAAAAAAB38AAFkAAAEfkPtEWQdmb3h0cm90AAAAFwAAAAAAAAAIfwAAWgAAAR+Q+0RaB2dyw7xlemkAAAAYAAAAAAAAAAl/AABbAAABH5D7RFsEYWxmYQAAABkAAAAAAAAACn8AAFwAAAEfkPtEXAVicmF2bwAAABoAAAAAAAAAC38AAF0AAAEfkPtEXQdjaGFybGllAAAAGwAAAAAAAAAMfwAAXgAAAR+Q+0ReBWRlbHRhAAAAHAAAAAAAAAANfwAAXwAAAR+Q+0RfBGVjaG8AAAAdAAAAAAAAAA5/AABgAAABH5D7RGAHZm94dHJvdAAAAB4AAAAAAAAAD38AAGEAAAEfkPtEYQdncsO8ZXppAAAAHwAAAAAAAAAQfwAAYgAAAR+Q+0RiBGFsZmEAAAAgAAAAAAAAABF/AABjAAABH5D7RGMFYnJhdm8AAAAAAAAAAAAAABJ/AABkAAABH5D7RGQHY2hhcmxpZQAAAAEAAAAAAAAAE38AAGUAAAEfkPtEZQVkZWx0YQAAAAIAAAAAAAAAFH8AAGYAAAEfkPtEZgRlY2hvAAAAAwAAAAAAAAAVfwAAZwAAAR+Q+0RnB2ZveHRyb3QAAAAEAAAAAAAAABZ/AABoAAABH5D7RGgHZ3LDvGV6aQAAAAUAAAAAAAAAF38AAGkAAAEfkPtEaQRhbGZhAAAABgAAAAAAAAAYfwAAagAAAR+Q+0RqBWJyYXZvAAAABwAAAAAAAAAZfwAAawAAAR+Q+0RrB2NoYXJsaWUAAAAIAAAAAAAAABp/AABsAAABH5D7RGwFZGVsdGEAAAAJAAAAAAAAAAB/AABtAAABH5D7RG0EZWNobwAAAAoAAAAAAAAAAX8AAG4AAAEfkPtEbgdmb3h0cm90AAAACwAAAAAAAAACfwAAbwAAAR+Q+0RvB2dyw7xlemkAAAAMAAAAAAAAAAN/AABwAAABH5D7RHAEYWxmYQAAAA0AAAAAAAAABH8AAHEAAAEfkPtEcQVicmF2bwAAAA4AAAAAAAAABX8AAHIAAAEfkPtEcgdjaGFybGllAAAADwAAAAAAAAAGfwAAcwAAAR+Q+0RzBWRlbHRhAAAAEAAAAAAAAAAHfwAAdAAAAR+Q+0R0BGVjaG8AAAARAAAAAAAAAAh/AAB1AAABH5D7RHUHZm94dHJvdAAAABIAAAAAAAAACX8AAHYAAAEfkPtEdgdncsO8ZXppAAAAEwAAAAAAAAAKfwAAdwAAAR+Q+0R3BGFsZmEAAAAUAAAAAAAAAAt/AAB4AAABH5D7RHgFYnJhdm8AAAAVAAAAAAAAAAx/AAB5AAABH5D7RHkHY2hhcmxpZQAAABYAAAAAAAAADX8AAHoAAAEfkPtEegVkZWx0YQAAABcAAAAAAAAADn8AAHsAAAEfkPtEewRlY2hvAAAAGAAAAAAAAAAPfwAAfAAAAR+Q+0R8B2ZveHRyb3QAAAAZAAAAAAAAABB/AAB9AAABH5D7RH0HZ3LDvGV6aQAAABoAAAAAAAAAEX8AAH4AAAEfkPtEfgRhbGZhAAAAGwAAAAAAAAASfwAAfwAAAR+Q+0R/BWJyYXZvAAAAHAAAAAAAAAAT')
 
@@ -164,3 +168,1369 @@ def test_message_read_errors():
         assert(False)
     except IpfixDecodeError as e:
         pass
+
+def test_message_tuple_decode():
+    msg = message.MessageBuffer()
+    msg.from_bytes(_stored_test_message)
+    ielist = ie.spec_list(["packetDeltaCount", "testString",
+                           "sourceIPv4Address"])
+    for i, rec in enumerate(msg.tuple_iterator(ielist)):
+        trec = mktest_record(i)
+        assert(rec == (trec['packetDeltaCount'], trec['testString'],
+                       trec['sourceIPv4Address']))
+    assert(i == 127)
+
+def test_message_varlen_decode():
+    ie.use_iana_default()
+    ie.for_spec("testString(35566/32766)<string>")
+    ie.for_spec("testOctets(35566/32765)<octetArray>")
+    tmpl = template.from_ielist(258,
+           ie.spec_list(["testString", "octetDeltaCount[4]",
+                         "testOctets", "packetDeltaCount"]))
+    recs = [("x" * n, n, b"y" * (300 - n), n + 1) for n in (0, 7, 254, 255, 300)]
+
+    msg = message.MessageBuffer()
+    msg.begin_export(8304)
+    msg.add_template(tmpl)
+    msg.export_ensure_set(258)
+    for rec in recs:
+        msg.export_tuple(rec)
+    msg.from_bytes(msg.to_bytes())
+
+    assert(list(msg.tuple_iterator(ie.InformationElementList(tmpl.ies))) == recs)
+
+    ielist = ie.spec_list(["packetDeltaCount", "testOctets"])
+    assert(list(msg.tuple_iterator(ielist)) == [(r[3], r[2]) for r in recs])
+
+    (offset, setid, setlen) = msg.setlist[-1]
+    offsets = msg.template_for_id(258).record_offsets(msg.mbuf, offset + 4,
+                                                     offset + setlen)
+    assert([msg.template_for_id(258).decode_tuple_from(msg.mbuf, o)[0]
+            for o in offsets] == recs)
+
+def mktest_fixlen_message(rec_count=128, odid=8304, tid=259):
+    """
+    Make a test message with a certain number of records, using a template
+    containing only fixed-length Information Elements.
+    """
+    ie.use_iana_default()
+    msg = message.MessageBuffer()
+    msg.begin_export(odid)
+    msg.add_template(template.from_ielist(tid,
+           ie.spec_list(["sourceIPv4Address",
+                         "flowStartMilliseconds",
+                         "octetDeltaCount[4]",
+                         "packetDeltaCount"])))
+    msg.export_ensure_set(tid)
+
+    for seq in xrange(rec_count):
+        msg.export_namedict(mktest_record(seq))
+
+    return msg
+
+def test_message_array_decode():
+    if compat.get_numpy() is None:
+        raise unittest.SkipTest("numpy not available")
+
+    msg = message.MessageBuffer()
+    msg.from_bytes(mktest_fixlen_message().to_bytes())
+    ielist = ie.spec_list(["packetDeltaCount", "sourceIPv4Address"])
+    tuples = list(msg.tuple_iterator(ielist))
+
+    arrays = list(msg.array_iterator(ielist))
+    assert(len(arrays) == 1)
+    assert(arrays[0].dtype.names == ("packetDeltaCount", "sourceIPv4Address"))
+    assert([(int(p), ip_address(int(a))) for p, a in arrays[0]] == tuples)
+
+    # an empty ielist returns all IEs
+    msg.from_bytes(mktest_fixlen_message().to_bytes())
+    arrays = list(msg.array_iterator(ie.spec_list([])))
+    assert(len(arrays) == 1 and len(arrays[0]) == len(tuples))
+    assert("sourceIPv4Address" in arrays[0].dtype.names)
+
+    # sets with variable-length IEs are skipped
+    msg.from_bytes(_stored_test_message)
+    assert(list(msg.array_iterator(ielist)) == [])
+
+def test_coalesced_writes():
+    # coalesced, vectored writes to files and sockets produce the same
+    # stream as writing each message, in fewer writes
+    import socket
+    from . import writer
+    recs = [mktest_record(seq) for seq in xrange(500)]
+
+    def write_stream(stream, **kwargs):
+        w = writer.to_stream(stream, mtu=1400, **kwargs)
+        w.msg.set_export_time(datetime(2013, 6, 21, 14))
+        w.set_domain(8304)
+        w.add_template(mktest_template())
+        w.set_export_template(257)
+        w.export_namedicts(recs)
+        w.flush()
+        return w
+
+    f = io.BytesIO()
+    w = write_stream(f)
+    expected = f.getvalue()
+    assert(w.writecount == w.msgcount)
+
+    with tempfile.TemporaryFile(buffering=0) as f:
+        w = write_stream(f, coalesce_bytes=8192)
+        assert(w.writecount < w.msgcount / 4)
+        assert(f.tell() == len(expected))
+        f.seek(0)
+        assert(f.read() == expected)
+
+    # buffered and compressed files are written through, not around
+    import gzip
+    with tempfile.TemporaryFile() as f:
+        w = write_stream(f, coalesce_bytes=8192)
+        f.write(b"trailer")
+        f.seek(0)
+        assert(f.read() == expected + b"trailer")
+    with tempfile.TemporaryFile() as f:
+        with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+            write_stream(gz, coalesce_bytes=8192)
+        f.seek(0)
+        with gzip.GzipFile(fileobj=f, mode="rb") as gz:
+            assert(gz.read() == expected)
+
+    for kwargs in ({}, {"coalesce_bytes": 65536, "coalesce_delay": 0.1}):
+        (a, b) = socket.socketpair()
+        try:
+            w = write_stream(a, **kwargs)
+            a.close()
+            data = b""
+            while True:
+                chunk = b.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            assert(data == expected)
+        finally:
+            a.close()
+            b.close()
+    assert(w.writecount < w.msgcount)
+
+def test_udp_exporter():
+    # each record arrives whole in a datagram within the MTU, and templates
+    # are refreshed every few datagrams
+    import socket
+    from . import exporter
+    recs = [mktest_record(seq) for seq in xrange(500)]
+
+    rsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rsock.bind(("127.0.0.1", 0))
+    rsock.settimeout(5)
+    try:
+        e = exporter.for_udp("127.0.0.1", rsock.getsockname()[1], mtu=512,
+                             template_refresh_packets=4, batch_count=8,
+                             max_rate=5000)
+        e.set_domain(8304)
+        e.add_template(mktest_template())
+        e.set_export_template(257)
+        e.export_namedicts(recs)
+        e.flush()
+        stats = e.stats()
+        e.close()
+
+        datagrams = [rsock.recv(65536) for i in xrange(stats["datagrams"])]
+    finally:
+        rsock.close()
+
+    assert(stats["messages"] == len(datagrams))
+    assert(stats["records"] == len(recs))
+    assert(stats["drops"] == 0)
+    assert(max(len(d) for d in datagrams) <= 512)
+
+    # a collector joining late gets templates from the next refresh
+    refreshes = []
+    p = parser.IpfixParser()
+    p.msg.template_record_hook = lambda msg, tmpl: refreshes.append(msg)
+    decoded = []
+    for d in datagrams[10:]:
+        decoded.extend(p.feed(d))
+    assert(len(refreshes) >= (len(datagrams) - 10) // 5)
+    assert(decoded == recs[-len(decoded):])
+    per_datagram = max(len(parser.IpfixParser().feed(datagrams[0])), 1)
+    assert(len(decoded) >= len(recs) - 14 * per_datagram)
+
+def test_async_exporter():
+    # single records are sent within max_delay, bursts in full messages,
+    # and templates are exported again on reconnection
+    import asyncio
+    import time
+    from . import exporter
+    recs = [mktest_record(seq) for seq in xrange(2000)]
+    sessions = []
+    arrivals = []
+
+    async def handle(reader, writer):
+        data = bytearray()
+        sessions.append(data)
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            data += chunk
+            arrivals.append(time.monotonic())
+            if len(sessions) == 1 and len(data) > 16384:
+                # drop the first session
+                break
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        e = exporter.for_tcp_async("127.0.0.1", port, mtu=1400,
+                                   max_delay=0.05, reconnect_delay=0.01)
+        await e.start()
+        await e.set_domain(8304)
+        await e.add_template(mktest_template())
+        await e.set_export_template(257)
+
+        start = time.monotonic()
+        await e.export_namedict(recs[0])
+        while not arrivals:
+            await asyncio.sleep(0.005)
+        assert(arrivals[0] - start < 0.5)
+        assert(e.stats()["dwell_flushes"] == 1)
+
+        for rec in recs:
+            await e.export_namedict(rec)
+        while len(sessions) < 2:
+            await asyncio.sleep(0.005)
+        await e.export_namedicts(recs)
+        await e.close()
+        stats = e.stats()
+        server.close()
+        await server.wait_closed()
+        return stats
+
+    stats = asyncio.run(run())
+    assert(stats["connections"] == 2)
+    assert(stats["messages"] < 2 * len(recs) // 40)
+
+    # the second session decodes on its own
+    decoded = parser.IpfixParser().feed(bytes(sessions[1]))
+    assert(decoded[-len(recs):] == recs)
+
+def test_async_udp_export_before_start():
+    # records exported before start are held in messages of a default
+    # size, and sent once connected
+    import asyncio
+    import socket
+    from . import exporter
+    recs = [mktest_record(seq) for seq in xrange(100)]
+    rsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rsock.bind(("127.0.0.1", 0))
+    rsock.settimeout(5)
+    port = rsock.getsockname()[1]
+
+    async def run():
+        e = exporter.for_udp_async("127.0.0.1", port, max_delay=None)
+        await e.set_domain(8304)
+        await e.add_template(mktest_template())
+        await e.set_export_template(257)
+        assert(e.msg.mtu == exporter._initial_udp_mtu)
+        exports = asyncio.ensure_future(e.export_namedicts(recs))
+        await asyncio.sleep(0.01)
+        assert(not exports.done())
+        await e.start()
+        await exports
+        await e.close()
+        return e.stats()
+
+    try:
+        stats = asyncio.run(run())
+        assert(stats["records"] == len(recs))
+        decoded = []
+        p = parser.IpfixParser()
+        while len(decoded) < len(recs):
+            decoded += p.feed(rsock.recv(65536))
+    finally:
+        rsock.close()
+    assert(decoded == recs)
+
+def test_array_export():
+    # arrays and columns export the same records as tuples, and round-trip
+    # through array decoding
+    if compat.get_numpy() is None:
+        raise unittest.SkipTest("numpy not available")
+    from . import writer
+    numpy = compat.get_numpy()
+
+    ie.use_iana_default()
+    tmpl = template.from_ielist(258, ie.spec_list(["sourceIPv4Address",
+                                "flowStartMilliseconds", "octetDeltaCount[4]",
+                                "packetDeltaCount"]))
+    recs = [mktest_record(seq) for seq in xrange(500)]
+    columns = {"sourceIPv4Address": [int(rec["sourceIPv4Address"])
+                                     for rec in recs],
+               "flowStartMilliseconds": numpy.array(
+                        [rec["flowStartMilliseconds"] for rec in recs],
+                        dtype="datetime64[ms]"),
+               "octetDeltaCount": [rec["octetDeltaCount"] for rec in recs],
+               "packetDeltaCount": [rec["packetDeltaCount"] for rec in recs]}
+
+    streams = []
+    for mode in ("namedicts", "columns", "array"):
+        f = io.BytesIO()
+        w = writer.to_stream(f, mtu=1400)
+        w.msg.set_export_time(datetime(2013, 6, 21, 14))
+        w.set_domain(8304)
+        w.add_template(tmpl)
+        w.set_export_template(tmpl.tid)
+        if mode == "namedicts":
+            w.export_namedicts(recs)
+        elif mode == "columns":
+            w.export_columns(columns)
+        else:
+            arrays = []
+            r = reader.from_stream(io.BytesIO(streams[0]))
+            for msg in r._read_messages():
+                arrays.extend(msg.array_iterator(
+                            ie.InformationElementList(tmpl.ies)))
+            w.export_array(numpy.concatenate(arrays))
+        w.flush()
+        streams.append(f.getvalue())
+
+    assert(streams[1] == streams[0])
+    assert(streams[2] == streams[0])
+
+def test_array_export_overflow():
+    # columns that don't fit their IEs are refused rather than wrapped
+    if compat.get_numpy() is None:
+        raise unittest.SkipTest("numpy not available")
+    from . import writer
+    numpy = compat.get_numpy()
+
+    ie.use_iana_default()
+    tmpl = template.from_ielist(258, ie.spec_list(["sourceTransportPort",
+                                                   "ingressInterface"]))
+    good = {"sourceTransportPort": [80, 65535], "ingressInterface": [0, 1]}
+    bad = [{"sourceTransportPort": [80, 70000], "ingressInterface": [0, 1]},
+           {"sourceTransportPort": [80, 443], "ingressInterface": [-1, 1]},
+           {"sourceTransportPort": [80.5, 443], "ingressInterface": [0, 1]}]
+    native = numpy.zeros(2, dtype=[("sourceTransportPort", "u4"),
+                                   ("ingressInterface", "i8")])
+    native["sourceTransportPort"] = 70000
+
+    w = writer.to_stream(io.BytesIO())
+    w.set_domain(8304)
+    w.add_template(tmpl)
+    w.set_export_template(tmpl.tid)
+    w.export_columns(good)
+    for columns in bad:
+        try:
+            w.export_columns(columns)
+            assert(False)
+        except message.IpfixEncodeError:
+            pass
+    try:
+        w.export_array(native)
+        assert(False)
+    except message.IpfixEncodeError:
+        pass
+
+def test_message_view_decode():
+    msg = message.MessageBuffer()
+    msg.from_bytes(_stored_test_message)
+    views = list(msg.view_iterator())
+    assert(len(views) == 128)
+
+    msg.from_bytes(_stored_test_message)
+    for view, rec in zip(views, msg.namedict_iterator()):
+        assert(view.as_namedict() == rec)
+        assert(view["packetDeltaCount"] == rec["packetDeltaCount"])
+        assert(view.testString == rec["testString"])
+        assert(view.get("octetDeltaCount") == rec["octetDeltaCount"])
+        assert(view.get("destinationIPv4Address") is None)
+        assert(sorted(view.keys()) == sorted(rec.keys()))
+
+def test_message_batch_decode():
+    ielist = ie.spec_list(["packetDeltaCount", "sourceIPv4Address"])
+    for msgbytes in (_stored_test_message,
+                     mktest_fixlen_message().to_bytes()):
+        msg = message.MessageBuffer()
+        msg.from_bytes(msgbytes)
+        recs = list(msg.namedict_iterator())
+        tuples = list(msg.tuple_iterator(ielist))
+
+        msg.from_bytes(msgbytes)
+        assert([r for b in msg.namedict_batch_iterator() for r in b] == recs)
+        assert([t for b in msg.tuple_batch_iterator(ielist) for t in b] == tuples)
+
+def test_message_filtered_decode():
+    msg = message.MessageBuffer()
+    msg.from_bytes(_stored_test_message)
+    recs = list(msg.namedict_iterator())
+
+    for expr, fn in (
+        ("packetDeltaCount == 3", lambda r: r['packetDeltaCount'] == 3),
+        ("testString in ('alfa', 'echo') and not octetDeltaCount >= 10",
+         lambda r: r['testString'] in ('alfa', 'echo') and
+                   not r['octetDeltaCount'] >= 10),
+        ("sourceIPv4Address < '127.0.0.5' or packetDeltaCount == 26",
+         lambda r: r['sourceIPv4Address'] < ip_address('127.0.0.5') or
+                   r['packetDeltaCount'] == 26)):
+        f = recfilter.for_expression(expr)
+        msg.from_bytes(_stored_test_message)
+        assert(list(msg.namedict_iterator(recfilter=f)) ==
+               [r for r in recs if fn(r)])
+
+    # filters match the same records whatever the reader's DecodePolicy,
+    # on IEs before and after a variable-length IE
+    ie.use_iana_default()
+    tmpl = template.from_ielist(256, ie.spec_list(["protocolIdentifier",
+                        "interfaceName", "sourceIPv4Address"]))
+    pmsg = message.MessageBuffer()
+    pmsg.begin_export(8304)
+    pmsg.add_template(tmpl)
+    pmsg.export_ensure_set(256)
+    for i in xrange(16):
+        pmsg.export_tuple((i % 3, "eth%u" % i, ip_address("10.0.0.%u" % i)))
+    pbytes = pmsg.to_bytes()
+    f = recfilter.for_expression("sourceIPv4Address == '10.0.0.1' or "
+                                 "protocolIdentifier == 2")
+    for policy in (None, types.DecodePolicy(ipv4="int")):
+        pmsg = message.MessageBuffer(policy=policy)
+        pmsg.from_bytes(pbytes)
+        assert([r["interfaceName"] for r in pmsg.namedict_iterator(recfilter=f)]
+               == ["eth1", "eth2", "eth5", "eth8", "eth11", "eth14"])
+
+    # templates without a filtered IE are skipped
+    f = recfilter.for_expression("destinationTransportPort == 80")
+    msg.from_bytes(_stored_test_message)
+    assert(list(msg.namedict_iterator(recfilter=f)) == [])
+
+    for expr in ("packetDeltaCount", "packetDeltaCount == octetDeltaCount",
+                 "packetDeltaCount +", "packetDeltaCount is 3",
+                 "sourceIPv4Address == None",
+                 "sourceIPv4Address in {'10.0.0.1', None}",
+                 "sourceIPv4Address == 'bogus'"):
+        try:
+            recfilter.for_expression(expr)
+            assert(False)
+        except ValueError:
+            pass
+
+def test_message_policy_decode():
+    policy = types.DecodePolicy(ipv4="int", timestamps="ns",
+                                strings="memoryview")
+    msg = message.MessageBuffer(policy=policy)
+    msg.from_bytes(_stored_test_message)
+    for i, view in enumerate(msg.view_iterator()):
+        trec = mktest_record(i)
+        assert(view['sourceIPv4Address'] == int(trec['sourceIPv4Address']))
+        assert(view['flowStartMilliseconds'] ==
+               int(types._encode_msec(trec['flowStartMilliseconds'])) * 1000000)
+        assert(view['testString'].tobytes().decode('utf8') == trec['testString'])
+
+    msg.from_bytes(_stored_test_message)
+    for i, rec in enumerate(msg.namedict_iterator()):
+        trec = mktest_record(i)
+        assert(rec['sourceIPv4Address'] == int(trec['sourceIPv4Address']))
+        assert(rec['testString'].tobytes().decode('utf8') == trec['testString'])
+
+    # the default policy is unaffected
+    msg = message.MessageBuffer()
+    msg.from_bytes(_stored_test_message)
+    assert(next(msg.namedict_iterator())['sourceIPv4Address'] ==
+           ip_address("127.0.0.0"))
+
+    try:
+        types.DecodePolicy(ipv4="float")
+        assert(False)
+    except ValueError:
+        pass
+
+def test_message_policy_encode():
+    # integer nanosecond timestamps round-trip exactly through
+    # dateTimeNanoseconds, and varlen values after them are encoded
+    ie.use_iana_default()
+    policy = types.DecodePolicy(ipv4="int", timestamps="ns")
+    ielist = ie.spec_list(["flowStartNanoseconds", "flowEndMilliseconds",
+                           "interfaceName", "sourceIPv4Address"])
+    tmpl = template.from_ielist(256, ielist, policy)
+    recs = [(1371823203456789123 + 1234567 * i, 1371823203456000000 + 1000000 * i,
+             "eth%u" % i, 0x7f000000 + i) for i in xrange(64)]
+
+    msg = message.MessageBuffer()
+    msg.begin_export(8304)
+    msg.add_template(tmpl)
+    msg.export_ensure_set(256)
+    for rec in recs:
+        msg.export_tuple(rec)
+
+    dmsg = message.MessageBuffer(policy=policy)
+    dmsg.from_bytes(msg.to_bytes())
+    assert(list(dmsg.tuple_iterator(ielist)) == recs)
+
+def test_compiled_encoders():
+    # tuple, dict and object input encode identically to the generic
+    # encoder, including long varlen values
+    import collections
+    tmpl = mktest_template()
+    names = [e.name for e in tmpl.ies]
+    Flow = collections.namedtuple("Flow", names)
+    recs = [mktest_record(seq) for seq in xrange(8)]
+    recs[3]["testString"] = "x" * 300
+
+    for rec in recs:
+        vals = tuple(rec[name] for name in names)
+        generic = bytearray(1024)
+        end = tmpl.encode_to(generic, 0, vals, tmpl.packplan)
+        for (fn, arg) in ((template.Template.encode_tuple_to, vals),
+                          (template.Template.encode_namedict_to, rec),
+                          (template.Template.encode_object_to, Flow(*vals))):
+            buf = memoryview(bytearray(1024))
+            assert(fn(tmpl, buf, 0, arg) == end)
+            assert(buf[:end] == generic[:end])
+        assert(tmpl.decode_namedict_from(memoryview(generic), 0)[0]["testString"]
+               == rec["testString"])
+
+    # templates with the same layout share encoders
+    assert(mktest_template(300).compiled_encoders() is
+           tmpl.compiled_encoders())
+
+def test_bulk_export():
+    # bulk export produces the same messages as exporting one at a time
+    from . import writer
+    ie.use_iana_default()
+    fixtmpl = template.from_ielist(258, ie.spec_list(["sourceIPv4Address",
+                                   "octetDeltaCount[4]", "packetDeltaCount"]))
+    for tmpl in (mktest_template(), fixtmpl):
+        names = [e.name for e in tmpl.ies]
+        recs = [mktest_record(seq) for seq in xrange(500)]
+        tuples = [tuple(rec[name] for name in names) for rec in recs]
+
+        streams = []
+        for mode in ("single", "tuples", "namedicts"):
+            f = io.BytesIO()
+            w = writer.to_stream(f, mtu=1400)
+            w.msg.set_export_time(datetime(2013, 6, 21, 14))
+            w.set_domain(8304)
+            w.add_template(tmpl)
+            w.set_export_template(tmpl.tid)
+            if mode == "single":
+                for rec in tuples:
+                    w.export_tuple(rec)
+            elif mode == "tuples":
+                w.export_tuples(tuples)
+            else:
+                w.export_namedicts(iter(recs))
+            w.flush()
+            streams.append((f.getvalue(), w.msgcount))
+
+        assert(streams[0][1] > 1)
+        assert(streams[1] == streams[0])
+        assert(streams[2] == streams[0])
+
+    # a message is full when the next record runs off the end of the
+    # buffer; a record with a value that can't be encoded is an error, and
+    # the records before it are kept
+    tmpl = mktest_template()
+    names = [e.name for e in tmpl.ies]
+    tuples = [tuple(mktest_record(seq)[name] for name in names)
+              for seq in xrange(100)]
+    msg = message.MessageBuffer(buf_sz=1000)
+    msg.begin_export(8304)
+    msg.add_template(tmpl)
+    msg.export_ensure_set(257)
+    end = msg.export_tuples(tuples)
+    assert(0 < end < 100 and msg.length <= 1000)
+
+    bad = list(tuples)
+    bad[10] = bad[10][:2] + ("x" * 70000,) + bad[10][3:]
+    msg = message.MessageBuffer()
+    msg.begin_export(8304)
+    msg.add_template(tmpl)
+    msg.export_ensure_set(257)
+    try:
+        msg.export_tuples(bad)
+        assert(False)
+    except IpfixEncodeError:
+        pass
+    msg.from_bytes(msg.to_bytes())
+    assert([rec[4] for rec in msg.tuple_iterator(ie.spec_list(names))] ==
+           [rec[4] for rec in tuples[:10]])
+
+    # the same holds for records missing values, with a fixed-length
+    # template, and the index of the bad record is reported
+    recs = [mktest_record(seq) for seq in xrange(20)]
+    del recs[12]["packetDeltaCount"]
+    msg = message.MessageBuffer()
+    msg.begin_export(8304)
+    msg.add_template(fixtmpl)
+    msg.export_ensure_set(258)
+    try:
+        msg.export_namedicts(recs)
+        assert(False)
+    except IpfixEncodeError as e:
+        assert(e.index == 12)
+    assert(msg.sequences[(8304, 0)] == 12)
+    assert(msg.export_namedicts(recs, 13) == 20)
+    msg.from_bytes(msg.to_bytes())
+    assert([rec["octetDeltaCount"] for rec in msg.namedict_iterator()] ==
+           [recs[i]["octetDeltaCount"] for i in xrange(20) if i != 12])
+
+def test_template_interning():
+    # identical templates in different messages decode to the same instance
+    msg1 = message.MessageBuffer()
+    msg1.from_bytes(_stored_test_message)
+    list(msg1.namedict_iterator())
+    msg2 = message.MessageBuffer()
+    msg2.from_bytes(mktest_message(rec_count=1).to_bytes())
+    list(msg2.namedict_iterator())
+    assert(msg1.templates[(8304, 257)] is msg2.templates[(8304, 257)])
+
+    msg2.from_bytes(mktest_message(rec_count=1, tid=258).to_bytes())
+    list(msg2.namedict_iterator())
+    assert(msg2.templates[(8304, 258)].tid == 258)
+    assert(msg1.templates[(8304, 257)] is not msg2.templates[(8304, 258)])
+
+def test_template_infomodel_changes():
+    # templates decoded before their IEs are registered are decoded again
+    # once they are
+    tmpl = template.from_ielist(256, [ie.for_template_entry(35566, 31000, 4)])
+    buf = bytearray(tmpl.enclength + 4)
+    tmpl.encode_template_to(buf, 0, template.TEMPLATE_SET_ID)
+    before = template.decode_template_from(buf, 0, template.TEMPLATE_SET_ID)[0]
+    assert(before.ies[0].name == "_ipfix_35566_31000")
+    assert(template.decode_template_from(buf, 0,
+                                         template.TEMPLATE_SET_ID)[0] is before)
+
+    # decoding a template with a new unknown IE keeps other cached templates
+    buf2 = struct.pack("!HHHHL", 257, 1, 0x8000 | 31001, 4, 35566)
+    assert(template.decode_template_from(buf2, 0, template.TEMPLATE_SET_ID)[0]
+           .ies[0].name == "_ipfix_35566_31001")
+    assert(template.decode_template_from(buf, 0,
+                                         template.TEMPLATE_SET_ID)[0] is before)
+
+    ie.for_spec("testCounter(35566/31000)<unsigned32>")
+    after = template.decode_template_from(buf, 0, template.TEMPLATE_SET_ID)[0]
+    assert(after.ies[0].name == "testCounter")
+    assert(after.ies[0].type.name == "unsigned32")
+
+def test_message_from_buffer():
+    # in-place decode matches decode from a copy, and ignores trailing data
+    msgbytes = _stored_test_message + b"\0" * 7
+    msg = message.MessageBuffer()
+    msg.from_buffer(memoryview(msgbytes))
+    assert(msg.length == len(_stored_test_message))
+    for i, rec in enumerate(msg.namedict_iterator()):
+        assert(rec["packetDeltaCount"] == mktest_record(i)["packetDeltaCount"])
+    assert(i == 127)
+
+    # exporting after an in-place read uses the message buffer's own buffer
+    msg.begin_export(8304)
+    assert(msg.mbuf is msg.ownbuf)
+
+def mktest_file(stream, msg_count=64, rec_count=16, odid=8304, tid=257):
+    """
+    Write a test file of messages with consecutive export times, each
+    containing a certain number of records. Only the first message contains
+    the template.
+    """
+    msg = message.MessageBuffer()
+    for i in xrange(msg_count):
+        msg.begin_export(odid)
+        if i == 0:
+            msg.add_template(mktest_template(tid))
+        msg.export_ensure_set(tid)
+        msg.set_export_time(datetime(2009, 2, 20, 19, 18, 17) +
+                            timedelta(0, i))
+        for seq in xrange(i * rec_count, (i + 1) * rec_count):
+            msg.export_namedict(mktest_record(seq))
+        msg.write_message(stream)
+
+def test_mapped_file_reader():
+    with tempfile.TemporaryFile() as f:
+        mktest_file(f)
+        f.flush()
+        with reader.from_file(f) as r:
+            r.checkpoint_interval = 1
+            assert(len(r) == 64)
+            assert(r.export_time(3) == datetime(2009, 2, 20, 19, 18, 20))
+
+            # random access, with templates from the first message
+            for msgnum in (40, 2, 63, 0):
+                msg = r.message_at(msgnum)
+                recs = list(msg.namedict_iterator())
+                assert(len(recs) == 16)
+                assert(recs[0]["packetDeltaCount"] == (msgnum * 16) % 27)
+            del msg
+
+            # access by export time
+            assert(r.messages_between(datetime(2009, 2, 20, 19, 18, 27),
+                                      datetime(2009, 2, 20, 19, 18, 30)) ==
+                   [10, 11, 12])
+            ielist = ie.spec_list(["octetDeltaCount"])
+            assert(list(r.tuple_iterator(ielist,
+                        start=datetime(2009, 2, 20, 19, 18, 27),
+                        end=datetime(2009, 2, 20, 19, 18, 30))) ==
+                   [(seq % 33,) for seq in xrange(160, 208)])
+
+    # templates are carried over whether or not records are read, and
+    # withdrawn templates are dropped
+    f = io.BytesIO()
+    msg = message.MessageBuffer()
+    msg.begin_export(8304)
+    msg.add_template(mktest_template())
+    msg.write_message(f)
+    msg.begin_export(8304)
+    msg.export_ensure_set(257)
+    msg.export_namedict(mktest_record(0))
+    msg.write_message(f)
+    msg.begin_export(8304)
+    msg._export_template_withdrawal(template.TEMPLATE_SET_ID, 257)
+    msg.write_message(f)
+    with tempfile.TemporaryFile() as tf:
+        tf.write(f.getvalue())
+        tf.flush()
+        with reader.from_file(tf) as r:
+            tkeys = []
+            for (i, rmsg) in enumerate(r.message_iterator()):
+                tkeys.append(sorted(rmsg.templates))
+                if i == 1:
+                    assert(len(list(rmsg.namedict_iterator())) == 1)
+            del rmsg
+            assert(tkeys == [[], [(8304, 257)], [(8304, 257)]])
+            assert(r._templates_before(3) == {})
+
+def test_file_index():
+    f = io.BytesIO()
+    mktest_file(f, msg_count=32)
+    idx = fileindex.build_index(f, ["flowStartMilliseconds"])
+    assert(idx.record_counts.tolist() == [16] * 32)
+    assert(idx.templates_defined(0) == [257])
+    assert(idx.templates_defined(1) == [])
+    assert(idx.sets_present(31) == [257])
+    assert(idx.definition_before(8304, 257, 31) == 0)
+    assert(idx.time_range(1, "flowStartMilliseconds") ==
+           (datetime(2009, 2, 20, 0, 0, 0, 16000),
+            datetime(2009, 2, 20, 0, 0, 0, 31000)))
+
+    # round trip through a sidecar
+    g = io.BytesIO()
+    idx.write(g)
+    g.seek(0)
+    idx2 = fileindex.from_stream(g)
+    assert([a.tolist() for a in idx._arrays()] ==
+           [a.tolist() for a in idx2._arrays()])
+    assert(idx2.timeies == idx.timeies)
+
+    # sidecars have the same fixed-width layout on every platform: after
+    # the header and time IE specs, a count and big-endian values for each
+    # array, starting with 64-bit offsets and 32-bit export times
+    data = g.getvalue()
+    pos = fileindex._idxhdr_st.size + 2 + len(str(idx.timeies[0]).encode())
+    assert(struct.unpack_from("!LQQ", data, pos) == (32, 0, idx.offsets[1]))
+    pos += 4 + 8 * 32
+    assert(struct.unpack_from("!LL", data, pos) == (32, idx.export_epochs[0]))
+    assert(len(data) == pos + 4 + 4 * 32 + 2 * (4 + 4 * 32) +
+                        2 * (4 + 8 * 32) + (4 + 2) + (4 + 4 * 33) +
+                        (4 + 2 * 32) + (4 + 4 * 33))
+
+    # selected messages decode with replayed templates
+    r = reader.from_stream(f)
+    r.select_messages(idx2, [20, 3])
+    ielist = ie.spec_list(["packetDeltaCount"])
+    assert(list(r.tuple_iterator(ielist)) ==
+           [(seq % 27,) for seq in list(xrange(320, 336)) +
+                                   list(xrange(48, 64))])
+
+    # an older definition message doesn't replace a newer template for
+    # another ID
+    ie.use_iana_default()
+    f = io.BytesIO()
+    msg = message.MessageBuffer()
+    msg.begin_export(8304)
+    msg.add_template(template.from_ielist(256,
+                        ie.spec_list(["octetDeltaCount"])))
+    msg.add_template(template.from_ielist(257,
+                        ie.spec_list(["packetDeltaCount"])))
+    msg.write_message(f)
+    msg.begin_export(8304)
+    msg.add_template(template.from_ielist(257,
+                        ie.spec_list(["packetDeltaCount", "protocolIdentifier"])))
+    msg.write_message(f)
+    msg.begin_export(8304)
+    msg.export_ensure_set(257)
+    msg.export_tuple((7, 6))
+    msg.export_new_set(256)
+    msg.export_tuple((5,))
+    msg.write_message(f)
+
+    idx = fileindex.build_index(f)
+    r = reader.from_stream(f)
+    r.select_messages(idx, [2])
+    assert(list(r.namedict_iterator()) ==
+           [{"packetDeltaCount": 7, "protocolIdentifier": 6},
+            {"octetDeltaCount": 5}])
+
+def test_file_index_sidecar():
+    # a sidecar indexing other time IEs than requested is rebuilt, or
+    # refused if it may not be
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "test.ipfix")
+        with open(filename, mode="wb") as f:
+            mktest_file(f, msg_count=4)
+
+        timeies = ["flowStartMilliseconds"]
+        assert(fileindex.for_file(filename).timeies == [])
+        assert(fileindex.for_file(filename, create=False).timeies == [])
+        try:
+            fileindex.for_file(filename, timeies, create=False)
+            assert(False)
+        except IOError:
+            pass
+        idx = fileindex.for_file(filename, timeies)
+        assert([e.name for e in idx.timeies] == timeies)
+        assert(fileindex.for_file(filename, timeies,
+                                  create=False).timeies == idx.timeies)
+
+def test_parallel_file_reader():
+    # chunks decoded in parallel give the same records as reading the file
+    # in order, across template redefinitions and withdrawals
+    with tempfile.NamedTemporaryFile() as f:
+        mktest_file(f, msg_count=32)
+        msg = message.MessageBuffer()
+        msg.begin_export(8304)
+        msg.add_template(template.from_ielist(257, ie.spec_list(
+                            ["sourceIPv4Address", "packetDeltaCount"])))
+        msg.add_template(template.from_ielist(258, ie.spec_list(
+                            ["packetDeltaCount"])))
+        msg.export_ensure_set(257)
+        for seq in xrange(16):
+            msg.export_namedict(mktest_record(seq))
+        msg.write_message(f)
+        msg.begin_export(8304)
+        msg._export_template_withdrawal(template.TEMPLATE_SET_ID, 258)
+        msg.write_message(f)
+        mktest_file(f, msg_count=32, tid=259)
+        f.flush()
+
+        f.seek(0)
+        expected = list(reader.from_stream(f).namedict_iterator())
+        assert(len(expected) == 1040)
+        ielist = ie.spec_list(["packetDeltaCount", "sourceIPv4Address"])
+        f.seek(0)
+        expected_tuples = list(reader.from_stream(f).tuple_iterator(ielist))
+
+        r = parallel.from_file(f.name, max_workers=2, chunk_size=4096)
+        assert(len(r.chunks) > 4)
+        assert(sorted(r.chunks[-1][2]) == [(8304, 257), (8304, 259)])
+        assert([rec for recs in r.namedict_batch_iterator() for rec in recs]
+               == expected)
+        assert([rec for recs in r.tuple_batch_iterator(ielist) for rec in recs]
+               == expected_tuples)
+        unordered = [rec for recs in r.tuple_batch_iterator(ielist,
+                                                            ordered=False)
+                     for rec in recs]
+        assert(sorted(unordered) == sorted(expected_tuples))
+
+def test_parallel_array_types():
+    # arrays from templates encoding an IE in different reduced lengths
+    # are combined in a common type
+    if compat.get_numpy() is None:
+        raise unittest.SkipTest("numpy not available")
+
+    ie.use_iana_default()
+    with tempfile.NamedTemporaryFile() as f:
+        msg = message.MessageBuffer()
+        msg.begin_export(8304)
+        for (tid, spec) in ((257, "packetDeltaCount[4]"),
+                            (258, "packetDeltaCount")):
+            msg.add_template(template.from_ielist(tid, ie.spec_list([spec])))
+            msg.export_ensure_set(tid)
+            for seq in xrange(8):
+                msg.export_tuple((tid * 100 + seq,))
+        msg.write_message(f)
+        f.flush()
+
+        r = parallel.from_file(f.name, max_workers=1)
+        arrays = list(r.array_iterator(ie.spec_list(["packetDeltaCount"])))
+        assert(len(arrays) == 1)
+        assert(arrays[0].dtype["packetDeltaCount"].itemsize == 8)
+        assert(arrays[0]["packetDeltaCount"].tolist() ==
+               [tid * 100 + seq for tid in (257, 258) for seq in xrange(8)])
+
+def test_parser_chunks():
+    # records are the same however the stream is split
+    f = io.BytesIO()
+    mktest_file(f, msg_count=8)
+    data = f.getvalue()
+    ielist = ie.spec_list(["packetDeltaCount", "testString"])
+    expected = [(mktest_record(seq)["packetDeltaCount"],
+                 mktest_record(seq)["testString"]) for seq in xrange(128)]
+
+    for chunksz in (1, 3, 17, 500, len(data)):
+        p = parser.IpfixParser(ielist=ielist)
+        recs = []
+        for i in xrange(0, len(data), chunksz):
+            recs.extend(p.feed(bytearray(data[i:i+chunksz])))
+        assert(recs == expected)
+        assert(p.msgcount == 8)
+        assert(len(p.pending) == 0)
+
+    # batches are filtered like records
+    f = recfilter.for_expression("packetDeltaCount < 10")
+    count = len([rec for rec in expected if rec[0] < 10])
+    for pielist in (None, ielist):
+        p = parser.IpfixParser(ielist=pielist, recfilter=f)
+        recs = p.feed(data)
+        p = parser.IpfixParser(ielist=pielist, recfilter=f)
+        batches = p.feed_batches(data)
+        assert(0 < len(recs) == count < len(expected))
+        assert([rec for batch in batches for rec in batch] == recs)
+
+    # data following the last message yielded is kept, whether or not
+    # the iterator is exhausted or closed
+    for split in (len(data) // 2, len(data) - 10):
+        for close_first in (False, True):
+            p = parser.IpfixParser(ielist=ielist)
+            it = p.messages(data[:split])
+            recs = p.decode(next(it))
+            if close_first:
+                it.close()
+            recs.extend(p.feed(data[split:]))
+            it.close()
+            assert(recs == expected)
+            assert(len(p.pending) == 0)
+
+    # partial data is dropped on error, so the next message decodes
+    p = parser.IpfixParser()
+    try:
+        p.feed(b"\0\x09")
+        p.feed(b"\0\x20")
+        assert(False)
+    except IpfixDecodeError:
+        pass
+    assert(len(p.feed(data)) == 128)
+
+def test_tcp_collector():
+    # concurrent sessions over loopback, with a coroutine sink
+    import asyncio
+    from . import collector
+
+    f = io.BytesIO()
+    mktest_file(f, msg_count=8)
+    data = f.getvalue()
+    ielist = ie.spec_list(["packetDeltaCount"])
+    received = {}
+
+    # a template claiming five fields, carrying one
+    body = struct.pack("!HHHHHH", 2, 12, 256, 5, 8, 4)
+    bad = struct.pack("!HHLLL", 10, 16 + len(body), 0, 0, 8304) + body
+
+    async def sink(session, recs):
+        received.setdefault(session.peer, []).extend(recs)
+        await asyncio.sleep(0)
+
+    async def export(host, port, chunksz):
+        (r, w) = await asyncio.open_connection(host, port)
+        for i in xrange(0, len(data), chunksz):
+            w.write(data[i:i+chunksz])
+            await w.drain()
+        w.close()
+
+    async def run():
+        c = collector.for_tcp(sink, host="127.0.0.1", port=0,
+                              ielist=ielist, batch_size=50)
+        await c.start()
+        (host, port) = c.addresses()[0][:2]
+        await asyncio.gather(*[export(host, port, chunksz)
+                               for chunksz in (7, 100, 1000, len(data))])
+
+        # a malformed message closes its session, and is counted
+        (r, w) = await asyncio.open_connection(host, port)
+        w.write(bad)
+        await r.read()
+        w.close()
+
+        while c.sessions or c.stats()["sessions"] < 5:
+            await asyncio.sleep(0.01)
+        c.close()
+        await c.wait_closed()
+        return c.stats()
+
+    stats = asyncio.run(run())
+    assert(stats["sessions"] == 5)
+    assert(stats["decode_errors"] == 1)
+    assert(stats["records"] == 4 * 128)
+    assert(stats["sequence_errors"] == 0)
+    assert(len(received) == 4)
+    for recs in received.values():
+        assert(recs == [(mktest_record(seq)["packetDeltaCount"],)
+                        for seq in xrange(128)])
+
+def test_tcp_collector_rejected():
+    # sessions beyond max_sessions are closed at once, and counted
+    import asyncio
+    from . import collector
+
+    async def run():
+        c = collector.for_tcp(lambda session, recs: None, host="127.0.0.1",
+                              port=0, max_sessions=1)
+        await c.start()
+        (host, port) = c.addresses()[0][:2]
+        (r1, w1) = await asyncio.open_connection(host, port)
+        while not c.sessions:
+            await asyncio.sleep(0.01)
+        (r2, w2) = await asyncio.open_connection(host, port)
+        assert(await r2.read() == b"")
+        w2.close()
+        w1.close()
+        while c.sessions:
+            await asyncio.sleep(0.01)
+        c.close()
+        await c.wait_closed()
+        return c.stats()
+
+    stats = asyncio.run(run())
+    assert(stats["rejected"] == 1)
+    assert(stats["sessions"] == 1)
+
+def test_udp_collector():
+    # templates are scoped per exporter, and expire
+    import asyncio
+    import socket
+    import time
+    from . import collector
+
+    f = io.BytesIO()
+    mktest_file(f, msg_count=4)
+    data = f.getvalue()
+    amsgs = []
+    offset = 0
+    while offset < len(data):
+        length = message._msghdr_st.unpack_from(data, offset)[1]
+        amsgs.append(data[offset:offset+length])
+        offset += length
+    bmsg = mktest_fixlen_message(rec_count=16, tid=257).to_bytes()
+    received = {}
+
+    def sink(session, recs):
+        received.setdefault(session.peer, []).extend(recs)
+
+    async def run():
+        c = collector.for_udp(sink, host="127.0.0.1", port=0)
+        await c.start()
+        addr = c.addresses()[0]
+        a = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        b = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        a.sendto(amsgs[0], addr)
+        b.sendto(bmsg, addr)
+        for data in amsgs[1:3]:
+            a.sendto(data, addr)
+        while c.stats()["messages"] < 4:
+            await asyncio.sleep(0.01)
+
+        # expire all templates, then send a message needing one
+        c.expire(time.monotonic() + c.template_lifetime + 1)
+        a.sendto(amsgs[3], addr)
+        b.sendto(b"\0\x0a\0\x10", addr)
+        while c.stats()["datagrams"] < 6:
+            await asyncio.sleep(0.01)
+
+        c.close()
+        await c.wait_closed()
+        peers = (("127.0.0.1", a.getsockname()[1]),
+                 ("127.0.0.1", b.getsockname()[1]))
+        a.close()
+        b.close()
+        return (c.stats(), peers)
+
+    (stats, (apeer, bpeer)) = asyncio.run(run())
+    assert(stats["records"] == 64)
+    assert(stats["expired_templates"] == 2)
+    assert(stats["sessions"] == 2)
+    assert(stats["unknown_sets"] == 1)
+    assert(stats["decode_errors"] == 1)
+    assert(stats["sequence_errors"] == 0)
+    assert(len(received[apeer]) == 48)
+    assert(received[apeer][47]["testString"] == mktest_record(47)["testString"])
+    assert(len(received[bpeer]) == 16)
+    assert("testString" not in received[bpeer][0])
+
+def test_udp_collector_sequence():
+    # records in sets skipped for the ielist count toward sequence numbers,
+    # and the collector can be closed without an event loop
+    import asyncio
+    import socket
+    from . import collector
+
+    ie.use_iana_default()
+    fixtmpl = template.from_ielist(258, ie.spec_list(["sourceIPv4Address",
+                                        "destinationTransportPort"]))
+    msg = message.MessageBuffer()
+    datagrams = []
+    for i in xrange(4):
+        msg.begin_export(8304)
+        if i == 0:
+            msg.add_template(mktest_template())
+            msg.add_template(fixtmpl)
+        msg.export_ensure_set(257)
+        for seq in xrange(i * 8, i * 8 + 8):
+            msg.export_namedict(mktest_record(seq))
+        msg.export_new_set(258)
+        for seq in xrange(i * 3):
+            msg.export_tuple((ip_address("10.0.0.1"), seq))
+        datagrams.append(msg.to_bytes())
+
+    async def run(ielist):
+        c = collector.for_udp(_discard_records, host="127.0.0.1", port=0,
+                              ielist=ie.spec_list(ielist))
+        await c.start()
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for data in datagrams:
+            s.sendto(data, c.addresses()[0])
+        while c.stats()["messages"] < len(datagrams):
+            await asyncio.sleep(0.01)
+        s.close()
+        return c
+
+    for ielist in (["testString"], ["destinationTransportPort"]):
+        c = asyncio.run(run(ielist))
+        c.close()
+        assert(c.sock is None)
+        stats = c.stats()
+        assert(stats["sequence_errors"] == 0)
+        assert(stats["unknown_sets"] == 0)
+
+def test_collector_session_withdrawal():
+    # withdrawn templates are removed, so later data sets for them are
+    # unknown, and templates without fields are never used to decode
+    from . import collector
+
+    data = mktest_fixlen_message(rec_count=4, tid=257).to_bytes()
+    msg = message.MessageBuffer()
+    msg.from_bytes(data)
+    (offset, setid, setlen) = msg.setlist[-1]
+    dataset = data[offset:offset + setlen]
+    orphan = struct.pack("!HHLLL", 10, 16 + len(dataset), 0, 4, 8304) + \
+             dataset
+    msg.begin_export(8304)
+    msg._export_template_withdrawal(template.TEMPLATE_SET_ID, 257)
+    withdrawal = msg.to_bytes()
+
+    session = collector.CollectorSession(None)
+    assert(len(session.feed(data)) == 4)
+    assert(session.feed(withdrawal + orphan) == [])
+    assert(session.templates == {})
+    assert(session.unknown_sets == 1)
+
+    session.parser.msg.set_templates({(8304, 257): template.from_ielist(257,
+                                                                        [])})
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        assert(session.feed(orphan) == [])
+    assert(len(w) == 1)
+
+def test_collector_session_sequence():
+    # gaps ahead of the expected sequence number are lost records; late
+    # messages behind it are reordered, and don't move it back
+    from . import collector
+
+    data = mktest_fixlen_message(rec_count=4, tid=257).to_bytes()
+
+    def with_sequence(seq):
+        return data[:8] + struct.pack("!L", seq % 2**32) + data[12:]
+
+    session = collector.CollectorSession(None)
+    for (seq, errors, lost, reordered) in ((0, 0, 0, 0), (8, 1, 4, 0),
+                                           (4, 1, 4, 1), (12, 1, 4, 1),
+                                           (-4, 1, 4, 2), (16, 1, 4, 2)):
+        assert(len(session.feed(with_sequence(seq))) == 4)
+        assert(session.sequence_errors == errors)
+        assert(session.lost_records == lost)
+        assert(session.reordered_messages == reordered)
+    assert(session.next_sequence == {8304: 20})
+
+def test_udp_collector_malformed():
+    # a malformed datagram is counted, and doesn't stop the collector
+    import asyncio
+    import socket
+    from . import collector
+
+    # a template claiming five fields, carrying one; a set of length zero
+    body = struct.pack("!HHHHHH", 2, 12, 256, 5, 8, 4)
+    bad = [struct.pack("!HHLLL", 10, 16 + len(body), 0, 0, 8304) + body,
+           struct.pack("!HHLLLHH", 10, 24, 0, 0, 8304, 257, 0) + b"\0" * 4]
+    good = mktest_fixlen_message(rec_count=16, tid=257).to_bytes()
+    received = []
+
+    def sink(session, recs):
+        received.extend(recs)
+
+    async def run():
+        c = collector.for_udp(sink, host="127.0.0.1", port=0)
+        await c.start()
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for data in bad + [good]:
+            s.sendto(data, c.addresses()[0])
+        while c.stats()["datagrams"] < 3 and not c.task.done():
+            await asyncio.sleep(0.01)
+        s.close()
+        c.close()
+        await c.wait_closed()
+        return c.stats()
+
+    stats = asyncio.run(run())
+    assert(stats["decode_errors"] == 2)
+    assert(stats["records"] == 16)
+    assert(len(received) == 16)
+
+def _discard_records(session, recs):
+    pass
+
+def test_udp_collector_pool():
+    # exporters are spread over workers, which report stats
+    import socket
+    import time
+    from . import collector
+
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise unittest.SkipTest("SO_REUSEPORT not available")
+
+    f = io.BytesIO()
+    mktest_file(f, msg_count=2)
+    data = f.getvalue()
+    length = message._msghdr_st.unpack_from(data, 0)[1]
+
+    pool = collector.for_udp_pool(_discard_records, host="127.0.0.1", port=0,
+                                  workers=2, stats_interval=0.05)
+    pool.start()
+    try:
+        # a worker which exits is restarted
+        pool.workers[0].terminate()
+        pool.workers[0].join()
+        pool._restart_workers()
+        deadline = time.monotonic() + 10
+        while 0 not in pool.worker_stats and time.monotonic() < deadline:
+            pool._update_stats(0.05)
+        assert(pool.workers[0].is_alive())
+
+        socks = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                 for i in xrange(8)]
+        for s in socks:
+            s.sendto(data[:length], ("127.0.0.1", pool.port))
+            s.sendto(data[length:], ("127.0.0.1", pool.port))
+        deadline = time.monotonic() + 10
+        while pool.stats().get("records", 0) < 8 * 32 and \
+              time.monotonic() < deadline:
+            time.sleep(0.05)
+        for s in socks:
+            s.close()
+    finally:
+        pool.close()
+
+    stats = pool.stats()
+    assert(stats["workers"] == 2)
+    assert(stats["restarts"] == 1)
+    assert(stats["records"] == 8 * 32)
+    assert(stats["active"] == 8)
+    assert(stats["unknown_sets"] == 0)
+
+def test_archive_withdrawal():
+    # withdrawn templates and options templates are not checkpointed
+    ie.use_iana_default()
+    otmpl = template.from_ielist(258, ie.spec_list(["exportingProcessId",
+                                                    "packetDeltaCount"]))
+    otmpl.scopecount = 1
+    f = io.BytesIO()
+    with archive.to_stream(f, block_size=1) as w:
+        msg = message.MessageBuffer()
+        msg.begin_export(8304)
+        msg.add_template(mktest_template())
+        msg.add_template(otmpl)
+        msg.write_message(w)
+        for (setid, tid) in ((template.OPTIONS_SET_ID, 258),
+                             (template.TEMPLATE_SET_ID, 257)):
+            msg.begin_export(8304)
+            msg._export_template_withdrawal(setid, tid)
+            msg.write_message(w)
+
+    with archive.from_stream(f) as r:
+        assert([sorted(tid for (odid, tid) in templates)
+                for (templates, data) in r.block_iterator()] ==
+               [[], [257, 258], [257]])
+    assert(r.executor is None)
+
+def test_archive_epochs():
+    # a block's export time range covers messages exported out of order
+    times = [datetime(2013, 6, 21, 14, 0, 10), datetime(2013, 6, 21, 14),
+             datetime(2013, 6, 21, 14, 0, 20), datetime(2013, 6, 21, 14, 0, 5)]
+    f = io.BytesIO()
+    with archive.to_stream(f) as w:
+        msg = message.MessageBuffer()
+        for dt in times:
+            msg.begin_export(8304)
+            msg.set_export_time(dt)
+            msg.add_template(mktest_template())
+            msg.write_message(w)
+
+    with archive.from_stream(f) as r:
+        assert(len(r.blocks) == 1)
+        assert(r.blocks[0].first_epoch == types._encode_sec(min(times)))
+        assert(r.blocks[0].last_epoch == types._encode_sec(max(times)))
+        assert(r.blocks_between(datetime(2013, 6, 21, 14),
+                                datetime(2013, 6, 21, 14, 0, 1)) == [0])
+
+def test_archive():
+    # all codecs round-trip; blocks decode on their own, with templates
+    # replayed from their checkpoints
+    ielist = ie.spec_list(["packetDeltaCount"])
+    expected = [(mktest_record(seq)["packetDeltaCount"],)
+                for seq in xrange(64 * 16)]
+    codecs = ["zlib", "bz2"]
+    if archive.lzma is not None:
+        codecs.append("lzma")
+    for codec in codecs:
+        f = io.BytesIO()
+        with archive.to_stream(f, codec=codec, block_size=4096) as w:
+            mktest_file(w, msg_count=64)
+        with archive.from_stream(f) as r:
+            assert(r.codec == codec)
+            assert(len(r.blocks) > 4)
+            assert(sum(b.msgcount for b in r.blocks) == 64)
+            assert(list(r.tuple_iterator(ielist)) == expected)
+
+            # a block from the middle of the archive decodes alone
+            last = r.blocks_between(datetime(2009, 2, 20, 19, 19, 20))
+            assert(last == [len(r.blocks) - 1])
+            first = r.blocks[last[0]].first_epoch - r.blocks[0].first_epoch
+            assert(list(r.tuple_iterator(ielist,
+                        start=datetime(2009, 2, 20, 19, 19, 20))) ==
+                   expected[first * 16:])
+
+    # blocks_between selects blocks overlapping a time range
+    with archive.from_stream(f) as r:
+        assert(r.blocks_between() == list(xrange(len(r.blocks))))
+        assert(r.blocks_between(datetime(2009, 2, 20, 19, 18, 17),
+                                datetime(2009, 2, 20, 19, 18, 18)) == [0])
+        assert(r.blocks_between(end=datetime(2009, 2, 20, 19, 18, 17)) == [])
+        assert(r.blocks_between(datetime(2009, 2, 20, 19, 20)) == [])
+        (lo, hi) = (datetime(2009, 2, 20, 19, 18, 40),
+                    datetime(2009, 2, 20, 19, 18, 50))
+        selected = r.blocks_between(lo, hi)
+        assert(len(selected) > 1)
+        for (i, b) in enumerate(r.blocks):
+            assert((i in selected) ==
+                   (b.first_epoch < types._encode_sec(hi) and
+                    b.last_epoch >= types._encode_sec(lo)))
+
+    # an archive whose writer was not closed is scanned, dropping a
+    # truncated last block
+    f = io.BytesIO()
+    w = archive.to_stream(f, block_size=4096)
+    mktest_file(w, msg_count=64)
+    w.flush()
+    w.executor.shutdown()
+    complete = f.getvalue()
+    for data in (complete, complete + complete[8:40]):
+        with archive.from_stream(io.BytesIO(data)) as r:
+            assert(len(r.blocks) == len(w.blocks))
+            assert(list(r.tuple_iterator(ielist)) == expected)
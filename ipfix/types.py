@@ -55,7 +55,6 @@ IPFIX representation of each type. Type methods operate on buffers, as used
 internally by the :class:`ipfix.message.MessageBuffer` class, so we'll create
 one to illustrate encoding and decoding:
 
->>> from __future__ import unicode_literals
 >>> import ipfix.compat
 >>> import ipfix.types
 >>> buf = ipfix.compat.get_buffer(16)
@@ -148,9 +147,30 @@ dateTimeNanoseconds is also supported, but is identical to
 dateTimeMicroseconds, as the datetime class in Python only supports
 microsecond-level timing.
 
+These representations can be changed for a single reader with a
+:class:`DecodePolicy`, e.g. to decode addresses and timestamps as plain
+integers, which are much cheaper to create:
+
+>>> policy = ipfix.types.DecodePolicy(ipv4="int", timestamps="ms")
+>>> policy
+DecodePolicy(ipv4='int', timestamps='ms')
+>>> length = ipv4Address.encode_single_value_to(ip_address("198.51.100.27"), buf, 0)
+>>> ipv4Address.decode_single_value_from(buf, 0, length, policy)
+3325256731
+>>> length = dateTimeMilliseconds.encode_single_value_to(dt, buf, 0)
+>>> dateTimeMilliseconds.decode_single_value_from(buf, 0, length, policy)
+1371823203456
+
+Integer timestamps avoid creating datetime objects altogether, and with
+nanosecond resolution, make dateTimeNanoseconds values exact:
+
+>>> policy = ipfix.types.DecodePolicy(timestamps="ns")
+>>> dateTimeNanoseconds = ipfix.types.for_name("dateTimeNanoseconds")
+>>> length = dateTimeNanoseconds.encode_single_value_to(1371823203456789123, buf, 0, policy)
+>>> dateTimeNanoseconds.decode_single_value_from(buf, 0, length, policy)
+1371823203456789123
+
 """
-from __future__ import unicode_literals
-from __future__ import division
 from datetime import datetime, timedelta
 from functools import total_ordering
 from ipaddress import ip_address
@@ -158,6 +178,8 @@ import binascii
 import struct
 import math
 
+from . import compat
+
 VARLEN = 65535
 
 ISO8601_FMT = "%Y-%m-%d %H:%M:%S"
@@ -198,6 +220,9 @@ def _identity(x):
 class IpfixType(object):
     # Builtin type implementation
     """Abstract interface for all IPFIX types. Used internally. """
+    __slots__ = ("name", "num", "valenc", "valdec", "valstr", "valparse",
+                 "roottype", "length")
+
     def __init__(self, name, num, valenc, valdec, valstr, valparse, roottype=None):
         self.name = name
         self.num = num
@@ -226,6 +251,8 @@ class IpfixType(object):
 
 class StructType(IpfixType):
     """Type encoded by struct packing. Used internally."""
+    __slots__ = ("stel", "st", "skipel", "policy_st")
+
     def __init__(self, name, num, stel, valenc=_identity, valdec=_identity, valstr=str, valparse=int, roottype=None):
         super(self.__class__, self).__init__(name, num, valenc, valdec, valstr, valparse, roottype)
         self.stel = stel
@@ -233,32 +260,58 @@ class StructType(IpfixType):
         self.length = self.st.size
         self.skipel = str(self.length)+"x"
 
+        # structs for the struct elements chosen by decode policies
+        self.policy_st = {stel: self.st}
+
+    def _policy_struct(self, stel):
+        try:
+            return self.policy_st[stel]
+        except KeyError:
+            return self.policy_st.setdefault(stel, struct.Struct("!"+stel))
+
     def for_length(self, length):
         if not length or length == self.length:
             return self
-        elif self.roottype is _roottypes[0]:
+
+        try:
+            return _typeForLength[(self.num, length)]
+        except KeyError:
+            pass
+
+        root = self.roottype
+        if isinstance(root, OctetArrayType):
             # FIXME this is kind of a hack to allow any-length encoding of octet arrays
-            return StructType(self.name, self.num, str(length)+"s",
-                              self.valenc, self.valdec, self.roottype)
+            stel = str(length)+"s"
         else:
             try:
-                return StructType(self.name, self.num,
-                                  _stel_rle[(self.stel, length)],
-                                  self.valenc, self.valdec, self.roottype)
+                stel = _stel_rle[(root.stel, length)]
             except KeyError:
                 raise IpfixTypeError("No RLE for <%s>[%u]" %
                                      (self.name, length))
 
-    def encode_single_value_to(self, val, buf, offset):
+        return _intern_type(StructType(self.name, self.num, stel,
+                                       root.valenc, root.valdec, root.valstr,
+                                       root.valparse, root))
+
+    def encode_single_value_to(self, val, buf, offset, policy=None):
+        if policy:
+            (stel, valenc) = policy.encoder_for(self)
+            self._policy_struct(stel).pack_into(buf, offset, valenc(val))
+            return offset + self.length
         self.st.pack_into(buf, offset, self.valenc(val))
         return offset + self.length
 
-    def decode_single_value_from(self, buf, offset, length):
+    def decode_single_value_from(self, buf, offset, length, policy=None):
         assert(self.length == length)
+        if policy:
+            (stel, valdec) = policy.field_for(self)
+            return valdec(self._policy_struct(stel).unpack_from(buf, offset)[0])
         return self.valdec(self.st.unpack_from(buf, offset)[0])
 
 class OctetArrayType(IpfixType):
     """Type encoded by byte array packing. Used internally."""
+    __slots__ = ()
+
     def __init__(self, name, num, valenc=_identity, valdec=_identity, valstr=binascii.hexlify, valparse=binascii.unhexlify, roottype=None):
         super(self.__class__, self).__init__(name, num, valenc, valdec, valstr, valparse, roottype)
         self.length = VARLEN
@@ -266,16 +319,29 @@ class OctetArrayType(IpfixType):
     def for_length(self, length):
         if not length or length == self.length:
             return self
-        else:
-            return StructType(self.name, self.num, str(length)+"s",
-                              self.valenc, self.valdec, self.roottype)
 
-    def encode_single_value_to(self, val, buf, offset):
-        enc = self.valenc(val)
+        try:
+            return _typeForLength[(self.num, length)]
+        except KeyError:
+            return _intern_type(StructType(self.name, self.num,
+                                           str(length)+"s", self.valenc,
+                                           self.valdec, self.valstr,
+                                           self.valparse, self))
+
+    def encode_single_value_to(self, val, buf, offset, policy=None):
+        if policy:
+            enc = policy.encoder_for(self)[1](val)
+        else:
+            enc = self.valenc(val)
         buf[offset:offset+len(enc)] = enc
         return offset + len(enc)
 
-    def decode_single_value_from(self, buf, offset, length):
+    def decode_single_value_from(self, buf, offset, length, policy=None):
+        if policy:
+            valdec = policy.field_for(self)[1]
+            if valdec is _decode_buffer:
+                return buf[offset:offset+length]
+            return valdec(buf[offset:offset+length].tobytes())
         return self.valdec(buf[offset:offset+length].tobytes())
 
 # Utility calls for buildin encoders/decoders
@@ -400,16 +466,247 @@ _roottypes = [
 
 _TypeForName = dict((ietype.name, ietype) for ietype in _roottypes)
 
+# Interned fixed-length variants of types, by (num, length)
+_typeForLength = {}
+
+def _intern_type(ietype):
+    _typeForLength[(ietype.num, ietype.length)] = ietype
+    return ietype
+
+# Generation of the information model and type representations, changed
+# whenever an IE or a type is replaced; caches of objects
+# built from the information model (e.g. decoded templates) are keyed on it.
+_infomodel_generation = 0
+
+def _infomodel_changed():
+    global _infomodel_generation
+    _infomodel_generation += 1
+
+# Encoders/decoders for alternate representations, used by DecodePolicy
+
+def _decode_buffer(buf):
+    # marker: use a slice of the message buffer for a varlen value, without
+    # copying it. Fixed-length values are passed as bytes.
+    return buf
+
+if hasattr(int, "from_bytes"):
+    def _decode_octets_int(octets):
+        return int.from_bytes(octets, "big")
+
+    def _encode_ipv6_int(val):
+        return val.to_bytes(16, "big")
+
+    def _encode_mac_int(val):
+        return val.to_bytes(6, "big")
+else:
+    def _decode_octets_int(octets):
+        return int(binascii.hexlify(octets), 16)
+
+    def _encode_ipv6_int(val):
+        return binascii.unhexlify("%032x" % val)
+
+    def _encode_mac_int(val):
+        return binascii.unhexlify("%012x" % val)
+
+def _decode_sec_ms(epoch):
+    return epoch * 1000
+
+def _decode_sec_ns(epoch):
+    return epoch * 1000000000
+
+def _decode_msec_ns(epoch):
+    return epoch * 1000000
+
+def _decode_ntp_ms(ntp):
+    return (((ntp >> 32) - NTP_EPOCH_TO_UNIX_EPOCH) * 1000 +
+            (((ntp & 0xffffffff) * 1000) >> 32))
+
+def _decode_ntp_ns(ntp):
+    return (((ntp >> 32) - NTP_EPOCH_TO_UNIX_EPOCH) * 1000000000 +
+            (((ntp & 0xffffffff) * 1000000000) >> 32))
+
+def _encode_ms_sec(ms):
+    return ms // 1000
+
+def _encode_ns_sec(ns):
+    return ns // 1000000000
+
+def _encode_ns_msec(ns):
+    return ns // 1000000
+
+def _encode_ms_ntp(ms):
+    (sec, frac) = divmod(ms, 1000)
+    return (((sec + NTP_EPOCH_TO_UNIX_EPOCH) << 32) +
+            -((-frac << 32) // 1000))
+
+def _encode_ns_ntp(ns):
+    # round the fraction up, so that _decode_ntp_ns is exact
+    (sec, frac) = divmod(ns, 1000000000)
+    return (((sec + NTP_EPOCH_TO_UNIX_EPOCH) << 32) +
+            -((-frac << 32) // 1000000000))
+
+# datetime64 conversions; NumPy is imported on first use
+
+def _decode_sec_dt64(epoch):
+    return compat.get_numpy().datetime64(epoch, "s")
+
+def _decode_msec_dt64(epoch):
+    return compat.get_numpy().datetime64(epoch, "ms")
+
+def _decode_ntp_dt64(ntp):
+    return compat.get_numpy().datetime64(_decode_ntp_ns(ntp), "ns")
+
+def _dt64_ns(dt64):
+    numpy = compat.get_numpy()
+    return int(numpy.datetime64(dt64, "ns").astype(numpy.int64))
+
+def _encode_dt64_sec(dt64):
+    return _encode_ns_sec(_dt64_ns(dt64))
+
+def _encode_dt64_msec(dt64):
+    return _encode_ns_msec(_dt64_ns(dt64))
+
+def _encode_dt64_ntp(dt64):
+    return _encode_ns_ntp(_dt64_ns(dt64))
+
+_dt64_fields = {14: (None, _decode_sec_dt64, _encode_dt64_sec),
+                15: (None, _decode_msec_dt64, _encode_dt64_msec),
+                16: (None, _decode_ntp_dt64, _encode_dt64_ntp),
+                17: (None, _decode_ntp_dt64, _encode_dt64_ntp)}
+
+# (struct element or None to keep, decoder, encoder) per type number
+# for each policy option and value
+_policy_fields = {
+    "ipv4":       { "ipaddress": {18: (None, ip_address, _encode_ip)},
+                    "int":       {18: ("L", _identity, _identity)},
+                    "bytes":     {18: (None, _identity, _identity)} },
+    "ipv6":       { "ipaddress": {19: (None, ip_address, _encode_ip)},
+                    "int":       {19: (None, _decode_octets_int,
+                                       _encode_ipv6_int)},
+                    "bytes":     {19: (None, _identity, _identity)} },
+    "mac":        { "bytes":     {12: (None, _identity, _identity)},
+                    "int":       {12: (None, _decode_octets_int,
+                                       _encode_mac_int)} },
+    "timestamps": { "datetime":  {14: (None, _decode_sec, _encode_sec),
+                                  15: (None, _decode_msec, _encode_msec),
+                                  16: (None, _decode_ntp, _encode_ntp),
+                                  17: (None, _decode_ntp, _encode_ntp)},
+                    "ms":        {14: (None, _decode_sec_ms, _encode_ms_sec),
+                                  15: (None, _identity, _identity),
+                                  16: (None, _decode_ntp_ms, _encode_ms_ntp),
+                                  17: (None, _decode_ntp_ms, _encode_ms_ntp)},
+                    "ns":        {14: (None, _decode_sec_ns, _encode_ns_sec),
+                                  15: (None, _decode_msec_ns, _encode_ns_msec),
+                                  16: (None, _decode_ntp_ns, _encode_ns_ntp),
+                                  17: (None, _decode_ntp_ns, _encode_ns_ntp)},
+                    "datetime64": _dt64_fields },
+    "strings":    { "str":       {13: (None, _decode_utf8, _encode_utf8)},
+                    "bytes":     {13: (None, _identity, _identity)},
+                    "memoryview": {13: (None, _decode_buffer, _identity)} },
+    "octets":     { "bytes":     {0: (None, _identity, _identity)},
+                    "memoryview": {0: (None, _decode_buffer, _identity)} } }
+
+class DecodePolicy(object):
+    """
+    Selects the Python representation of values for each IPFIX abstract
+    data type. Pass an instance as the policy argument of
+    :class:`ipfix.message.MessageBuffer`,
+    :class:`ipfix.reader.MessageStreamReader` or
+    :class:`ipfix.v9pdu.PduBuffer`; templates read by that buffer compile
+    their decoders against the policy, so readers with different policies
+    can be used in the same process. A policy can also be given to
+    :func:`ipfix.template.from_ielist`, in which case records exported with
+    the template are encoded from values in the policy's representation.
+
+    Each keyword argument selects a representation for some types:
+
+    - ipv4: "ipaddress" (default), "int", or "bytes"
+    - ipv6: "ipaddress" (default), "int", or "bytes" (16 bytes)
+    - mac: "bytes" (default) or "int"
+    - timestamps: "datetime" (default); "ms" or "ns" for integer
+      milliseconds or nanoseconds since the Unix epoch; or "datetime64" for
+      numpy.datetime64 (requires NumPy), for all dateTime types. Integer
+      nanoseconds preserve the full precision of dateTimeNanoseconds.
+    - strings: "str" (default), "bytes" (UTF-8 encoded), or "memoryview"
+    - octets: "bytes" (default) or "memoryview"
+
+    Variable-length values decoded as "memoryview" refer directly to the
+    message buffer, and are only valid until the next message is read.
+
+    """
+    def __init__(self, **options):
+        self.options = {}
+        self.fields = {}
+        for option in sorted(options):
+            try:
+                fields = _policy_fields[option][options[option]]
+            except KeyError:
+                raise ValueError("bad decode policy option %s=%s" %
+                                 (option, repr(options[option])))
+            if fields is _dt64_fields and compat.get_numpy() is None:
+                raise ValueError("decode policy option %s=%s requires numpy" %
+                                 (option, repr(options[option])))
+            self.options[option] = options[option]
+            self.fields.update(fields)
+
+    def __repr__(self):
+        return "DecodePolicy(%s)" % ", ".join("%s=%s" %
+                            (k, repr(str(v))) for k, v in
+                            sorted(self.options.items()))
+
+    def field_for(self, ietype):
+        """
+        Return the struct element and value decoder to use for a type under
+        this policy.
+
+        :param ietype: type of an Information Element
+        :returns: a tuple of (struct element or None for variable-length
+                  types, value decoder)
+
+        """
+        stel = getattr(ietype, "stel", None)
+        if ietype.num in self.fields:
+            (pstel, valdec, valenc) = self.fields[ietype.num]
+            if pstel and stel:
+                stel = pstel
+            if valdec is _decode_buffer and stel:
+                valdec = _identity
+            return (stel, valdec)
+        else:
+            return (stel, ietype.valdec)
+
+    def encoder_for(self, ietype):
+        """
+        Return the struct element and value encoder to use for a type under
+        this policy.
+
+        :param ietype: type of an Information Element
+        :returns: a tuple of (struct element or None for variable-length
+                  types, value encoder)
+
+        """
+        stel = getattr(ietype, "stel", None)
+        if ietype.num in self.fields:
+            (pstel, valdec, valenc) = self.fields[ietype.num]
+            if pstel and stel:
+                stel = pstel
+            return (stel, valenc)
+        else:
+            return (stel, ietype.valenc)
+
 def use_integer_ipv4():
     """
     Use integers instead of ipaddress.IPv4Address to store IPv4 addresses.
     Changes behavior globally; should be called before using any IPFIX types.
     Designed for use with numpy arrays, to not require a Python object for
-    storing IP addresses.
+    storing IP addresses. To change the representation of IPv4 addresses for
+    a single reader, use a :class:`DecodePolicy` instead.
     """
     _roottypes[18] = StructType("ipv4address", 18, "L")
     global _TypeForName
     _TypeForName = dict((ietype.name, ietype) for ietype in _roottypes)
+    _typeForLength.clear()
+    _infomodel_changed()
 
 def for_name(name):
     """
@@ -24,7 +24,6 @@ Units (PDUs) from a stream.
 
 """
 
-from __future__ import division
 from . import template, types, ie, compat
 from .template import IpfixEncodeError, IpfixDecodeError
 from .message import accept_all_templates
@@ -44,11 +43,13 @@ class PduBuffer(object):
     Implements a buffer for reading NetFlow V9 PDUs from a stream or packet.
 
     Abstract class; use the :meth:`from_stream` to get an instance for
-    reading from a stream instead.
+    reading from a stream instead. Records are decoded according to the
+    given :class:`ipfix.types.DecodePolicy`, if any.
     """
-    def __init__(self, mbuf):
+    def __init__(self, mbuf, policy=None):
         """Create a new PduBuffer instance."""
         self.mbuf = mbuf
+        self.policy = policy
 
         self.length = 0
         self.cur = 0
@@ -139,7 +140,8 @@ class PduBuffer(object):
                setid == template.V9_OPTIONS_SET_ID:
                 while offset < setend:
                     (tmpl, offset) = template.decode_template_from(
-                                              mbuf, offset, setid)
+                                              mbuf, offset, setid,
+                                              self.policy)
                     # FIXME handle withdrawal
                     self.templates[(self.sesid, self.odid, tmpl.tid)] = tmpl
                     if tmplaccept_fn(tmpl):
@@ -216,8 +218,7 @@ class PduBuffer(object):
         """
 
         tmplaccept_fn = lambda tmpl: \
-                reduce(operator.__and__,
-                                 (ie in tmpl.ies for ie in ielist))
+                all(ie in tmpl.ies for ie in ielist)
 
         if ((not self.last_tuple_iterator_ielist) or
             (ielist is not self.last_tuple_iterator_ielist)):
@@ -240,8 +241,8 @@ class PduBuffer(object):
 
 class StreamPduBuffer(PduBuffer):
     """Create a new StreamPduBuffer instance."""
-    def __init__(self, stream, buf_sz=65536):
-        super().__init__(mbuf=compat.get_buffer(buf_sz))
+    def __init__(self, stream, buf_sz=65536, policy=None):
+        super().__init__(mbuf=compat.get_buffer(buf_sz), policy=policy)
         
         self.stream = stream
 
@@ -295,8 +296,8 @@ class StreamPduBuffer(PduBuffer):
 
 class SinglePduBuffer(PduBuffer):
     """Create a new SinglePduBuffer instance."""
-    def __init__(self, bytes_in):
-        super().__init__(mbuf=memoryview(bytes_in))
+    def __init__(self, bytes_in, policy=None):
+        super().__init__(mbuf=memoryview(bytes_in), policy=policy)
         self._parse_pdu_header()
         self._next_set_ptr = _pduhdr_st.size
 
@@ -306,15 +307,17 @@ class SinglePduBuffer(PduBuffer):
         self._next_set_ptr += setlen
         return (self.mbuf, setloc, setid, setlen)
 
-def from_stream(stream, buf_sz=65536):
+def from_stream(stream, buf_sz=65536, policy=None):
     """
     Get a StreamPduBuffer for a given stream
 
     :param stream: stream to read
+    :param policy: :class:`ipfix.types.DecodePolicy` for decoding records,
+                   or None for the default representations
     :return: a :class:`PduBuffer` wrapped around the stream.
 
     """
-    return StreamPduBuffer(stream, buf_sz=buf_sz)
+    return StreamPduBuffer(stream, buf_sz=buf_sz, policy=policy)
 
 class TimeAdapter(object):
     """
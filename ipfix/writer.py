@@ -18,7 +18,22 @@
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from . import message
+from . import message, compat
+from .template import IpfixEncodeError
+
+import io
+import itertools
+import os
+import socket
+import time
+
+# maximum number of buffers in one vectored write
+try:
+    _iov_max = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    _iov_max = 1024
+if _iov_max <= 0:
+    _iov_max = 1024
 
 class MessageStreamWriter(object):
     """
@@ -31,23 +46,107 @@ class MessageStreamWriter(object):
     
     Suitable for writing to IPFIX files (see :rfc:`5655`) as well as to TCP 
     sockets. When writing a stream to a file, use mode='wb'.
+
+    Messages are written directly from the message buffer, without copying.
+    If coalesce_bytes is given, finished messages are instead kept in a
+    pool of message buffers, and written together with a single vectored
+    write (os.writev on raw files opened with buffering=0, sendmsg on
+    sockets) once at least coalesce_bytes are pending, or once the oldest
+    pending message is older than coalesce_delay seconds. Other streams,
+    including buffered and compressed files, get one write per message.
+    Pending messages are only written as new messages are finished, so
+    call :meth:`flush` to bound latency when no more records are coming.
     
-    ..warning: This class is not yet suitable for UDP export; this is an open
-               issue to be fixed in a subsequent release.
+    ..warning: This class is not suitable for UDP export, as it does not
+               refresh templates; use :class:`ipfix.exporter.UdpExporter`.
     
     """
-    def __init__(self, stream, mtu=65535):
+    def __init__(self, stream, mtu=65535, coalesce_bytes=0,
+                 coalesce_delay=None):
         self.stream = stream
         self.msg = message.MessageBuffer()    
         self.msg.mtu = mtu
         self.msgcount = 0
-        
+
+        self.coalesce_bytes = coalesce_bytes
+        self.coalesce_delay = coalesce_delay
+        self.pending = []
+        self.pendingbufs = []
+        self.pending_bytes = 0
+        self.pending_since = None
+        self.freebufs = []
+        self.writecount = 0
+        self._writev = _vector_write_fn(stream)
+        if isinstance(stream, socket.socket):
+            self._write = stream.sendall
+        else:
+            self._write = stream.write
+
     def _retry_after_flush(self, fn, *args, **kwargs):
         try:
             return fn(*args, **kwargs)
         except message.EndOfMessage:
-            self.flush()
+            self._next_message()
             return fn(*args, **kwargs)
+
+    def _finish_message(self):
+        # Write the current message, or queue it for a coalesced write,
+        # and start a new message in a fresh buffer.
+        if not self.coalesce_bytes:
+            self._write(self.msg.to_view())
+            self.writecount += 1
+        else:
+            self._queue_message()
+            if self.pending_bytes >= self.coalesce_bytes or \
+               (self.coalesce_delay is not None and
+                time.monotonic() - self.pending_since >= self.coalesce_delay):
+                self._write_pending()
+        self.msgcount += 1
+
+    def _queue_message(self):
+        # Keep the current message in its buffer until it is written, and
+        # continue in a buffer from the pool
+        view = self.msg.to_view()
+        self.pending.append(view)
+        self.pendingbufs.append(self.msg.ownbuf)
+        self.pending_bytes += len(view)
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        if self.freebufs:
+            self.msg.ownbuf = self.freebufs.pop()
+        else:
+            # pooled buffers only need to hold a message
+            self.msg.ownbuf = compat.get_buffer(
+                    bytearray(min(self.msg.mtu, len(self.msg.ownbuf))))
+
+    def _write_pending(self):
+        # Write all pending messages, and return their buffers to the pool
+        if not self.pending:
+            return
+        if self._writev is None:
+            for view in self.pending:
+                self._write(view)
+                self.writecount += 1
+        else:
+            views = self.pending
+            while views:
+                sent = self._writev(views[:_iov_max])
+                self.writecount += 1
+                # skip written views; keep the rest of a partial write
+                while views and sent >= len(views[0]):
+                    sent -= len(views[0])
+                    views = views[1:]
+                if sent:
+                    views = [views[0][sent:]] + views[1:]
+        self._release_pending()
+
+    def _release_pending(self):
+        # Return the buffers of written messages to the pool
+        self.freebufs.extend(self.pendingbufs)
+        self.pending = []
+        self.pendingbufs = []
+        self.pending_bytes = 0
+        self.pending_since = None
     
     def set_domain(self, odid):
         """
@@ -61,7 +160,7 @@ class MessageStreamWriter(object):
 
         """
         if self.msg.export_needs_flush():
-            self.msg.write_message(self.stream)
+            self._finish_message()
         self.msg.begin_export(odid)
 
     def add_template(self, tmpl):
@@ -77,7 +176,8 @@ class MessageStreamWriter(object):
     def set_export_template(self, tid):
         """
         Set the template to be used for export by subsequent calls to
-        :meth:`export_namedict` and :meth:`export_tuple`.
+        :meth:`export_namedict`, :meth:`export_tuple`, and the bulk export
+        methods such as :meth:`export_tuples`.
 
         :param tid: Template ID of the Template that will be used to encode 
                     records to the Writer. The corresponding Template must 
@@ -108,10 +208,131 @@ class MessageStreamWriter(object):
                                 self.msg, self.curtid)
         self._retry_after_flush(message.MessageBuffer.export_tuple, 
                                 self.msg, rec)
+
+    def export_object(self, rec):
+        """
+        Export a record to the message, using the current template.
+        The record is an object with an attribute named for each IE in
+        the template, e.g. a namedtuple.
+
+        :param rec: the record to export, as an object
+
+        """
+        self._retry_after_flush(message.MessageBuffer.export_ensure_set,
+                                self.msg, self.curtid)
+        self._retry_after_flush(message.MessageBuffer.export_object,
+                                self.msg, rec)
     
+    def _export_many(self, recs, export_fn):
+        # Export a list of records, flushing whenever the message is full
+        self._retry_after_flush(message.MessageBuffer.export_ensure_set,
+                                self.msg, self.curtid)
+        start = 0
+        flushed = False
+        while start < len(recs):
+            end = export_fn(self.msg, recs, start)
+            if end == start:
+                if flushed:
+                    # doesn't fit into an empty message
+                    raise message.EndOfMessage()
+                self._next_message()
+                flushed = True
+            else:
+                flushed = False
+            start = end
+
+    def _export_iterable(self, recs, export_fn):
+        if isinstance(recs, (list, tuple)):
+            self._export_many(recs, export_fn)
+        else:
+            recs = iter(recs)
+            while True:
+                chunk = list(itertools.islice(recs, 4096))
+                if not chunk:
+                    break
+                self._export_many(chunk, export_fn)
+
+    def export_tuples(self, recs):
+        """
+        Export many records using the current template, packing as many
+        into each message as fit. Each record is a tuple of values in
+        template order.
+
+        :param recs: an iterable of records, as tuples
+
+        """
+        self._export_iterable(recs, message.MessageBuffer.export_tuples)
+
+    def export_namedicts(self, recs):
+        """
+        Export many records using the current template, packing as many
+        into each message as fit. Each record is a dictionary mapping IE
+        names to values.
+
+        :param recs: an iterable of records, as dictionaries
+
+        """
+        self._export_iterable(recs, message.MessageBuffer.export_namedicts)
+
+    def export_objects(self, recs):
+        """
+        Export many records using the current template, packing as many
+        into each message as fit. Each record is an object with an
+        attribute named for each IE in the template.
+
+        :param recs: an iterable of records, as objects
+
+        """
+        self._export_iterable(recs, message.MessageBuffer.export_objects)
+
+    def export_array(self, arr):
+        """
+        Export many records using the current template, which must not
+        contain variable-length IEs, from a NumPy structured array; see
+        :meth:`ipfix.message.MessageBuffer.export_array`. The array is
+        converted to the template's wire layout once, then copied into
+        each message in runs of records.
+
+        :param arr: the records to export, as a structured array
+        :raises: IpfixEncodeError
+
+        """
+        self._export_wire(arr, len(arr))
+
+    def export_columns(self, columns):
+        """
+        Export many records using the current template, which must not
+        contain variable-length IEs, from columns of values: a dict mapping
+        the name of each IE in the template to a NumPy array (or sequence)
+        of values, in the representation used by
+        :meth:`ipfix.message.MessageBuffer.export_array`.
+
+        :param columns: dict of IE name to array of values; all arrays must
+                        have the same length.
+        :raises: IpfixEncodeError
+
+        """
+        counts = set(len(col) for col in columns.values())
+        if len(counts) > 1:
+            raise ValueError("columns have different lengths")
+        self._export_wire(columns, counts.pop() if counts else 0)
+
+    def _export_wire(self, columns, count):
+        # Convert columns to the current template's wire layout, and export
+        if compat.get_numpy() is None:
+            raise ImportError("array export requires numpy")
+        tmpl = self.msg.templates[(self.msg.odid, self.curtid)]
+        if tmpl.varlenslice is not None:
+            raise IpfixEncodeError("can't export array with "+repr(tmpl)+
+                                   " with variable-length IEs")
+
+        self._export_many(message._wire_array(tmpl, columns, count),
+                          message.MessageBuffer.export_array)
+
     def flush(self):
         """
-        Export an in-progress Message immediately.
+        Export an in-progress Message immediately, and write any pending
+        messages.
         
         Used internally to manage message boundaries, but
         can also be used to force immediate export (e.g. to reduce delay
@@ -119,20 +340,49 @@ class MessageStreamWriter(object):
         a Writer before closing the underlying stream.
         """
         
+        self._next_message()
+        self._write_pending()
+
+    def _next_message(self):
+        # Finish the current message, and continue the current set in the
+        # next message
         setid = self.msg.cursetid
-        self.msg.write_message(self.stream)
-        self.msgcount += 1
+        self._finish_message()
         self.msg.begin_export()
         self.msg.export_ensure_set(setid)
 
-def to_stream(stream, mtu=65535):
+def _vector_write_fn(stream):
+    # Get a function writing a list of buffers to a stream in one system
+    # call, returning the number of bytes written, or None if the stream
+    # doesn't support it. Only sockets and raw, unbuffered files qualify;
+    # other streams with a file descriptor (buffered files, or compressed
+    # files wrapping one) must see every write through stream.write.
+    if isinstance(stream, socket.socket):
+        return stream.sendmsg
+    if not hasattr(os, "writev") or not isinstance(stream, io.FileIO):
+        return None
+    try:
+        fd = stream.fileno()
+    except (OSError, ValueError):
+        return None
+
+    def writev(views):
+        return os.writev(fd, views)
+    return writev
+
+def to_stream(stream, mtu=65535, coalesce_bytes=0, coalesce_delay=None):
     """
     Get a MessageStreamWriter for a given stream
     
-    :param stream: stream to write
+    :param stream: stream to write, or a connected socket
     :param mtu: maximum message size in bytes; defaults to 65535,
                 the largest possible ipfix message.
+    :param coalesce_bytes: if nonzero, write finished messages together
+                           once at least this many bytes are pending
+    :param coalesce_delay: if given with coalesce_bytes, also write pending
+                           messages once the oldest is this many seconds
+                           old
     :return: a :class:`MessageStreamWriter` wrapped around the stream.
 
     """
-    return MessageStreamWriter(stream, mtu)
+    return MessageStreamWriter(stream, mtu, coalesce_bytes, coalesce_delay)
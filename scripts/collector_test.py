@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
-import socketserver
-import ipfix.reader
+import asyncio
+import ipfix.collector
 import ipfix.ie
 
 import argparse
@@ -16,20 +16,17 @@ if args.spec:
     ipfix.ie.use_specfile(args.spec)
 
 
-class CollectorDictHandler(socketserver.StreamRequestHandler):
+reccounts = {}
 
-    def handle(self):
-        reccount = 0
+def print_records(session, recs):
+    for rec in recs:
+        reccount = reccounts.get(session.peer, 0)
+        reccounts[session.peer] = reccount + 1
+        print("--- record %u in message %u from %s---" %
+              (reccount, session.message_count, str(session.peer)))
+        for key in rec:
+             print("  %30s => %s" % (key, str(rec[key])))
 
-        print ("connection from "+str(self.client_address))
-        r = ipfix.reader.from_stream(self.rfile)
-        for rec in r.records_as_dict():
-            print("--- record %u in message %u from %s---" %
-                  (reccount, r.msgcount, str(self.client_address)))
-            reccount += 1
-            for key in rec:
-                 print("  %30s => %s" % (key, str(rec[key])))
 
-
-ss = socketserver.TCPServer(("", 4739), CollectorDictHandler)
-ss.serve_forever()
+c = ipfix.collector.for_tcp(print_records, port=4739)
+asyncio.run(c.serve_forever())
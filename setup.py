@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 
-from __future__ import with_statement
 from setuptools import setup
 from io import open
 
@@ -9,21 +8,23 @@ with open('README.txt') as file:
 
 setup(name='ipfix',
       version='0.9.8',
-      description='IPFIX implementation for Python 3.3+',
+      description='IPFIX implementation for Python 3.7+',
       long_description = long_description,
       author='Brian Trammell',
       author_email='brian@trammell.ch',
       url='http://github.com/britram/python-ipfix',
       packages=['ipfix'],
       package_data={'ipfix': ['iana.iespec', 'rfc5103.iespec']},
-      scripts=['scripts/ipfix2csv', 'scripts/ipfixstat'],
+      scripts=['scripts/ipfix2csv', 'scripts/ipfixstat',
+               'scripts/ipfixindex'],
       classifiers=["Development Status :: 3 - Alpha",
                    "Intended Audience :: Developers",
                    "License :: OSI Approved :: "
                    "GNU Lesser General Public License v3 or later (LGPLv3+)",
                    "Operating System :: OS Independent",
-                   "Programming Language :: Python :: 3.3",
+                   "Programming Language :: Python :: 3.7",
                    "Topic :: System :: Networking"],
+      python_requires='>=3.7',
       tests_require=['nose', 'coverage', 'doctest-ignore-unicode'],
       )
       